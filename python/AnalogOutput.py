@@ -15,10 +15,11 @@ logger = logging.getLogger(__name__)
 
 from cs_errors import PauseError
 
-from atom.api import Typed, Member, Int, Str
+from atom.api import Typed, Member, Int, Str, Bool
 from instrument_property import BoolProp, FloatProp, StrProp
 from cs_instruments import Instrument
 import numpy as np
+import timeline
 
 
 class AnalogOutput(Instrument):
@@ -41,10 +42,13 @@ class AnalogOutput(Instrument):
     numChannels = Int(6)
 
     # properties for functional waveforms
-    transition_list = Member()  # list that will store the transitions as they are added
+    transition_list = Member()  # TransitionBuffer that will store the transitions as they are added
     values = Member()  # an array of the compiled transition values
     times = Member()  # an array of the compiled transition times
     transitions = Member()
+    serializer = Member()  # remembers the formatted waveform from previous iterations
+    parsed_key = Member()  # the transitions and sample rate that were last compiled
+    defer_compile = Bool()  # set while LabView evaluates, which then compiles the outputs in parallel
 
     def __init__(self, experiment):
         super(AnalogOutput, self).__init__('AnalogOutput', experiment)
@@ -68,7 +72,8 @@ class AnalogOutput(Instrument):
                             'exportStartTriggerDestination', 'useExternalClock', 'externalClockSource',
                             'maxExternalClockRate', 'channel_descriptions']
         self.doNotSendToHardware += ['numChannels', 'units', 'channel_descriptions']
-        self.transition_list = []  # an empty list to store
+        self.transition_list = timeline.TransitionBuffer()  # an empty buffer to store
+        self.serializer = timeline.CachedSerializer()
 
     def add_transition(self, time, channel, value):
         """Append a transition to the list of transitions.  The values are not processed until evaluate is called.
@@ -80,44 +85,42 @@ class AnalogOutput(Instrument):
         """
         self.transition_list.append((time, channel, value))
 
+    def add_transitions(self, times, channels, values):
+        """Append many transitions at once, such as a whole ramp.
+        :param times: array of times, as in add_transition
+        :param channels: array of channel numbers, or a single channel for all
+        :param values: array of voltages, or a single value for all
+        :return: Nothing.
+        """
+        self.transition_list.extend(times, channels, values)
+
     def parse_transition_list(self):
+        # keep the compiled arrays if no transitions were added or cleared since they were compiled (the functional
+        # waveforms were not executed again) and the sample rate is the same
+        parsed_key = self.transition_list.state() + (self.clockRate.value*self.units.value, self.numChannels)
+        if parsed_key == self.parsed_key:
+            return
+        self.parsed_key = parsed_key
         if self.transition_list:
-            # put all the transitions that have been stored together into one big list
+            # get all the transitions that have been stored as arrays
             # keep the times as floats for now, they will be converted to integer samples after the sample rate is applied
-            times = np.array([i[0] for i in self.transition_list], dtype=np.float64)
-            # compile the channels
-            channels = np.array([i[1] for i in self.transition_list], dtype=np.uint8)
-            # compile the values
-            values = np.array([i[2] for i in self.transition_list], dtype=np.float32)
-
-            # sort the transitions time.  If there is a tie, preserve the order.
-            # mergesort is slower than the default quicksort, but it is 'stable'
-            # which means items of the same value are kept in their relative order, which is desired here
-            order = np.argsort(times, kind='mergesort')
-
-            # Create an array to store the compiled sample values
-            total_samples = int(np.rint(times[order[-1]]*self.clockRate.value*self.units.value)+1)
-            time_list = 1.0*np.arange(total_samples)/self.clockRate.value
-            value_list = np.zeros((total_samples, self.numChannels), dtype=np.float32)
-
-            # go through all the transitions, updating the compiled sequence as we go
-            # duplicate times are okay.  We want to allow that to allow sharp steps.
-            for i in order:
-                # evaluate the sample index equivalent to the transition time
-                index = np.rint(times[i]*self.clockRate.value*self.units.value).astype(np.uint64)
-                # for all samples >= index set it to the new value
-                try:
-                    value_list[index:, channels[i]] = values[i]
-                except Exception as e:
-                    logger.exception("probably invalid slice....... "
-                                     "Exception: {}".format(e))
-                    logger.info("index={}".format(index))
-                    raise PauseError
+            times, channels, values = self.transition_list.columns()
+
+            # sort the transitions by time and fill in the value of each channel at every sample.
+            # duplicate times are okay.  We want to allow that to allow sharp steps, the latter entry wins.
+            try:
+                value_list, sorted_times = timeline.compile_analog(
+                    times, channels, values, self.clockRate.value*self.units.value, self.numChannels)
+            except Exception as e:
+                logger.exception("probably invalid transition time....... "
+                                 "Exception: {}".format(e))
+                raise PauseError
+            time_list = 1.0*np.arange(len(value_list))/self.clockRate.value
 
             # update the exposed variables
             self.times = time_list
             self.values = value_list
-            self.transitions = times[order]*self.units.value  # used for plot xticks
+            self.transitions = sorted_times*self.units.value  # used for plot xticks
         else:
             # there are no stored transitions
             self.times = np.zeros(0, dtype=np.float64)
@@ -128,16 +131,16 @@ class AnalogOutput(Instrument):
         if self.enable and self.experiment.allow_evaluation:
             logger.debug('AnalogOutput.evaluate()')
             super(AnalogOutput, self).evaluate()
-            self.parse_transition_list()
-            # reset the transition list so it starts empty for the next usage
-            self.transition_list = []
+            # the transition list is emptied by the functional waveforms before they add to it
+            if not self.defer_compile:
+                self.parse_transition_list()
 
     def toHardware(self):
         """This overwrites Instrument.toHardware in order to add in the <waveform> which is not stored as a property.
         We transpose self.values because Labview expects the waveform with shape (channels, times)."""
         if self.enable:
             waveformXML = ('<waveform>'+
-                '\n'.join([' '.join([str(sample) for sample in channel]) for channel in self.values.T])+
+                self.serializer.text(self.values.T)+
                 '</waveform>\n')
 
             # then insert waveformXML into the output sent to LabView, in addition to the other properites
@@ -11,6 +11,7 @@ from atom.api import Member
 from cs_instruments import Instrument
 import numpy
 import json
+import hashlib
 import pprint
 import sys
 import ConfigParser
@@ -101,6 +102,10 @@ class Config(Instrument):
         except:
             logger.exception('Error saving config to hdf file.')
 
+    def settings_hash(self, memo):
+        # toHDF5 saves the config dictionary, which is not in the properties list
+        return hashlib.sha1(json.dumps(self.config_dict, sort_keys=True)).hexdigest()
+
     def fromHDF5(self, hdf):
         try:
             # read from hdf file
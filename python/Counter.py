@@ -21,6 +21,7 @@ from atom.api import Str, Float, Typed, Member, Bool, Int, List
 from cs_instruments import Instrument
 from instrument_property import Prop, ListProp
 from analysis import AnalysisWithFigure
+from array_buffers import GrowableArray
 from sklearn import mixture
 from scipy.optimize import curve_fit
 from scipy.special import erf
@@ -59,7 +60,14 @@ class Counter(Prop):
 
 
 class CounterAnalysis(AnalysisWithFigure):
-    counter_array = Member()
+    # running sum of the time series data for the iteration average, shape (shots, rois, bins)
+    counter_sum = Member()
+    # number of (sub-)measurements in counter_sum
+    counter_count = Int(0)
+    # time series data of the most recent (sub-)measurement, shape (shots, rois, bins)
+    counter_last = Member()
+    # preallocated storage for the per-measurement bin sums
+    binned_buffer = Member()
     binned_array = Member()
     meas_analysis_path = Str()
     meas_data_path = Str()
@@ -81,7 +89,15 @@ class CounterAnalysis(AnalysisWithFigure):
         self.properties += ['enable', 'drops', 'bins', 'shots', 'graph_roi','draw_fig','iterationonly']
 
     def preIteration(self, iterationResults, experimentResults):
-        self.counter_array = []
+        self.counter_sum = None
+        self.counter_count = 0
+        self.counter_last = None
+        # size the buffer for the expected number of measurements, it will grow if there are cut measurements
+        capacity = max(1, self.experiment.measurementsPerIteration)
+        if self.binned_buffer is None:
+            self.binned_buffer = GrowableArray(capacity=capacity)
+        else:
+            self.binned_buffer.reset(capacity=capacity)
         self.binned_array = None
 
     def format_data(self, array):
@@ -118,15 +134,12 @@ class CounterAnalysis(AnalysisWithFigure):
         # calculate the number of measurements contained in the raw data
         # there may be extra shots if we get branching implemented
         num_meas = num_shots//self.shots
-        # build a mask for removing valid data
-        shot_mask = ([False]*self.drops + [True]*self.bins)
-        good_shots = self.shots*num_meas
-        # mask for the roi
-        ctr_mask = np.array(shot_mask*good_shots + 0*shot_mask*(num_shots-good_shots), dtype='bool')
-        # apply mask a reshape partially
-        array = array[:, ctr_mask].reshape((rois, num_meas, self.shots, self.bins))
-        array = array.swapaxes(0, 1)  # swap rois and measurement axes
-        array = array.swapaxes(1, 2)  # swap rois and shots axes
+        good_bins = self.shots*num_meas*bins_per_shot
+        # reshape so that each shot is a row, then slice off the dropped bins.  This is a strided view, no copy is
+        # made until the data is summed.
+        array = array[:, :good_bins].reshape((rois, num_meas, self.shots, bins_per_shot))[..., self.drops:]
+        # order axes as (measurements, shots, rois, bins)
+        array = array.transpose((1, 2, 0, 3))
         return array
 
     def analyzeMeasurement(self, measurementResults, iterationResults, experimentResults):
@@ -153,8 +166,13 @@ class CounterAnalysis(AnalysisWithFigure):
             try:
                 # package data into an array with shape (sub measurements, shots, counters, time series data)
                 array = self.format_data(array)
-                # flatten the sub_measurements by converting top level to normal list and concatentating
-                self.counter_array += list(array)
+                # accumulate the sub_measurements for the iteration average display
+                if self.counter_sum is None:
+                    self.counter_sum = array.sum(axis=0, dtype=np.float64)
+                else:
+                    self.counter_sum += array.sum(axis=0)
+                self.counter_count += len(array)
+                self.counter_last = np.array(array[-1])
             except ValueError:
                 errmsg = "Error retrieving counter data.  Offending counter data shape: {}"
                 logger.exception(errmsg.format(array.shape))
@@ -164,17 +182,11 @@ class CounterAnalysis(AnalysisWithFigure):
             # write this cycle's data into hdf5 file so that the threshold analysis can read it
             # when multiple counter support is enabled, the ROIs parameter will hold the count
             # Note the constant 1 is for the roi column parameter, all counters get entered in a single row
-            n_meas, n_shots, n_rois, bins = array.shape
-            sum_array = array.sum(axis=3).reshape((n_meas, n_shots, n_rois, 1))
+            sum_array = array.sum(axis=3, keepdims=True)
             measurementResults[self.meas_analysis_path] = sum_array
             # put the sum data in the expected format for display
-            if self.binned_array is None:
-                self.binned_array = np.array([sum_array.reshape((n_meas, n_shots, n_rois))])
-            else:
-                self.binned_array = np.concatenate((
-                    self.binned_array,
-                    [sum_array.reshape((n_meas, n_shots, n_rois))]
-                ))
+            self.binned_buffer.append(sum_array[..., 0])
+            self.binned_array = self.binned_buffer.view()
         if not self.iterationonly:
             self.updateFigure()
 
@@ -254,13 +266,13 @@ class CounterAnalysis(AnalysisWithFigure):
                         # Average over all shots/iteration
                         ax2 = fig.add_subplot(222)
                         ptr = 0
-                        ca = np.array(self.counter_array)
+                        mean = self.counter_sum/self.counter_count
                         for s in range(self.shots):
                             xs = np.arange(ptr, ptr + self.bins)
-                            ax.bar(xs, ca[-1, s, self.graph_roi])
-                            ax2.bar(xs, ca[:, s, self.graph_roi].mean(0))
+                            ax.bar(xs, self.counter_last[s, self.graph_roi])
+                            ax2.bar(xs, mean[s, self.graph_roi])
                             ptr += max(1.05*self.bins, self.bins+1)
-                        ax.set_title('Measurement: {}'.format(len(ca)))
+                        ax.set_title('Measurement: {}'.format(self.counter_count))
                         ax2.set_title('Iteration average')
 
                         # time series of sum data
@@ -16,11 +16,12 @@ logger = logging.getLogger(__name__)
 
 
 import numpy as np
-from atom.api import Typed, Member, Int
+from atom.api import Typed, Member, Int, Bool
 
 from cs_instruments import Instrument
 from instrument_property import Prop, BoolProp, IntProp, FloatProp, StrProp, EnumProp
 from digital_waveform import NumpyChannels
+import timeline
 
 
 class StartTrigger(Prop):
@@ -48,11 +49,14 @@ class DAQmxDO(Instrument):
     numChannels = Int(8)
 
     # properties for functional waveforms
-    transition_list = Member()  # list that will store the transitions as they are added
+    transition_list = Member()  # TransitionBuffer that will store the transitions as they are added
     states = Member()  # an array of the compiled transition states
     indices = Member()  # an array of the compiled transitions times (in samples indexes)
     times = Member()  # an array of the compiled transition times (in seconds, for plotting)
     time_durations = Member()  # an array of the compiled transition durations (in seconds, for plotting)
+    serializer = Member()  # remembers the formatted waveform from previous iterations
+    parsed_key = Member()  # the transitions and sample rate that were last compiled
+    defer_compile = Bool()  # set while LabView evaluates, which then compiles the outputs in parallel
 
     def __init__(self, experiment):
         super(DAQmxDO, self).__init__('DAQmxDO', experiment)
@@ -65,7 +69,8 @@ class DAQmxDO(Instrument):
         # the number of channels is defined by the resourceName (and the waveform which must agree), so
         # channels need not be send to hardware
         self.doNotSendToHardware += ['units', 'channels', 'numChannels']
-        self.transition_list = []
+        self.transition_list = timeline.TransitionBuffer()
+        self.serializer = timeline.CachedSerializer()
 
     def evaluate(self):
         if self.experiment.allow_evaluation:
@@ -76,9 +81,9 @@ class DAQmxDO(Instrument):
         if self.enable and self.experiment.allow_evaluation:
             logger.debug('DAQmxDO.evaluate()')
             super(DAQmxDO, self).evaluate()
-            self.parse_transition_list()
-            # reset the transition list so it starts empty for the next usage
-            self.transition_list = []
+            # the transition list is emptied by the functional waveforms before they add to it
+            if not self.defer_compile:
+                self.parse_transition_list()
 
     def add_transition(self, time, channel, state):
         """Append a transition to the list of transitions.  The values are not processed until evaluate is called.
@@ -90,38 +95,28 @@ class DAQmxDO(Instrument):
         """
         self.transition_list.append((time, channel, state))
 
+    def add_transitions(self, times, channels, states):
+        """Append many transitions at once, such as a whole pulse train.
+        :param times: array of times, as in add_transition
+        :param channels: array of channel numbers, or a single channel for all
+        :param states: array of bools, or a single state for all
+        :return: Nothing.
+        """
+        self.transition_list.extend(times, channels, states)
+
     def parse_transition_list(self):
+        # keep the compiled arrays if no transitions were added or cleared since they were compiled (the functional
+        # waveforms were not executed again) and the sample rate is the same
+        parsed_key = self.transition_list.state() + (self.clockRate.value*self.units.value, self.numChannels)
+        if parsed_key == self.parsed_key:
+            return
+        self.parsed_key = parsed_key
         if self.transition_list:
-            # put all the transitions that have been stored together into one big list
-            # convert the float time to an integer number of samples
-            indices = np.rint(np.array([i[0] for i in self.transition_list], dtype=np.float64)*self.clockRate.value*self.units.value).astype(np.uint64)
-            # compile the channels
-            channels = np.array([i[1] for i in self.transition_list], dtype=np.uint8)
-            # compile the states
-            states = np.array([i[2] for i in self.transition_list], dtype=np.bool)
-
-            # Create two arrays to store the compiled times and states.
-            # These arrays will be appended to to increase their size as we go along.
-            index_list = np.zeros(1, dtype=np.uint64)
-            state_list = np.zeros((1, self.numChannels), dtype=np.bool)
-
-            # sort the transitions time.  If there is a tie, preserve the order.
-            # mergesort is slower than the default quicksort, but it is 'stable' which means items of the same value are kept in their relative order, which is desired here
-            order = np.argsort(indices, kind='mergesort')
-
-            # go through all the transitions, updating the compiled sequence as we go
-            for i in order:
-                # check to see if the next time is the same as the last one in the time list
-                if indices[i] == index_list[-1]:
-                    # if this is a duplicate time, the latter entry overrides
-                    state_list[-1][channels[i]] = states[i]
-                else:
-                    # If this is a new time, increase the length of time_list and state_list.
-                    # Create the new state_list entry by copying the last entry.
-                    index_list = np.append(index_list, indices[i])
-                    state_list = np.append(state_list, state_list[-1, np.newaxis], axis=0)
-                    # then update the last entry
-                    state_list[-1, channels[i]] = states[i]
+            # get all the transitions that have been stored as arrays
+            times, channels, states = self.transition_list.columns()
+
+            # sort and compress the transitions into one segment per distinct sample index.  If there is a tie the latter entry overrides.
+            index_list, state_list, _ = timeline.compile_digital(times, channels, states, self.clockRate.value*self.units.value, self.numChannels)
 
             # the DAQmx hardware requires at least 2 samples
             if len(index_list) < 2:
@@ -130,9 +125,7 @@ class DAQmxDO(Instrument):
                 state_list = np.append(state_list, state_list[-1, np.newaxis], axis=0)
 
             # find the duration of each segment
-            durations = np.empty_like(index_list)
-            durations[:-1] = index_list[1:]-index_list[:-1]
-            durations[-1] = 1  # add in a 1 sample duration at end for last transition
+            durations = timeline.segment_durations(index_list)
 
             # find the real time at each index (used for plotting)
             # leave this in seconds, don't use units so that the plot can apply its own units
@@ -153,8 +146,8 @@ class DAQmxDO(Instrument):
         if self.enable and (len(self.indices)>0):
             waveformXML = ('<waveform>'+
                 '<name>'+self.name+'</name>'+
-                '<transitions>'+' '.join([str(time) for time in self.indices])+'</transitions>'+
-                '<states>'+'\n'.join([' '.join([str(sample) for sample in state]) for state in self.states])+'</states>\n'+
+                '<transitions>'+self.serializer.text(self.indices)+'</transitions>'+
+                '<states>'+self.serializer.text(self.states)+'</states>\n'+
                 '</waveform>\n')
 
             # then upload scriptOut instead of script.toHardware, waveformXML instead of waveforms.toHardware (those toHardware methods will return an empty string and so will not interfere)
@@ -5,16 +5,21 @@ author=Matthew Ebert
 created=2017-04-25
 
 This instrument generates random data for testing purposes.
+
+FakeCamera, FakeCounter and FakeAnalogInput stand in for the camera, counter
+and analog input in the benchmark harness (test/benchmark_harness.py), with
+configurable data sizes and measurement times.
 """
 
 from __future__ import division
-from atom.api import Typed
+from atom.api import Typed, Float, Int, Member, Str
 from numpy.random import random_sample, randint
 import numpy as np
 from cs_instruments import Instrument
 from instrument_property import IntProp, FloatProp, FloatRangeProp
 from cs_errors import PauseError
 import time
+import threading
 
 __author__ = 'Matthew Ebert'
 import logging
@@ -115,3 +120,133 @@ class Embezzletron(Instrument):
 
     def gaussian(self, a, w, xy0, xy):
         return self.elliptical_gaussian(a, w, xy - xy0)
+
+
+class FakeDataInstrument(Instrument):
+    """A fake instrument that takes `period` seconds per measurement, and then writes one of a few made up data sets.
+
+    The data sets are made up once in initialize(), so that writeResults costs what storing real data of that size
+    costs, and not the time it takes to make it up.
+    """
+    period = Float()  # seconds from start() until the data is ready
+    data_sets = Int(8)  # number of different data sets to choose from
+    frames = Member()
+    timer = Member()
+
+    def __init__(self, name, experiment, description=''):
+        super(FakeDataInstrument, self).__init__(name, experiment, description)
+        self.properties += ['period', 'data_sets']
+
+    def initialize(self):
+        self.frames = [self.generate() for i in range(self.data_sets)]
+        self.isInitialized = True
+
+    def generate(self):
+        raise NotImplementedError
+
+    def frame(self):
+        return self.frames[randint(len(self.frames))]
+
+    def start(self):
+        if self.period > 0:
+            self.timer = threading.Timer(self.period, self.finish)
+            self.timer.start()
+        else:
+            self.isDone = True
+
+    def finish(self):
+        self.isDone = True
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+
+class FakeCamera(FakeDataInstrument):
+    """Stacks of images with a grid of gaussian atom spots, which are loaded at random in the first shot and kept
+    with probability `retention` in the following shots."""
+    shotsPerMeasurement = Typed(IntProp)
+    height = Int(128)
+    width = Int(128)
+    spacing = Int(8)  # pixels between the sites
+    sigma = Float(1.5)  # width of the spots in pixels
+    amplitude = Float(20)  # peak counts of an atom
+    background = Int(10)  # the background is uniform between 0 and background counts
+    loading = Float(.5)
+    retention = Float(.9)
+    data_group = Str('FakeCamera')
+
+    def __init__(self, name, experiment, description=''):
+        super(FakeCamera, self).__init__(name, experiment, description)
+        self.shotsPerMeasurement = IntProp('shotsPerMeasurement', experiment, 'number of expected shots', '2')
+        self.shotsPerMeasurement.value = 2
+        self.properties += ['shotsPerMeasurement', 'height', 'width', 'spacing', 'sigma', 'amplitude', 'background',
+                            'loading', 'retention']
+
+    def sites(self):
+        """The (row, column) pixel of each site, in ROI order, for the ROI grid of the experiment."""
+        rows, columns = np.indices((self.experiment.ROI_rows, self.experiment.ROI_columns))
+        return np.column_stack([rows.ravel(), columns.ravel()]) * self.spacing + self.spacing
+
+    def rois(self):
+        """A square (left, top, right, bottom) ROI around each site."""
+        half = self.spacing // 2
+        return [(c - half, r - half, c + half, r + half) for r, c in self.sites()]
+
+    def threshold(self):
+        """An ROI sum halfway between an empty site and one with an atom."""
+        pixels = self.spacing**2
+        atom = self.amplitude * 2 * np.pi * self.sigma**2
+        return int(pixels * (self.background - 1) / 2. + atom / 2.)
+
+    def generate(self):
+        shots = self.shotsPerMeasurement.value
+        sites = self.sites()
+        atoms = np.empty((shots, len(sites)), dtype=np.bool_)
+        atoms[0] = random_sample(len(sites)) < self.loading
+        for shot in range(1, shots):
+            atoms[shot] = atoms[shot - 1] & (random_sample(len(sites)) < self.retention)
+        grid = np.indices((self.height, self.width))
+        stack = randint(self.background, size=(shots, self.height, self.width)).astype(np.float64)
+        for i, site in enumerate(sites):
+            spot = self.amplitude * np.exp(-0.5 * np.sum((grid - site[:, None, None])**2, axis=0) / self.sigma**2)
+            stack[atoms[:, i]] += spot
+        return np.rint(stack).astype(np.uint16)
+
+    def writeResults(self, hdf5):
+        for i, shot in enumerate(self.frame()):
+            hdf5['{}/shots/{}'.format(self.data_group, i)] = shot
+
+
+class FakeCounter(FakeDataInstrument):
+    """Poisson counts in time bins, of shape (bins, counters), at 'counter/data' as the counter instrument stores
+    them."""
+    counters = Int(1)
+    bins = Int(1000)
+    rate = Float(1)  # mean counts per bin
+
+    def __init__(self, name, experiment, description=''):
+        super(FakeCounter, self).__init__(name, experiment, description)
+        self.properties += ['counters', 'bins', 'rate']
+
+    def generate(self):
+        return np.random.poisson(self.rate, size=(self.bins, self.counters)).astype(np.uint32)
+
+    def writeResults(self, hdf5):
+        hdf5['counter/data'] = self.frame()
+
+
+class FakeAnalogInput(FakeDataInstrument):
+    """Noisy traces of shape (channels, samples) at 'AI/data', as the analog input stores them."""
+    channels = Int(8)
+    samples = Int(1000)
+
+    def __init__(self, name, experiment, description=''):
+        super(FakeAnalogInput, self).__init__(name, experiment, description)
+        self.properties += ['channels', 'samples']
+
+    def generate(self):
+        return np.random.normal(size=(self.channels, self.samples))
+
+    def writeResults(self, hdf5):
+        hdf5['AI/data'] = self.frame()
@@ -17,11 +17,12 @@ import dicttoxml
 
 from cs_errors import PauseError
 
-from atom.api import Typed, Member, Int
+from atom.api import Typed, Member, Int, Bool
 
 from instrument_property import Prop, BoolProp, IntProp, FloatProp, StrProp, ListProp
 from cs_instruments import Instrument
 from digital_waveform import NumpyChannels
+import timeline
 
 
 __author__ = 'Martin Lichtman'
@@ -86,7 +87,7 @@ class HSDIO(Instrument):
     startTrigger = Member()
 
     # properties for functional waveforms
-    transition_list = Member()  # list that will store the transitions as they are added
+    transition_list = Member()  # TransitionBuffer that will store the transitions as they are added
     states = Member()  # an array of the compiled transition states
     indices = Member()  # an array of the compiled transition indices
     times = Member()  # an array of the compiled transition times
@@ -97,6 +98,9 @@ class HSDIO(Instrument):
     repeat_list = Member()
     repeats = Member()
     complex_waveform_counter = Int(0)
+    serializer = Member()  # remembers the formatted states from previous iterations
+    parsed_key = Member()  # the transitions and sample rate that were last compiled
+    defer_compile = Bool()  # set while LabView evaluates, which then compiles the outputs in parallel
 
     def __init__(self, name, experiment):
         super(HSDIO, self).__init__(name, experiment)
@@ -128,17 +132,18 @@ class HSDIO(Instrument):
         ]
         # script and waveforms are handled specially in HSDIO.toHardware()
         self.doNotSendToHardware += ['units', 'numChannels']
-        self.transition_list = []  # an empty list to store
+        self.transition_list = timeline.TransitionBuffer()  # an empty buffer to store
         self.repeat_list = []
+        self.serializer = timeline.CachedSerializer()
 
     def evaluate(self):
         """Prepare the instrument."""
         if self.enable and self.experiment.allow_evaluation:
             logger.debug('HSDIO.evaluate()')
             super(HSDIO, self).evaluate()
-            self.parse_transition_list()
-            # reset the transition list so it starts empty for the next usage
-            self.transition_list = []
+            # the transition list is emptied by the functional waveforms before they add to it
+            if not self.defer_compile:
+                self.parse_transition_list()
 
     def add_transition(self, time, channel, state):
         """Append a transition to the list of transitions.
@@ -152,6 +157,16 @@ class HSDIO(Instrument):
         """
         self.transition_list.append((time, channel, state))
 
+    def add_transitions(self, times, channels, states):
+        """Append many transitions at once, such as a whole pulse train.
+
+        :param times: array of times, as in add_transition
+        :param channels: array of channel numbers, or a single channel for all
+        :param states: array of bools, or a single state for all
+        :return: Nothing.
+        """
+        self.transition_list.extend(times, channels, states)
+
     def add_repeat(self, time, function, repeats):
         """Add a repeat loop to the script to take advantage of the HSDIO's builtin "Repeat" functionality.
 
@@ -216,73 +231,38 @@ class HSDIO(Instrument):
             logger.error("Overlapping repeats. Repeats cannot be overlapped, even if they affect different channels.")
             raise PauseError
 
-        # tag the repeated transitions in the transition_list
-        for idx in xrange(start_index, stop_index):
-            # add entries to the tuple with the cycle dict
-            self.transition_list[idx] += (cycle_dict,)
+        # tag the repeated transitions in the transition_list with the cycle dict
+        self.transition_list.tag(start_index, stop_index, cycle_dict)
         return time + dt*repeats
 
     def parse_transition_list(self):
         """Turn requested transitions into a list of states and delays."""
+        # keep the compiled arrays if no transitions were added or cleared since they were compiled (the functional
+        # waveforms were not executed again) and the sample rate is the same
+        parsed_key = self.transition_list.state() + (self.clockRate.value*self.units.value, self.numChannels)
+        if parsed_key == self.parsed_key:
+            return
+        self.parsed_key = parsed_key
         if self.transition_list:
-            # put all the transitions that have been stored together into one big list
-            # convert the float time to an integer number of samples
-            indices = np.rint(
-                np.array(
-                    [i[0] for i in self.transition_list],
-                    dtype=np.float64)*self.clockRate.value*self.units.value
-            ).astype(np.uint64)
-            # compile the channels
-            channels = np.array([i[1] for i in self.transition_list], dtype=np.uint8)
-            # compile the states
-            states = np.array([i[2] for i in self.transition_list], dtype=np.bool)
-            # keep track of repeats, [ -1 -1 -1 (cycle_dict, 0) (cycle_dict, 1) ... -1 -1]
-            # -1 is non-repeat, a tuple with cycle info dict and the cycle index is inserted for each
-            # cycle transition
-            repeats = [-1 if len(i) < 4 else i[3] for i in self.transition_list]
-
-            # Create two arrays to store the compiled times and states.
-            # These arrays will be appended to to increase their size as we go along.
-            index_list = np.zeros(1, dtype=np.uint64)
-            state_list = np.zeros((1, self.numChannels), dtype=np.bool)
-            repeat_list = [-1]
-
-            # sort the transitions time.  If there is a tie, preserve the order.
-            # mergesort is slower than the default quicksort, but it is 'stable'
-            # which means items of the same value are kept in their relative order, which is desired here
-            order = np.argsort(indices, kind='mergesort')
-
-            # go through all the transitions, updating the compiled sequence as we go
-            cycle_idx = 0
-            for i in order:
-                if len(self.transition_list[i]) > 3:
-                    logger.debug("repeat cycle: {} detected at index: "
-                                 "{}".format(self.transition_list[i], i))
-                # check to see if the next time is the same as the last one in the time list
-                if indices[i] == index_list[-1]:
-                    # if this is a duplicate time, the latter entry overrides
-                    state_list[-1][channels[i]] = states[i]
-                else:
-                    # If this is a new time, increase the length of time_list and state_list.
-                    # Create the new state_list entry by copying the last entry.
-                    index_list = np.append(index_list, indices[i])
-                    state_list = np.append(state_list, state_list[-1, np.newaxis], axis=0)
-                    # then update the last entry
-                    state_list[-1, channels[i]] = states[i]
-                    # compress the repeats list along with the others
-                    repeat_list.append(-1)
-                    if repeats[i] != -1:
-                        # need a compressed cycle index
-                        repeat_list[-1] = repeats[i]
-                        cycle_idx += 1
-                    else:
-                        # reset the cycle index if not in a repeat cycle
-                        cycle_idx = 0
+            # get all the transitions that have been stored as arrays
+            times, channels, states = self.transition_list.columns()
+            # keep track of repeats, the position in the tags of the cycle each transition belongs to, or -1 if it
+            # is non-repeat
+            repeats = self.transition_list.tag_positions()
+            cycles = self.transition_list.tags
+
+            # sort and compress the transitions into one segment per distinct sample index.  If there is a tie the
+            # latter entry overrides.
+            index_list, state_list, first = timeline.compile_digital(
+                times, channels, states, self.clockRate.value*self.units.value, self.numChannels
+            )
+            # compress the repeats list along with the others, a segment is part of a repeat if the transition that
+            # started it is
+            # [ -1 -1 -1 cycle_dict cycle_dict ... -1 -1]
+            repeat_list = [-1] + [-1 if repeats[i] < 0 else cycles[repeats[i]][2] for i in first[1:]]
 
             # find the duration of each segment
-            durations = np.empty_like(index_list)
-            durations[:-1] = index_list[1:]-index_list[:-1]
-            durations[-1] = 1  # add in a 1 sample duration at end for last transition
+            durations = timeline.segment_durations(index_list)
 
             # find the real time at each index (used for plotting)
             # send values in seconds, do not use units, so that the plot can apply its own units
@@ -603,6 +583,8 @@ class HSDIO(Instrument):
                              'make sure HSDIO Repeat calls do not overlap')
                 raise PauseError
 
+            # the channel states of each transition as '0 1 ...' strings
+            state_strings = self.serializer.rows(self.states.astype(np.uint8))
             # list of indicies and waitTimes to be added to a single waveform
             transition_list = []
             # repeat cycle state info
@@ -615,7 +597,7 @@ class HSDIO(Instrument):
                 transition_list.append({
                     'index': i,
                     'waitTime': waitTime,
-                    'state': ' '.join([str(int(state)) for state in self.states[i]])
+                    'state': state_strings[i]
                 })
                 #print("transition_list(1) is: ",transition_list)
 
@@ -19,9 +19,11 @@ from cs_errors import PauseError
 
 import TCP, HSDIO, piezo, RF_generators, AnalogOutput, AnalogInput, DAQmxDO, Camera, TTL, Counter
 from atom.api import Bool, Str, Member, Typed
-from instrument_property import FloatProp
+from instrument_property import FloatProp, IntProp
 from cs_instruments import Instrument
-import numpy, struct, traceback, threading
+from instrument_workers import call_in_parallel
+import numpy, struct, traceback, threading, time
+from multiprocessing import Pool
 
 def toBool(x):
     if (x == 'False') or (x == 'false'):
@@ -55,6 +57,14 @@ class LabView(Instrument):
     error = Bool()
     log = Str()
     cycleContinuously = Member()
+    compile_processes = Typed(IntProp)
+    compile_pool = Member()  # processes that format the output waveforms, if compile_processes > 0
+    compile_workers = Member()  # a persistent thread for each output instrument
+    compile_timings = Member()  # seconds each output instrument took to compile in the last evaluate
+    hardware_cache = Member()  # the output instruments' toHardware, computed in parallel before the rest
+
+    # the instruments that compile waveforms, by property name
+    output_names = ['HSDIO', 'AnalogOutput', 'DAQmxDO']
 
     def __init__(self, experiment):
         super(LabView, self).__init__('LabView', experiment, 'for communicating with a LabView system')
@@ -76,6 +86,9 @@ class LabView(Instrument):
         self.camera = Camera.HamamatsuC9100_13(experiment)
         self.TTL = TTL.TTL(experiment)
         self.results = {}
+        self.compile_workers = {}
+        self.compile_timings = {}
+        self.hardware_cache = {}
 
         self.instruments = [self.HSDIO, self.piezo, self.RF_generators, self.AnalogOutput, self.AnalogInput,
                             self.Counters, self.DAQmxDO, self.camera, self.TTL]
@@ -84,10 +97,13 @@ class LabView(Instrument):
         self.connected = False
 
         self.timeout = FloatProp('timeout', experiment, 'how long before LabView gives up and returns [s]', '1.0')
+        self.compile_processes = IntProp('compile_processes', experiment,
+                                         'processes for formatting the output waveforms (0 = in the worker threads)', '0')
 
         self.properties += ['IP', 'port', 'timeout', 'AnalogOutput', 'AnalogInput', 'HSDIO',
-                            'piezo', 'RF_generators', 'DAQmxDO', 'camera', 'TTL', 'Counters', 'cycleContinuously']
-        self.doNotSendToHardware += ['IP', 'port', 'enable']
+                            'piezo', 'RF_generators', 'DAQmxDO', 'camera', 'TTL', 'Counters', 'cycleContinuously',
+                            'compile_processes']
+        self.doNotSendToHardware += ['IP', 'port', 'enable', 'compile_processes']
 
     def openThread(self):
         thread = threading.Thread(target=self.initialize)
@@ -286,7 +302,64 @@ class LabView(Instrument):
         self.isDone = True
         return results
 
+    def output_instruments(self):
+        return [getattr(self, name) for name in self.output_names]
+
     def evaluate(self):
         if self.experiment.allow_evaluation:
             logger.debug('LabView.evaluate()')
-            return super(LabView, self).evaluate()
+            # the output instruments are compiled together once all the properties are evaluated
+            outputs = self.output_instruments()
+            for instrument in outputs:
+                instrument.defer_compile = True
+            try:
+                result = super(LabView, self).evaluate()
+                if not self.enable:
+                    # Instrument.evaluate skips the properties of a disabled LabView, but the outputs are still
+                    # evaluated so that the waveform graphs show them.  Only sending them to the hardware depends on
+                    # LabView.enable.
+                    for instrument in outputs:
+                        instrument.evaluate()
+            finally:
+                for instrument in outputs:
+                    instrument.defer_compile = False
+            self.compile_outputs([i for i in outputs if i.enable])
+            return result
+
+    def set_compile_pool(self):
+        """Start or stop the formatting processes to match compile_processes, and hand them to the outputs."""
+        processes = self.compile_processes.value
+        if (self.compile_pool is not None) and (processes != self.compile_pool._processes):
+            self.compile_pool.terminate()
+            self.compile_pool = None
+        if (self.compile_pool is None) and (processes > 0):
+            self.compile_pool = Pool(processes)
+        for instrument in self.output_instruments():
+            instrument.serializer.pool = self.compile_pool
+
+    def compile_outputs(self, instruments):
+        """Compile the transitions of each output instrument on its own worker, so that the time taken is that of
+        the slowest instrument rather than the sum of them."""
+        self.set_compile_pool()
+        start = time.time()
+        results = call_in_parallel(instruments, self.compile_workers, 'parse_transition_list')
+        self.compile_timings = {i.name: elapsed for i, result, elapsed in results}
+        logger.debug('Compiled the outputs in {:.3f} s ({}).'.format(time.time() - start, ', '.join(
+            '{} {:.3f} s'.format(name, elapsed) for name, elapsed in sorted(self.compile_timings.items()))))
+
+    def toHardware(self):
+        """Format the waveforms of the output instruments in parallel, then put together the XML for all the
+        instruments in the usual order."""
+        if not self.enable:
+            return super(LabView, self).toHardware()
+        results = call_in_parallel(self.output_instruments(), self.compile_workers, 'toHardware')
+        self.hardware_cache = {name: xml for name, (i, xml, elapsed) in zip(self.output_names, results)}
+        try:
+            return super(LabView, self).toHardware()
+        finally:
+            self.hardware_cache = {}
+
+    def HardwareProtocol(self, o, name):
+        if name in self.hardware_cache:
+            return self.hardware_cache[name]
+        return super(LabView, self).HardwareProtocol(o, name)
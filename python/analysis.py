@@ -6,7 +6,9 @@ logger = logging.getLogger(__name__)
 from cs_errors import PauseError
 
 import numpy as np
+import h5py
 import threading, traceback, time
+from collections import OrderedDict
 
 import matplotlib as mpl
 mpl.use('PDF')
@@ -26,7 +28,10 @@ from scipy.optimize import curve_fit
 from colors import my_cmap
 
 from instrument_property import Prop
+from array_buffers import GrowableArray
 import cs_evaluate
+import scan_planner
+from stage_profiler import profiler
 
 def mpl_rectangle(ax, ROI):
     """Draws a rectangle, for use in drawing ROIs on images."""
@@ -57,6 +62,22 @@ def mpl_rectangle(ax, ROI):
     patch = patches.PathPatch(path, edgecolor='orange', facecolor='none', lw=1)
     ax.add_patch(patch)
 
+
+def plot_stride(n, max_points):
+    """Returns the stride to use when plotting n points so that no more than
+    max_points are drawn.  Drawing every point of a long run makes the figure
+    update slower than the data comes in."""
+    if (max_points <= 0) or (n <= max_points):
+        return 1
+    return int(np.ceil(n/max_points))
+
+
+def plot_points(n, max_points):
+    """Returns a slice of every plot_stride(n, max_points)-th of n points,
+    lined up so that the newest point is always drawn."""
+    step = plot_stride(n, max_points)
+    return slice((n - 1) % step if n else 0, None, step)
+
 class Analysis(Prop):
     """This is the parent class for all data analyses.  New analyses should subclass off this,
     and redefine at least one of preExperiment(), preIteration(), postMeasurement(), postIteration() or
@@ -173,7 +194,8 @@ class Analysis(Prop):
             (measurementResults, iterationResults, experimentResults),  # args
             (self.experiment.iteration, self.experiment.measurement),  # status
             self.name,
-            callback        # callback function
+            callback,        # callback function
+            time.time()     # when it was queued
         ]
         # see if we can thread this analysis
         if self.queueAfterMeasurement:
@@ -191,7 +213,8 @@ class Analysis(Prop):
                 self.measurementQueue.append(m_data)
 
         else:
-            result = self.analyzeMeasurement(*m_data[1])
+            with profiler.span('analyzeMeasurement ' + self.name):
+                result = self.analyzeMeasurement(*m_data[1])
             # update the analysis status
             self.analysisStatus = m_data[2]
             callback(result)
@@ -210,11 +233,14 @@ class Analysis(Prop):
                         logger.debug('dep: `{}` satisfied'.format(dep.name))
                     msg = '`{}` processing data from {}:{} (iter:meas)'
                     logger.debug(msg.format(self.name, *m_data[2]))
+                    # the time waiting for the queue and the dependencies
+                    profiler.record('queue ' + self.name, m_data[5], time.time() - m_data[5])
 
                     result = 0
                     try:
                         # use the function pointer that was stored in the list
-                        result = m_data[0](*m_data[1])
+                        with profiler.span('analyzeMeasurement ' + self.name):
+                            result = m_data[0](*m_data[1])
                     except:
                         msg = (
                             'Measurement analysis thread encountered an error'
@@ -252,8 +278,9 @@ class Analysis(Prop):
         (iter, meas) = status
         # synchronize iteration
         while (dep.analysisStatus[0] < iter) or (dep.analysisStatus[1] < meas):
-            # wait until woken up by dependent analysis
-            self.restart.wait()
+            # wait until woken up by dependent analysis.  The wake up is missed if it comes between the check and the
+            # wait, so check again every so often.
+            self.restart.wait(.1)
 
     def analyzeMeasurement(self, measurementResults, iterationResults, experimentResults):
         """This is called after each measurement.
@@ -265,6 +292,13 @@ class Analysis(Prop):
         """
         pass
 
+    def standard_error(self):
+        """The running standard error of this analysis' result for the current iteration, or None if it has none.
+
+        Used by the experiment to decide when an iteration has enough measurements, when adaptiveMeasurements is on.
+        """
+        return None
+
     def postIteration(self, iterationResults, experimentResults):
         # block while any threaded measurements for this analysis finish
         if self.waitForMeasurements:
@@ -288,11 +322,13 @@ class Analysis(Prop):
                 # if a queue is already going, add to it, unless we can't tolerate being behind
                 self.iterationQueue.append((iterationResults, experimentResults))
         else:
-            self.analyzeIteration(iterationResults, experimentResults)
+            with profiler.span('analyzeIteration ' + self.name):
+                self.analyzeIteration(iterationResults, experimentResults)
 
     def iterationProcessLoop(self):
         while len(self.iterationQueue) > 0:
-            self.analyzeIteration(*self.iterationQueue.pop(0))  # process the oldest element
+            with profiler.span('analyzeIteration ' + self.name):
+                self.analyzeIteration(*self.iterationQueue.pop(0))  # process the oldest element
         self.iterationProcessing = False
 
     def analyzeIteration(self, iterationResults, experimentResults):
@@ -515,6 +551,13 @@ class ShotsBrowserAnalysis(AnalysisWithFigure):
     experimentResults=Member()
     showROIs = Bool(False)
     data_path = Member()
+    # maps a tuple of ivar indices to an iteration number
+    iteration_index = Member()
+    # least recently used cache of shot images, keyed by (iteration, measurement, shot)
+    image_cache = Member()
+    cache_size = Int(64)
+    # a results file opened for browsing, closed when another is opened or an experiment starts
+    opened_file = Member()
 
     def __init__(self, experiment):
         super(ShotsBrowserAnalysis, self).__init__(
@@ -524,15 +567,72 @@ class ShotsBrowserAnalysis(AnalysisWithFigure):
         )
         self.data_path = 'data/' + self.experiment.Config.config.get('CAMERA', 'DataGroup') + '/shots'
         self.properties += ['measurement', 'shot', 'showROIs']
+        self.iteration_index = {}
+        self.image_cache = OrderedDict()
 
     def preExperiment(self, experimentResults):
         # call therading setup code
         super(ShotsBrowserAnalysis, self).preExperiment(experimentResults)
+        self.close_results()
         self.experimentResults = experimentResults
+        # the experiment adds to this index as it creates iterations
+        self.iteration_index = self.experiment.iterationIndex
+        self.image_cache = OrderedDict()
         self.ivarValueLists = [i for i in self.experiment.ivarValueLists]  # this line used to access the hdf5 file, but I have temporarily removed ivarValueLists from the HDF5 because it could not handle arbitrary lists of lists
         self.selection = [0]*len(self.ivarValueLists)
         deferred_call(setattr, self, 'ivarNames', [i for i in experimentResults.attrs['ivarNames']])
 
+    def open_path(self, path):
+        """Open the results file at path for browsing."""
+        try:
+            f = h5py.File(path, 'r')
+        except Exception as e:
+            logger.warning('Could not open results file {} in ShotsBrowserAnalysis.open_path():\n{}'.format(path, e))
+            raise PauseError
+        self.close_results()
+        self.opened_file = f
+        self.open_results(f)
+
+    def close_results(self):
+        if self.opened_file is not None:
+            if self.experimentResults == self.opened_file:
+                self.experimentResults = None
+            self.opened_file.close()
+            self.opened_file = None
+
+    def open_results(self, experimentResults):
+        """Browse a previously saved results file."""
+        self.experimentResults = experimentResults
+        self.iteration_index = self.index_from_hdf5(experimentResults)
+        self.image_cache = OrderedDict()
+        self.ivarNames = [i for i in experimentResults.attrs['ivarNames']]
+        if 'scan_plan' in experimentResults:
+            self.ivarValueLists = scan_planner.value_lists(experimentResults['scan_plan'][()])
+        else:
+            # without the scan plan, the values are not saved, so list the indices instead
+            steps = [0]*len(self.ivarNames)
+            for key in self.iteration_index:
+                steps = [max(n, i + 1) for n, i in zip(steps, key)]
+            self.ivarValueLists = [range(n) for n in steps]
+        self.selection = [0]*len(self.ivarNames)
+        self.load()
+
+    @staticmethod
+    def index_from_hdf5(experimentResults):
+        """Rebuild the ivar index -> iteration lookup from a results file.
+
+        Uses the iteration_index table written by the experiment, or for files that predate it, reads the ivarIndex
+        attribute of every iteration once.
+        """
+        index = {}
+        if 'iteration_index' in experimentResults:
+            for row in experimentResults['iteration_index'][()]:
+                index.setdefault(tuple(int(i) for i in row[1:]), int(row[0]))
+        elif 'iterations' in experimentResults:
+            for i in experimentResults['iterations'].itervalues():
+                index.setdefault(tuple(int(j) for j in i.attrs['ivarIndex']), int(i.attrs['iteration']))
+        return index
+
     def setIteration(self,ivarIndex,index):
         try:
             self.selection[ivarIndex] = index
@@ -545,24 +645,35 @@ class ShotsBrowserAnalysis(AnalysisWithFigure):
     def reload(self,change):
         self.load()
 
+    def get_shot(self, iteration, measurement, shot):
+        """Returns the image for a shot, from the cache if it has been viewed recently."""
+        key = (iteration, measurement, shot)
+        array = self.image_cache.pop(key, None)
+        if array is None:
+            path = 'iterations/{}/measurements/{}/{}/{}'.format(iteration, measurement, self.data_path, shot)
+            array = self.experimentResults[path][()]
+        if (self.experimentResults == self.experiment.hdf5) and (iteration == self.experiment.iteration):
+            # measurements in the running iteration can still be deleted and retaken, so do not cache them
+            return array
+        # (re)insert as the most recently used
+        self.image_cache[key] = array
+        while len(self.image_cache) > self.cache_size:
+            self.image_cache.popitem(last=False)
+        return array
+
     def load(self):
         if self.experimentResults is not None:
-            # find the first matching iteration
-            m = str(self.measurement)
-            s = str(self.shot)
-            if 'iterations' in self.experimentResults:
-                for i in self.experimentResults['iterations'].itervalues():
-                    # find the first iteration that matches all the selected
-                    # ivar indices
-                    if np.all(i.attrs['ivarIndex'] == self.selection):
-                        try:
-                            path = 'measurements/{}' + self.data_path + '{}'
-                            self.array = i[path.format(m, s)]
-                            self.updateFigure()
-                        except Exception as e:
-                            logger.warning('Exception trying to plot measurement {}, shot {}, in analysis.ShotsBrowserAnalysis.load()\n{}\n'.format(m, s, e))
-                            self.blankFigure()
-                        break
+            # find the first iteration that matches all the selected ivar indices
+            iteration = self.iteration_index.get(tuple(int(i) for i in self.selection))
+            if iteration is not None:
+                m = self.measurement
+                s = self.shot
+                try:
+                    self.array = self.get_shot(iteration, m, s)
+                    self.updateFigure()
+                except Exception as e:
+                    logger.warning('Exception trying to plot measurement {}, shot {}, in analysis.ShotsBrowserAnalysis.load()\n{}\n'.format(m, s, e))
+                    self.blankFigure()
 
     def blankFigure(self):
         fig=self.backFigure
@@ -679,6 +790,12 @@ class MeasurementsGraph(AnalysisWithFigure):
     """Plots a region of interest sum after every measurement"""
     enable = Bool()
     data = Member()
+    # ring buffer holding the most recent history_length ROI sums
+    history = Member()
+    history_length = Int(10000)
+    # total number of measurements seen, including those that fell off the end of history
+    total_measurements = Int(0)
+    max_plot_points = Int(2000)
     update_lock = Bool(False)
     list_of_what_to_plot = Str()
     ROI_source = Member()
@@ -687,6 +804,7 @@ class MeasurementsGraph(AnalysisWithFigure):
         super(MeasurementsGraph, self).__init__(name, experiment, description)
         self.properties += ['enable', 'list_of_what_to_plot', 'ROI_source']
         self.data = None
+        self.history = GrowableArray(maxlen=self.history_length)
         # point analysis at the roi sum source
         self.ROI_source = getattr(
             self.experiment,
@@ -699,19 +817,26 @@ class MeasurementsGraph(AnalysisWithFigure):
         if self.enable:
             # every measurement, update a big array of all the ROI sums, then
             # histogram only the requested shot/site
-            d = measurementResults[self.ROI_source.meas_analysis_path]
-            if self.data is None:
-                self.data = np.array([d])
-            else:
-                self.data = np.append(self.data, np.array([d]), axis=0)
+            d = measurementResults[self.ROI_source.meas_analysis_path][()]
+            if (self.history.shape is not None) and (d.shape != self.history.shape):
+                # the ROI configuration changed, start over
+                self.clear_history()
+            self.history.append(d)
+            self.total_measurements += 1
+            self.data = self.history.view()
             self.updateFigure()
 
+    def clear_history(self):
+        self.history.reset()
+        self.total_measurements = 0
+        self.data = None
+
     @observe('list_of_what_to_plot')
     def reload(self, change):
         self.updateFigure()
 
     def clear(self):
-        self.data = None
+        self.clear_history()
         self.updateFigure()
 
     def updateFigure(self):
@@ -729,16 +854,20 @@ class MeasurementsGraph(AnalysisWithFigure):
                         except Exception as e:
                             logger.warning('Could not eval plotlist in MeasurementsGraph:\n{}\n'.format(e))
                             return
+                        # x axis is the measurement number since the last clear, decimated for long runs
+                        n = len(self.data)
+                        points = plot_points(n, self.max_plot_points)
+                        x = np.arange(self.total_measurements - n, self.total_measurements)[points]
                         #make one plot
                         ax = fig.add_subplot(111)
                         for i in plotlist:
                             try:
-                                data = self.data[:, i[0], 0, i[1]] #hardcoded '0' is to select the submeasurement No. 0
+                                data = self.data[points, i[0], 0, i[1]] #hardcoded '0' is to select the submeasurement No. 0
                             except:
                                 logger.warning('Trying to plot data that does not exist in MeasurementsGraph: shot {} roi {}'.format(i[0], i[1]))
                                 continue
                             label = '({},{})'.format(i[0], 0, i[1])
-                            ax.plot(data, 'o', label=label)
+                            ax.plot(x, data, 'o', label=label)
                         #add legend using the labels assigned during ax.plot()
                         ax.legend()
                     super(MeasurementsGraph, self).updateFigure()
@@ -753,7 +882,14 @@ class IterationsGraph(AnalysisWithFigure):
     enable = Bool()
     mean = Member()
     sigma = Member()
-    current_iteration_data = Member()
+    # one row per iteration, preallocated for the number of iterations in the experiment
+    mean_history = Member()
+    sigma_history = Member()
+    # Welford running mean and sum of squared deviations for the current iteration
+    n_measurements = Int(0)
+    running_mean = Member()
+    running_m2 = Member()
+    max_plot_points = Int(2000)
     update_lock = Bool(False)
     list_of_what_to_plot = Str()
     draw_connecting_lines = Bool()
@@ -778,11 +914,16 @@ class IterationsGraph(AnalysisWithFigure):
         # call therading setup code
         super(IterationsGraph, self).preExperiment(experimentResults)
         # erase the old data at the start of the experiment
+        capacity = max(1, self.experiment.totalIterations or 1)
+        self.mean_history = GrowableArray(capacity=capacity)
+        self.sigma_history = GrowableArray(capacity=capacity)
         self.mean = None
         self.sigma = None
 
     def preIteration(self, iterationResults, experimentResults):
-        self.current_iteration_data = None
+        self.n_measurements = 0
+        self.running_mean = None
+        self.running_m2 = None
 
     def analyzeMeasurement(self, measurementResults, iterationResults, experimentResults):
         # Check to see if we want to do anything with this data, based on the
@@ -792,36 +933,37 @@ class IterationsGraph(AnalysisWithFigure):
         if self.enable:  # and self.update_every_measurement:
             if (not self.add_only_filtered_data) or (('analysis/loading_filter' in measurementResults) and measurementResults['analysis/loading_filter'].value):
 
-                d = np.array([measurementResults['analysis/'+self.experiment.ROITypeString]])
+                d = np.array(measurementResults['analysis/'+self.experiment.ROITypeString], dtype=np.float64)
 
-                if self.current_iteration_data is None:
+                if self.n_measurements == 0:
                     # on first measurement of an iteration, start anew
                     new_iteration = True
-                    self.current_iteration_data = d
+                    self.running_mean = np.zeros_like(d)
+                    self.running_m2 = np.zeros_like(d)
                 else:
-                    # else append
                     new_iteration = False
-                    self.current_iteration_data = np.append(self.current_iteration_data, d, axis=0)
+
+                # update the running mean and variance in place, O(1) per measurement
+                self.n_measurements += 1
+                delta = d - self.running_mean
+                self.running_mean += delta/self.n_measurements
+                self.running_m2 += delta*(d - self.running_mean)
 
                 # average across measurements
-                # keepdims gives result with size (1 x shots X rois)
-                mean = np.mean(self.current_iteration_data, axis=0, keepdims=True)
+                mean = self.running_mean
                 # find standard deviation of the mean
-                sigma = np.std(self.current_iteration_data, axis=0, keepdims=True)/np.sqrt(len(self.current_iteration_data))
+                sigma = np.sqrt(self.running_m2/self.n_measurements)/np.sqrt(self.n_measurements)
 
-                if self.mean is None:
-                    # on first iteration start anew
-                    self.mean = mean
-                    self.sigma = sigma
+                if new_iteration:
+                    # append
+                    self.mean_history.append(mean)
+                    self.sigma_history.append(sigma)
                 else:
-                    if new_iteration:
-                        # append
-                        self.mean = np.append(self.mean, mean, axis=0)
-                        self.sigma = np.append(self.sigma, sigma, axis=0)
-                    else:
-                        # replace last entry
-                        self.mean[-1] = mean
-                        self.sigma[-1] = sigma
+                    # replace last entry
+                    self.mean_history.last()[...] = mean
+                    self.sigma_history.last()[...] = sigma
+                self.mean = self.mean_history.view()
+                self.sigma = self.sigma_history.view()
                 self.updateFigure()
 
     # TODO: this needs to be made to update at the iteration update
@@ -884,21 +1026,24 @@ class IterationsGraph(AnalysisWithFigure):
                         except Exception as e:
                             logger.warning('Could not eval plotlist in IterationsGraph:\n{}\n'.format(e))
                             return
+                        # decimate for long experiments
+                        points = plot_points(len(self.mean), self.max_plot_points)
+                        x = np.arange(len(self.mean))[points]
                         #make one plot
                         ax = fig.add_subplot(111)
                         for i in plotlist:
                             try:
-                                    mean = self.mean[:, i[0], 0, i[1]] # i[0] : shot, i[1]: submeasurement? , i[2] : roi
-                                    sigma = self.sigma[:, i[0], 0, i[1]]
+                                    mean = self.mean[points, i[0], 0, i[1]] # i[0] : shot, i[1]: submeasurement? , i[2] : roi
+                                    sigma = self.sigma[points, i[0], 0, i[1]]
                             except:
                                 logger.warning('Trying to plot data that does not exist in IterationsGraph: shot {} roi {}'.format(i[0], i[1]))
                                 continue
                             label = '(shot:{},roi:{})'.format(i[0],i[1])
                             linestyle = '-o' if self.draw_connecting_lines else 'o'
                             if self.draw_error_bars:
-                                ax.errorbar(np.arange(len(mean)), mean, yerr=sigma, fmt=linestyle, label=label)
+                                ax.errorbar(x, mean, yerr=sigma, fmt=linestyle, label=label)
                             else:
-                                ax.plot(np.arange(len(mean)), mean, linestyle, label=label)
+                                ax.plot(x, mean, linestyle, label=label)
                         #adjust the limits so that the data isn't right on the edge of the graph
                         ax.set_xlim(-.5, len(self.mean)+0.5)
                         if self.ymin != '':
@@ -27,17 +27,20 @@ import logging
 logger = logging.getLogger(__name__)
 from cs_errors import PauseError
 
-from ctypes import CDLL, c_int, c_float, c_long, c_char_p, byref, windll
+import ctypes
+from ctypes import CDLL, c_int, c_float, c_long, c_char_p, byref
 import sys, threading, time
 import numpy
 from atom.api import Int, Tuple, List, Str, Float, Bool, Member, observe
 from instrument_property import IntProp, FloatProp, ListProp
 from cs_instruments import Instrument
+from instrument_workers import acquire_in_parallel, stop_workers
 
 # imports for viewer
 from analysis import AnalysisWithFigure, Analysis
 from colors import my_cmap
 from enaml.application import deferred_call
+from video import VideoEngine, Blitter, downsampled
 
 import ConfigParser
 
@@ -70,6 +73,12 @@ class AndorCamera(Instrument):
     dim = Int()  # the total number of pixels
     serial = Int()  # the serial number of the camera
     c_image_array = Member()  # a c_int array to store incoming image data
+    # experiment mode buffers, reallocated only when (shots, rows, columns) changes
+    acquisition_config = Member()  # the (shots, rows, columns) the buffers were made for
+    c_acquisition_array = Member()  # c_int array filled by GetAcquiredData
+    acquisition_buffer = Member()  # numpy view of c_acquisition_array
+    storage_buffer = Member()  # uint16 buffer used for writing when storeUint16 applies
+    storeUint16 = Bool(False)  # write shots as uint16 when the AD bit depth allows
     set_T = Int()
     temperature = Float()
     gain = Int()
@@ -104,6 +113,7 @@ class AndorCamera(Instrument):
     data = Member()  # holds acquired images until they are written
     mode = Str('experiment')  # experiment vs. video
     analysis = Member()  # holds a link to the GUI display
+    video = Member()  # VideoEngine running while in video mode
     dll = Member()
 
     # size of CCD, width and height can change depending on binning
@@ -145,7 +155,8 @@ class AndorCamera(Instrument):
             'EMCCDGain', 'preAmpGain', 'exposureTime', 'triggerMode',
             'shotsPerMeasurement', 'minPlot', 'maxPlot', 'VSSpeed', 'HSSpeed',
             'acquisitionMode', 'binMode', 'AdvancedEMGain', 'EMGainMode',
-            'ROI', 'set_T', 'serial', 'subimage_position', 'subimage_size'
+            'ROI', 'set_T', 'serial', 'subimage_position', 'subimage_size',
+            'storeUint16'
         ]
 
     def __del__(self):
@@ -290,22 +301,25 @@ class AndorCamera(Instrument):
 
         # run the video loop in a new thread
         self.start_video_thread()
-        # thread = threading.Thread(target=self.start_video_thread)
-        # thread.daemon = True
-        # thread.start()
 
     def start_video_thread(self):
-        while self.mode == 'video':
-            self.setCamera()
-            if self.GetMostRecentImage():
-                # if there is new data, then redraw image
-                self.analysis.redraw_video()
-            time.sleep(.1)
+        # frames are paced by the camera: the producer blocks until the SDK
+        # reports a new image, then the viewer draws the newest one it has
+        self.video = VideoEngine(
+            '{}_video'.format(self.name),
+            self.GetMostRecentImage,
+            lambda: self.data,
+            self.analysis.redraw_video,
+            wait=self.WaitForNewImage
+        )
+        self.video.start()
 
     def stop_video(self):
         # stop the video thread from looping
         self.mode = 'idle'
-        time.sleep(.01)
+        if self.video is not None:
+            self.video.stop()
+            self.video = None
         self.AbortAcquisition()
 
     def acquire_data(self):
@@ -327,13 +341,14 @@ class AndorCamera(Instrument):
                     hdf5['Andor_{}/columns'.format(self.CurrentHandle)] = self.width
                     hdf5['Andor_{}/rows'.format(self.CurrentHandle)] = self.height
                     hdf5['Andor_{}/numShots'.format(self.CurrentHandle)] = self.shotsPerMeasurement.value
-                    # self.data size has two dimensional array. T num of shots x (row*column)
-                    # We need to reshape into two dim array having row x column, and each shots saved to different node under /shots/
-                    for i in numpy.arange(0, self.shotsPerMeasurement.value):
-                        array = numpy.array(self.data[i], dtype=numpy.int32)
-                        array.resize(int(self.subimage_size[1]), int(self.subimage_size[0]))
-                        # self.data # Defines the name of hdf5 node to write the results on.
-                        hdf5['Andor_{0}/shots/{1}'.format(self.CurrentHandle, i)] = array
+                    # self.data is a view of the acquisition buffer, shaped (shots, rows, columns),
+                    # so each shot can be written to its own node under /shots/ without a copy
+                    shots = self.data
+                    if self.storage_dtype() == numpy.uint16:
+                        numpy.copyto(self.storage_buffer, self.data, casting='unsafe')
+                        shots = self.storage_buffer
+                    for i, shot in enumerate(shots):
+                        hdf5['Andor_{0}/shots/{1}'.format(self.CurrentHandle, i)] = shot
                 except Exception as e:
                     logger.error('in Andor.writeResults:\n{}'.format(e))
                     raise PauseError
@@ -660,30 +675,67 @@ class AndorCamera(Instrument):
         error = self.dll.WaitForAcquisition()
         self.DLLError(sys._getframe().f_code.co_name, error)
 
+    def WaitForNewImage(self, timeout):
+        """Blocks until a new image is available or timeout seconds pass.
+        Returns True if there is a new image."""
+        self.setCamera()
+        error = self.dll.WaitForAcquisitionTimeOut(int(timeout*1000))
+        if ERROR_CODE[error] == 'DRV_NO_NEW_DATA':
+            return False
+        return self.DLLError(sys._getframe().f_code.co_name, error, True)
+
+    def frame_shape(self):
+        """Returns (rows, columns) of a single shot after binning."""
+        binning = self.binChoices[self.binMode]
+        return int(self.subimage_size[1])/binning, int(self.subimage_size[0])/binning
+
+    def storage_dtype(self):
+        """The dtype shots are written to hdf5 with.  uint16 is only used if
+        requested, if the AD channel has at most 16 bits, and if the camera is not
+        summing several readouts in accumulate mode."""
+        if self.storeUint16 and self.acquisitionChoices[self.acquisitionMode] != 2:
+            if self.channel < len(self.bit_depths) and self.bit_depths[self.channel] <= 16:
+                return numpy.uint16
+        return numpy.int32
+
+    def AllocateAcquisitionBuffers(self):
+        """Returns the numpy view of the buffer that GetAcquiredData fills.
+        The buffers are only reallocated when the subimage, binning or number of
+        shots changes, so every measurement reuses the same memory."""
+        rows, columns = self.frame_shape()
+        config = (self.shotsPerMeasurement.value, rows, columns)
+        if config != self.acquisition_config:
+            logger.debug('Allocating Andor acquisition buffer for (shots, rows, columns) = {}'.format(config))
+            c_array_type = c_int * (config[0] * rows * columns)
+            self.c_acquisition_array = c_array_type()
+            self.acquisition_buffer = numpy.ctypeslib.as_array(self.c_acquisition_array).reshape(config)
+            self.storage_buffer = None
+            self.acquisition_config = config
+        if (self.storage_buffer is None) and (self.storage_dtype() == numpy.uint16):
+            self.storage_buffer = numpy.empty(config, dtype=numpy.uint16)
+        return self.acquisition_buffer
+
     def GetAcquiredData(self, dump=False):
-        c_image_array_type = c_int * self.dim * self.shotsPerMeasurement.value
-        c_image_array = c_image_array_type()
+        data = self.AllocateAcquisitionBuffers()
+        c_image_array = self.c_acquisition_array
+        size = data.size
 
         if self.acquisitionChoices[self.acquisitionMode]!=5:
-            error = self.dll.GetAcquiredData(byref(c_image_array), self.dim * self.shotsPerMeasurement.value)
+            error = self.dll.GetAcquiredData(byref(c_image_array), size)
             #errct = 100
             #while (ERROR_CODE[error] == 'DRV_ACQUIRING'):
             #    time.sleep(.1)
             #    self.WaitForAcquisition()
-            #    error = self.dll.GetAcquiredData(byref(c_image_array), self.dim * self.shotsPerMeasurement.value)
+            #    error = self.dll.GetAcquiredData(byref(c_image_array), size)
             self.DLLError(sys._getframe().f_code.co_name, error, dump)
 
         elif self.acquisitionChoices[self.acquisitionMode]==5: # If acqusition mode is Run till abort, data must be read from circular buffer. Attempting dll.GetAcquiredData will not run as it is still acquiring.
             first, last = self.GetNumberNewImages(dump)
             validfirst = c_long()
             validlast = c_long()
-            size=self.dim * self.shotsPerMeasurement.value
             error = self.dll.GetImages(first, last, byref(c_image_array), size, byref(validfirst), byref(validlast))
             self.DLLError(sys._getframe().f_code.co_name, error, dump)
 
-        data = numpy.ctypeslib.as_array(c_image_array)
-        subimg_size = map(int, self.subimage_size)
-        data = numpy.reshape(data, (self.shotsPerMeasurement.value, subimg_size[1], subimg_size[0]))
         return data
 
     def CreateAcquisitionBuffer(self):
@@ -1099,6 +1151,7 @@ class AndorViewer(AnalysisWithFigure):
     shot = Int(0)
     update_lock = Bool(False)
     artist = Member()
+    blitter = Member()  # redraws artist in video mode
     mycam=Member()
     ax = Member()
     bgsub = Bool(False)
@@ -1178,20 +1231,22 @@ class AndorViewer(AnalysisWithFigure):
         ax = fig.add_subplot(111)
 
         self.artist = ax.imshow(data, vmin=self.mycam.minPlot.value, vmax=self.mycam.maxPlot.value, cmap=my_cmap)
+        self.blitter = Blitter([self.artist])
         super(AndorViewer, self).updateFigure()
 
-    def redraw_video(self):
-        """First update self.data using Andor methods, then redraw screen using
-        this.
+    def redraw_video(self, frame=None):
+        """Draw a video frame.  Called on the GUI thread by the camera's
+        VideoEngine with the newest frame.
         """
+        if frame is None:
+            frame = self.data
+        self.artist.set_data(frame)
         if (self.mycam.autoscale):
-            self.artist.set_data(self.data)
             self.artist.autoscale()
-        else:
-            self.artist.set_data(self.data)
-        deferred_call(self.figure.canvas.draw)
-        self.maxPixel = numpy.max(self.data[self.shot])              #What does "shot" mean in video mode?
-        self.meanPixel = int(numpy.mean(self.data[self.shot]))
+        self.blitter.draw()
+        sample = downsampled(frame)
+        self.maxPixel = int(numpy.max(sample))
+        self.meanPixel = int(numpy.mean(sample))
 
 
 class Andor(Instrument):
@@ -1212,12 +1267,17 @@ class Andors(Instrument, Analysis):
     version = '2016.06.02'
     motors = Member()
     dll = Member()
+    parallelAcquisition = Bool(False)  # read out all cameras concurrently
+    acquireTimeout = Member()  # seconds each camera gets in a parallel readout
+    workers = Member()  # camera -> InstrumentWorker, kept between measurements
 
     def __init__(self, name, experiment, description=''):
         super(Andors, self).__init__(name, experiment, description)
         self.motors = ListProp('motors', experiment, 'A list of individual Andor cameras', listElementType=Andor,
                                listElementName='motor')
-        self.properties += ['version', 'motors']
+        self.acquireTimeout = FloatProp('acquireTimeout', experiment, 'seconds to wait for each camera in a parallel readout', '10')
+        self.workers = {}
+        self.properties += ['version', 'motors', 'parallelAcquisition', 'acquireTimeout']
 
     def initializecameras(self):
         try:
@@ -1272,6 +1332,7 @@ class Andors(Instrument, Analysis):
     def evaluate(self):
         msg = ''
         try:
+            self.acquireTimeout.evaluate()
             for i in self.motors:
                 msg = i.evaluate()
         except Exception as e:
@@ -1293,6 +1354,10 @@ class Andors(Instrument, Analysis):
     def acquire_data(self):
         msg = ''
         try:
+            if self.parallelAcquisition:
+                cameras = [i.camera for i in self.motors if i.camera.enable]
+                acquire_in_parallel(cameras, self.workers, self.acquireTimeout.value)
+                return
             for i in self.motors:
                 if i.camera.enable:
                     logger.debug("Acquiring data from camera {}".format(i.camera.CurrentHandle))
@@ -1303,6 +1368,7 @@ class Andors(Instrument, Analysis):
             raise PauseError
 
     def __del__(self):
+        stop_workers(self.workers)
         if self.isInitialized:
             for i in self.motors:
                 try:
@@ -1318,7 +1384,7 @@ class Andors(Instrument, Analysis):
                 logger.warning("Error in ShutDown: {}".format(e))
             handle = self.dll._handle
             del self.dll
-            windll.kernel32.FreeLibrary(handle)
+            ctypes.windll.kernel32.FreeLibrary(handle)
         self.isInitialized = False
 
 
@@ -0,0 +1,156 @@
+"""array_buffers.py
+Part of the CsPyController experiment control software
+
+created = 2026.10.19
+
+Preallocated numpy buffers for analyses that accumulate per-measurement data.
+Appending to a numpy array with np.append or np.concatenate reallocates and
+copies the whole array every time, which makes an iteration O(n^2).  The
+buffers here grow geometrically (amortized O(1) appends) and can optionally be
+capped to a maximum length, in which case the oldest rows are discarded.
+"""
+
+from __future__ import division
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class GrowableArray(object):
+    """A numpy array that can be appended to along the first axis.
+
+    The row shape and dtype can be given up front, or they are taken from the
+    first row appended.  If maxlen is set the buffer behaves like a ring: only
+    the most recent maxlen rows are kept.  In that case the storage is twice
+    maxlen so that the valid rows are always one contiguous slice, and the
+    occasional compaction copy is amortized over maxlen appends.
+
+    view() returns the valid rows as a numpy view (no copy), in the order they
+    were appended.  The view is only valid until the next append.
+    """
+
+    def __init__(self, shape=None, dtype=None, capacity=16, maxlen=None):
+        self.shape = None if shape is None else tuple(shape)
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.maxlen = maxlen
+        self.initial_capacity = max(1, int(capacity))
+        if maxlen is not None:
+            self.initial_capacity = min(self.initial_capacity, maxlen)
+        self._data = None
+        self._start = 0
+        self._stop = 0
+        if (self.shape is not None) and (self.dtype is not None):
+            self._allocate(self.initial_capacity)
+
+    def _allocate(self, capacity):
+        if self.maxlen is not None:
+            capacity = max(capacity, 2*self.maxlen)
+        self._data = np.empty((capacity,) + self.shape, dtype=self.dtype)
+        self._start = 0
+        self._stop = 0
+
+    def __len__(self):
+        return self._stop - self._start
+
+    @property
+    def capacity(self):
+        if self._data is None:
+            return 0
+        return len(self._data)
+
+    def clear(self):
+        """Forget all rows but keep the allocated storage."""
+        self._start = 0
+        self._stop = 0
+
+    def reset(self, shape=None, dtype=None, capacity=None):
+        """Forget all rows and, if the row shape or dtype changed, the storage.
+
+        A shape or dtype of None means it will be taken from the next row.
+        """
+        if capacity is not None:
+            self.initial_capacity = max(1, int(capacity))
+        if shape is not None:
+            shape = tuple(shape)
+        if dtype is not None:
+            dtype = np.dtype(dtype)
+        if (shape != self.shape) or (dtype != self.dtype):
+            self.shape = shape
+            self.dtype = dtype
+            self._data = None
+        self.clear()
+
+    def _reserve(self, n):
+        """Make room for n more rows after _stop."""
+        if self._stop + n <= len(self._data):
+            return
+        length = len(self)
+        if self.maxlen is not None:
+            # keep only the rows that will survive, and move them to the front
+            keep = max(0, min(length, self.maxlen - n))
+            if n > len(self._data):
+                self._data = np.empty((n,) + self.shape, dtype=self.dtype)
+            else:
+                self._data[:keep] = self._data[self._stop-keep:self._stop]
+            self._start = 0
+            self._stop = keep
+        else:
+            new_capacity = max(2*len(self._data), length + n)
+            new_data = np.empty((new_capacity,) + self.shape, dtype=self.dtype)
+            new_data[:length] = self._data[self._start:self._stop]
+            self._data = new_data
+            self._start = 0
+            self._stop = length
+
+    def append(self, row):
+        """Append a single row."""
+        row = np.asarray(row)
+        if self._data is None:
+            if self.shape is None:
+                self.shape = row.shape
+            if self.dtype is None:
+                self.dtype = row.dtype
+            self._allocate(self.initial_capacity)
+        elif row.shape != self.shape:
+            raise ValueError('Row shape {} does not match buffer row shape {}'.format(row.shape, self.shape))
+        self._reserve(1)
+        self._data[self._stop] = row
+        self._stop += 1
+        if (self.maxlen is not None) and (len(self) > self.maxlen):
+            self._start = self._stop - self.maxlen
+
+    def extend(self, rows):
+        """Append several rows at once, rows[i] being one row."""
+        rows = np.asarray(rows)
+        if self._data is None:
+            if self.shape is None:
+                self.shape = rows.shape[1:]
+            if self.dtype is None:
+                self.dtype = rows.dtype
+            self._allocate(max(self.initial_capacity, len(rows)))
+        elif rows.shape[1:] != self.shape:
+            raise ValueError('Row shape {} does not match buffer row shape {}'.format(rows.shape[1:], self.shape))
+        if (self.maxlen is not None) and (len(rows) > self.maxlen):
+            rows = rows[-self.maxlen:]
+        n = len(rows)
+        self._reserve(n)
+        self._data[self._stop:self._stop+n] = rows
+        self._stop += n
+        if (self.maxlen is not None) and (len(self) > self.maxlen):
+            self._start = self._stop - self.maxlen
+
+    def view(self):
+        """Return the valid rows as a view into the buffer."""
+        if self._data is None:
+            if self.shape is None:
+                return np.empty((0,))
+            return np.empty((0,) + self.shape, dtype=self.dtype)
+        return self._data[self._start:self._stop]
+
+    def last(self):
+        """Return the most recently appended row."""
+        if len(self) == 0:
+            raise IndexError('GrowableArray is empty')
+        return self._data[self._stop-1]
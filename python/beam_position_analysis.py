@@ -15,6 +15,7 @@ import time
 from atom.api import Bool, Str, Float, Member, List
 
 from analysis import Analysis
+from array_buffers import GrowableArray
 import numpy as np
 import os.path
 import h5py
@@ -27,6 +28,43 @@ from scipy.optimize import curve_fit
 logger = logging.getLogger(__name__)
 
 
+def log_parabola_peak(profiles):
+    """Sub-pixel peak position of each row of profiles, shape (N, L).
+
+    A Gaussian is a parabola in log space, so the three samples around the
+    maximum determine its center in closed form.  The minimum of each profile
+    is subtracted first as a background estimate.  Returns NaN for rows where
+    there is no clear peak.
+    """
+    profiles = np.asarray(profiles, dtype=np.float64)
+    n, length = profiles.shape
+    centers = np.full(n, np.nan)
+    if length < 3:
+        return centers
+    p = profiles - profiles.min(axis=1)[:, np.newaxis]
+    k = np.clip(np.argmax(p, axis=1), 1, length - 2)
+    rows = np.arange(n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        l0 = np.log(p[rows, k - 1])
+        l1 = np.log(p[rows, k])
+        l2 = np.log(p[rows, k + 1])
+        offset = 0.5*(l0 - l2)/(l0 - 2*l1 + l2)
+    valid = np.isfinite(offset) & (np.abs(offset) <= 1)
+    centers[valid] = k[valid] + offset[valid]
+    return centers
+
+
+def beam_centers(images):
+    """Closed form (x, y) beam centers in pixels for an image or a stack of
+    images with shape (N, rows, columns), from the marginal profiles."""
+    images = np.asarray(images, dtype=np.float64)
+    if images.ndim == 2:
+        images = images[np.newaxis]
+    x = log_parabola_peak(images.sum(axis=1))  # profile along the columns
+    y = log_parabola_peak(images.sum(axis=2))  # profile along the rows
+    return x, y
+
+
 class BeamPositionAnalysis(Analysis):
     """Acts as the error signal generator and process controller in a feedback
     loop to stabilize beam position.
@@ -39,6 +77,8 @@ class BeamPositionAnalysis(Analysis):
     enable_feedback = Bool(False)
     enable_TemperatureCorrection = Bool(False)
     enable_reorder = Bool(False)
+    # refine the closed form beam centers with a gaussian curve_fit, slower
+    refine_with_fit = Bool(False)
     invert_TemperatureCorrection_X=Bool(False)
     invert_TemperatureCorrection_Y=Bool(False)
     meas_analysis_path = Str('analysis/positions/')
@@ -91,7 +131,8 @@ class BeamPositionAnalysis(Analysis):
             'setpoint_X', 'setpoint_Y',
             'actuator_vname_X', 'actuator_vname_Y', 'actuator_variable_X',
             'actuator_variable_Y', 'calibration_X', 'calibration_Y',
-            'enable_reorder', 'meas_analysis_path', 'iter_analysis_path', 'k_p', 'k_i', 'k_d'
+            'enable_reorder', 'meas_analysis_path', 'iter_analysis_path', 'k_p', 'k_i', 'k_d',
+            'refine_with_fit'
         ]
 
     def set_position_paths(self, section='AAS', datagroup='Camera0DataGroup'):
@@ -120,84 +161,100 @@ class BeamPositionAnalysis(Analysis):
 
     def initialize_positions(self):
         # stores positions from each measurement for an iteration
+        # the buffers are preallocated for one iteration, and grow if there are more measurements than expected
+        capacity = max(1, self.experiment.measurementsPerIteration*max(1, len(self.positions_paths)))
         self.positions = {
             'valid_cnt': 0,
 
-            'x': np.array([]),  # relative position
-            'y': np.array([]),
-            'x0': np.array([]),  # absolute positions
-            'y0': np.array([]),
-            'x1': np.array([]),
-            'y1': np.array([]),
-            'Xcorrection': np.array([]),
-            'Ycorrection': np.array([]),
+            'x': GrowableArray((), np.float64, capacity),  # relative position
+            'y': GrowableArray((), np.float64, capacity),
+            'x0': GrowableArray((), np.float64, capacity),  # absolute positions
+            'y0': GrowableArray((), np.float64, capacity),
+            'x1': GrowableArray((), np.float64, capacity),
+            'y1': GrowableArray((), np.float64, capacity),
+            'Xcorrection': 0,
+            'Ycorrection': 0,
 
         }
 
-    def calc_beam_position(self, img):
-        '''Calculate the position of a beam from a 2D image array.
+    def position_array(self, key):
+        """Returns the positions recorded so far this iteration for key, as a numpy array."""
+        return self.positions[key].view()
+
+    def calc_beam_positions(self, images):
+        '''Calculate the position of a beam from a list of 2D image arrays.
         append the results to the position array
         In Rb, this is most relevant to 480 beam imaged onto EMCCD camera.
         '''
-        # Initial guesses with centroid
-        [COM_X, COM_Y] = self.centroid_calc(img)
-        if COM_X == np.NaN and COM_Y == np.NaN:
-            error = 1
-        # Width guesses
+        if len(set(img.shape for img in images)) == 1:
+            # all the same shape, process them together
+            xs, ys = beam_centers(np.array(images))
         else:
-            [Xsigma_guess, Ysigma_guess] = [2.0, 2.0]  # use your guess. Units of pixels.
-            try:
-                x, error_x = self.gaussianfit(img, COM_X, Xsigma_guess, 0) # last argument is axis.
-                y, error_y = self.gaussianfit(img, COM_Y, Ysigma_guess, 1)
-                error = 0
-                logger.info('480 x: {}, 480 y:{}'.format(x,y))
-            except:
-                error = 1
-        if error == 1:
-            x = np.NaN
-            y = np.NaN
-        # only x and y are necessary.  if a relative measurement is performed then use
-        # x#/y# too
-        self.positions['x'] = np.append(self.positions['x'], x)
-        self.positions['y'] = np.append(self.positions['y'], y)
-        if error_x == 0 and error_y == 0 and error == 0:
-            self.positions['valid_cnt'] += 1
+            xs, ys = np.transpose([np.ravel(beam_centers(img)) for img in images])
+        if self.refine_with_fit:
+            for j, img in enumerate(images):
+                xs[j], ys[j] = self.refine_beam_position(img, xs[j], ys[j])
+        for x, y in zip(xs, ys):
+            logger.info('480 x: {}, 480 y:{}'.format(x, y))
+            # only x and y are necessary.  if a relative measurement is performed then use
+            # x#/y# too
+            self.positions['x'].append(x)
+            self.positions['y'].append(y)
+            if np.isfinite(x) and np.isfinite(y):
+                self.positions['valid_cnt'] += 1
+
+    def calc_beam_position(self, img):
+        '''Calculate the position of a beam from a single 2D image array.'''
+        self.calc_beam_positions([img])
+
+    def refine_beam_position(self, img, x_guess, y_guess):
+        """Use gaussian curve fits to refine closed form center guesses.  Returns NaN if a fit fails."""
+        if not (np.isfinite(x_guess) and np.isfinite(y_guess)):
+            # fall back on the centroid for a starting guess
+            x_guess, y_guess = self.centroid_calc(img)
+            if np.isnan(x_guess) or np.isnan(y_guess):
+                return np.nan, np.nan
+        [Xsigma_guess, Ysigma_guess] = [2.0, 2.0]  # use your guess. Units of pixels.
+        try:
+            x, error_x = self.gaussianfit(img, x_guess, Xsigma_guess, 0)  # last argument is axis.
+            y, error_y = self.gaussianfit(img, y_guess, Ysigma_guess, 1)
+        except:
+            logger.exception('Problem fitting beam position.')
+            return np.nan, np.nan
+        return x, y
 
     def append_beam_position_data(self, data, i):
         '''Extract position data from the pre-calculated stat data group'''
-        # every append operation on an np array requires reallocation
-        # of memory, so maybe we should try to not do all these appends
         try:
             assert(i in [0, 1])
         except:
             logger.error('Too many shots detected for beam position analysis.')
             return
 
-        self.positions['x{}'.format(i)] = np.append(
-            self.positions['x{}'.format(i)],
-            data['X{}'.format(i)][()]
-        )
-        self.positions['y{}'.format(i)] = np.append(
-            self.positions['y{}'.format(i)],
-            data['Y{}'.format(i)][()]
-        )
+        self.positions['x{}'.format(i)].extend(np.atleast_1d(data['X{}'.format(i)][()]))
+        self.positions['y{}'.format(i)].extend(np.atleast_1d(data['Y{}'.format(i)][()]))
 
         if self.enable_TemperatureCorrection:
-            self.positions['Xcorrection']=data['Xcorrection']
-            self.positions['Ycorrection']=data['Ycorrection']
+            self.positions['Xcorrection']=data['Xcorrection'][()]
+            self.positions['Ycorrection']=data['Ycorrection'][()]
         else:
             self.positions['Xcorrection']=0
             self.positions['Ycorrection']=0
 
         if i == 1:
+            # only the new pairs of positions need to be differenced
+            n = len(self.positions['x'])
+            m = min(len(self.positions['x0']), len(self.positions['x1']))
+            dx = self.position_array('x1')[n:m] - self.position_array('x0')[n:m]
+            dy = self.position_array('y1')[n:m] - self.position_array('y0')[n:m]
             if self.invert_TemperatureCorrection_X:
-                self.positions['x'] = self.positions['x1'] - self.positions['x0'] - self.positions['Xcorrection']
+                self.positions['x'].extend(dx - self.positions['Xcorrection'])
             else:
-                self.positions['x'] = self.positions['x1'] - self.positions['x0'] + self.positions['Xcorrection']
+                self.positions['x'].extend(dx + self.positions['Xcorrection'])
             if self.invert_TemperatureCorrection_Y:
-                self.positions['y'] = self.positions['y1'] - self.positions['y0'] - self.positions['Ycorrection']
+                self.positions['y'].extend(dy - self.positions['Ycorrection'])
             else:
-                self.positions['y'] = self.positions['y1'] - self.positions['y0'] + self.positions['Ycorrection']
+                self.positions['y'].extend(dy + self.positions['Ycorrection'])
             self.positions['valid_cnt'] += 1
             # print(self.positions)
 
@@ -205,13 +262,14 @@ class BeamPositionAnalysis(Analysis):
     def analyzeMeasurement(self, measResults, iterResults, expResults):
         if self.enable:
             # check that the data exists and it is valid
-
+            # raw images are collected and processed in one batch
+            images = []
             for i, path in enumerate(self.positions_paths):
                 if path in measResults:
                     data = measResults[path]
                     # if the data is a raw image we have to process it
                     if isinstance(data, h5py.Dataset) and len(data.shape) == 2:
-                        self.calc_beam_position(data.value)
+                        images.append(data.value)
                     # if the data is alreay processed, check if it is valid
                     elif self.meas_error_paths[i] in measResults:
                         if measResults[self.meas_error_paths[i]].value == 0:
@@ -226,6 +284,8 @@ class BeamPositionAnalysis(Analysis):
                         logger.error(msg.format(path))
                 else:
                     logger.error("Unable to find positions in measurementResults[{}].".format(path))
+            if images:
+                self.calc_beam_positions(images)
 
 
     def savetohdf5(self, iterationResults):
@@ -251,8 +311,8 @@ class BeamPositionAnalysis(Analysis):
     def calculateError(self):
 
         cutoff=200 # last 200 samples.
-        xs = self.positions['x']
-        ys = self.positions['y']
+        xs = self.position_array('x')
+        ys = self.position_array('y')
 
         # We will use only last chunck of samples for beam position calculation.
         num_of_samples=min(len(xs),cutoff)
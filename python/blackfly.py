@@ -311,6 +311,8 @@ class BlackflyClient(zmq_instrument.ZMQInstrument):
             listElementType=Blackfly,
             listElementName='camera'
         )
+        # images come back as raw buffers, older servers fall back to JSON
+        self.binaryTransport = True
         self.get_available_cameras()
         self.properties += ['version', 'cameras']
         self.doNotSendToHardware += ['available_cameras']
@@ -321,7 +323,8 @@ class BlackflyClient(zmq_instrument.ZMQInstrument):
                 try:
                     f = hdf5.create_group('{}/{}'.format(key, serial))
                     f['error'] = value[serial]['error']
-                    raw_data = np.array(value[serial]['data'])
+                    # already an array view on the message with binary transport
+                    raw_data = np.asarray(value[serial]['data'])
                     f.create_dataset('raw_data', data=raw_data)
                     f = f.create_group('stats')
                     for stat in value[serial]['stats']:
@@ -19,6 +19,7 @@ myGlobals = myGlobalSetup.copy()
 from cs_errors import PauseError
 
 import traceback
+import types
 
 def evalIvar(string, constants=None):
     """
@@ -118,3 +119,33 @@ def execWithGlobalDict(string, varDict=None):
             logger.warning('In execWithGlobalDict: Could not exec string:\n{}\n{}\n{}\n'.format(string, e,
                                                                                                 traceback.format_exc()))
             raise PauseError
+
+def globalNames(code):
+    """Return the set of names used by a compiled code object, including the functions and classes defined in it.
+
+    This is a superset of the global names the code can look up (it also has attribute names), so a namespace with
+    just these names behaves the same as the full global namespace for code that does not use exec, eval or
+    globals()."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= globalNames(const)
+    return names
+
+def execCodeWithGlobalDict(code, names=None, string=''):
+    """This executes a precompiled code object with the global context containing the previous established global
+    namespace.  If names is given, only those globals are put into the namespace, instead of copying all of them.
+    Variables defined in this context do not persist.  string is the source, for the error message."""
+
+    if names is None:
+        myVars = myGlobals.copy()
+    else:
+        myVars = {name: myGlobals[name] for name in names if name in myGlobals}
+        myVars['__builtins__'] = myGlobals['__builtins__']
+
+    try:
+        exec(code, myVars)
+    except Exception as e:
+        logger.warning('In execCodeWithGlobalDict: Could not exec code:\n{}\n{}\n{}\n'.format(string, e,
+                                                                                            traceback.format_exc()))
+        raise PauseError
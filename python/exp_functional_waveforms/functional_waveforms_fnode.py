@@ -1,8 +1,10 @@
 from exp_functional_waveforms.dds import DDS
 
 HSDIO = experiment.LabView.HSDIO.add_transition
+HSDIO_train = experiment.LabView.HSDIO.add_transitions
 HSDIO_repeat = experiment.LabView.HSDIO.add_repeat
 AO = experiment.LabView.AnalogOutput.add_transition
+AO_ramp = experiment.LabView.AnalogOutput.add_transitions
 DO = experiment.LabView.DAQmxDO.add_transition
 label = experiment.functional_waveforms_graph.label
 
@@ -75,20 +77,18 @@ def ramp(t, channel, v1, v2, duration):
     """Sweep one analog output channel from v1 to v2."""
     t_list = linspace(t, t+duration, 100)  # make 100 time steps
     v_list = linspace(v1, v2, 100)  # make 100 voltage steps
-    for t, v in zip(t_list, v_list):
-        # step through each value and assign it to the AO channel
-        AO(t, channel, v)
-    return t+duration  # return the end time
+    # assign all the values to the AO channel at once
+    AO_ramp(t_list, channel, v_list)
+    return t_list[-1]+duration  # return the end time, counted from the last step as it always has been
 
 
 def cal_ramp(t, channel, x1, x2, duration, cal=None):
     """Sweep one analog output channel from v1 to v2."""
     t_list = linspace(t, t+duration, 100)  # make 100 time steps
     v_list = fort_attn_cal(linspace(x1, x2, 100))  # make 100 voltage steps
-    for t, v in zip(t_list, v_list):
-        # step through each value and assign it to the AO channel
-        AO(t, channel, v)
-    return t+duration  # return the end time
+    # assign all the values to the AO channel at once
+    AO_ramp(t_list, channel, v_list)
+    return t_list[-1]+duration  # return the end time, counted from the last step as it always has been
 
 
 def cal_mod(t, channel, f, amp, cycles, cal=None):
@@ -97,10 +97,11 @@ def cal_mod(t, channel, f, amp, cycles, cal=None):
     ppc = 20
     t_list = linspace(t, t+duration, cycles*ppc)  # make 100 time steps
     v_list = fort_attn_cal(1+amp*sin(2*pi*f*t_list))  # make 100 voltage steps
-    for t, v in zip(t_list, v_list):
-        # step through each value and assign it to the AO channel
-        AO(t, channel, v)
-    return t+duration  # return the end time
+    # assign all the values to the AO channel at once
+    AO_ramp(t_list, channel, v_list)
+    if len(t_list):
+        t = t_list[-1]
+    return t+duration  # return the end time, counted from the last step as it always has been
 
 ################################################################################
 # INIT AND TEARDOWN ############################################################
@@ -348,11 +349,12 @@ def MZ2_shutter(t, state):
 def counter_sample_clock(t, bins, period_ms, channel):
     """Generate an evenly spaced number of counter sample clock cycles equal to bins"""
     # throwaway bins to clear counter
-    for i in range(bins):
-        HSDIO(t, channel, True)
-        HSDIO(t + 0.5*period_ms, channel, False)
-        t += period_ms
-    return t
+    # the start of each bin, accumulated one period at a time, then the end of the last bin
+    starts = cumsum(r_[t, full(bins, period_ms)])
+    # each bin goes high at its start and low half way through
+    times = column_stack((starts[:-1], starts[:-1] + 0.5*period_ms)).ravel()
+    HSDIO_train(times, channel, tile([True, False], bins))
+    return starts[-1]
 
 
 def counter_sample_clock_overhead(t, bins=1, channel=None):
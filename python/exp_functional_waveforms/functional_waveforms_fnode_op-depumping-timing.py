@@ -1,8 +1,10 @@
 from exp_functional_waveforms.dds import DDS
 
 HSDIO = experiment.LabView.HSDIO.add_transition
+HSDIO_train = experiment.LabView.HSDIO.add_transitions
 HSDIO_repeat = experiment.LabView.HSDIO.add_repeat
 AO = experiment.LabView.AnalogOutput.add_transition
+AO_ramp = experiment.LabView.AnalogOutput.add_transitions
 DO = experiment.LabView.DAQmxDO.add_transition
 label = experiment.functional_waveforms_graph.label
 
@@ -75,10 +77,9 @@ def ramp(t, channel, v1, v2, duration):
     """Sweep one analog output channel from v1 to v2."""
     t_list = linspace(t, t+duration, 100)  # make 100 time steps
     v_list = linspace(v1, v2, 100)  # make 100 voltage steps
-    for t, v in zip(t_list, v_list):
-        # step through each value and assign it to the AO channel
-        AO(t, channel, v)
-    return t+duration  # return the end time
+    # assign all the values to the AO channel at once
+    AO_ramp(t_list, channel, v_list)
+    return t_list[-1]+duration  # return the end time, counted from the last step as it always has been
 
 
 ################################################################################
@@ -322,11 +323,12 @@ def MZ2_shutter(t, state):
 def counter_sample_clock(t, bins, period_ms):
     """Generate an evenly spaced number of counter sample clock cycles equal to bins"""
     # throwaway bins to clear counter
-    for i in range(bins):
-        HSDIO(t, HSDIO_channels['spcm_gate_780']['channel'], True)
-        HSDIO(t + 0.5*period_ms, HSDIO_channels['spcm_gate_780']['channel'], False)
-        t += period_ms
-    return t
+    # the start of each bin, accumulated one period at a time, then the end of the last bin
+    starts = cumsum(r_[t, full(bins, period_ms)])
+    # each bin goes high at its start and low half way through
+    times = column_stack((starts[:-1], starts[:-1] + 0.5*period_ms)).ravel()
+    HSDIO_train(times, HSDIO_channels['spcm_gate_780']['channel'], tile([True, False], bins))
+    return starts[-1]
 
 
 def counter_sample_clock_overhead(t, bins=1):
@@ -30,8 +30,10 @@ from cs_errors import PauseError
 import cs_evaluate
 import sound
 import optimization
-from instrument_property import Prop, EvalProp, ListProp, StrProp
+from instrument_property import Prop, EvalProp, ListProp, StrProp, SETTINGS_HASH
 import functional_waveforms
+from scan_planner import ScanPlan
+from stage_profiler import profiler
 
 import logging
 __author__ = 'Martin Lichtman'
@@ -136,6 +138,13 @@ class Experiment(Prop):
     experimentDescriptionFilenameSuffix = Str()
     measurementTimeout = Float()
     measurementsPerIteration = Int()
+    # adaptive measurement allocation: take measurements until the analyses' standard error reaches the target
+    adaptiveMeasurements = Bool()
+    targetStandardError = Float(.05)
+    minMeasurementsPerIteration = Int(10)
+    maxMeasurementsPerIteration = Int(500)
+    profileStages = Bool()  # record the time taken by each stage of the measurement loop
+    profileReport = Str()
     willSendEmail = Bool()
     emailAddresses = Str()
     notes = Str()
@@ -144,6 +153,8 @@ class Experiment(Prop):
     cache_dir = Str()
     setting_path = Str()
     temp_path = Str()
+    previous_settings = Member()  # the previous settings file, open during an incremental autosave
+    settings_hashes = Member()  # the content hash of each Prop, by id, during an incremental autosave
 
     #iteration traits
     progress = Int()
@@ -199,6 +210,9 @@ class Experiment(Prop):
     ivarIndex = Member()
     ivarValueLists = Member()
     ivarSteps = Member()
+    ivarOrdering = Str('sequential')  # the order of the iterations, one of scan_planner.ORDERINGS
+    ivarSeed = Int()  # shuffles a randomized ordering, drawn anew for each experiment
+    scanPlan = Member()  # the ivar indices and values of every iteration
     constants = Member()
     vars = Member()
     hdf5 = Member()
@@ -207,7 +221,7 @@ class Experiment(Prop):
     allow_evaluation = Member()
     gui = Member()  # a reference to the gui Main, for use in Prop.set_gui
     optimizer = Member()
-    ivarBases = Member()
+    iterationIndex = Member()  # maps a tuple of ivar indices to the first iteration that used them
     instrument_update_needed = Bool(True)
     ROITypeString = Str()
     functional_waveforms = Member()
@@ -266,6 +280,7 @@ class Experiment(Prop):
         self.independentVariables = ListProp('independentVariables', self, listElementType=IndependentVariable,
                                              listElementName='independentVariable')
         self.ivarIndex = []
+        self.iterationIndex = {}
         self.vars = {}
         self.analyses = []
         self.ROITypeString = 'gaussian_roi'  # used in analysis.py; can be overwritten by experiment classes
@@ -283,7 +298,9 @@ class Experiment(Prop):
                             'currentTime', 'timeElapsed', 'timeRemaining', 'totalTime', 'completionTime',
                             'constantReport', 'variableReport', 'variablesNotToSave', 'notes', 'max_iterations',
                             'enable_sounds', 'enable_instrument_threads', 'optimizer', 'optimizer_count',
-                            'optimizer_iteration_count']
+                            'optimizer_iteration_count', 'ivarOrdering', 'ivarSeed', 'adaptiveMeasurements',
+                            'targetStandardError', 'minMeasurementsPerIteration', 'maxMeasurementsPerIteration',
+                            'profileStages']
         #we do not load in status as a variable, to allow old settings to be loaded without bringing in the status of
         #the saved experiments
 
@@ -341,7 +358,24 @@ class Experiment(Prop):
                 raise PauseError
 
     def autosave(self):
+        """Save all the settings to settings.hdf5, keeping the last save as previous_settings.hdf5.
+
+        The save is incremental.  Each Prop group is stored with a hash of its content.  If nothing changed since the
+        last save, settings.hdf5 is kept as it is.  Otherwise a Prop whose content has not changed is copied from
+        previous_settings.hdf5 as a whole, instead of being serialized again.
+        """
         logger.debug('Saving settings to default settings.hdf5 ...')
+        hashes = {}
+        try:
+            f = h5py.File(self.setting_path, 'a')
+        except Exception as e:
+            logger.debug('Could not open settings.hdf5:\n'+str(e))
+        else:
+            saved = f.get('settings/'+self.name)
+            if (saved is not None) and (saved.attrs.get(SETTINGS_HASH) == self.settings_hash(hashes)):
+                logger.debug('Settings have not changed since the last save.')
+                return f
+            f.close()
         # remove old autosave file
         try:
             os.remove(self.temp_path)
@@ -354,9 +388,21 @@ class Experiment(Prop):
                          'previous_settings.hdf5:\n'+str(e))
         # create file
         f = h5py.File(self.setting_path, 'w')
-        # recursively add all properties
-        x = f.create_group('settings')
-        self.toHDF5(x)
+        try:
+            self.previous_settings = h5py.File(self.temp_path, 'r')
+        except Exception as e:
+            logger.debug('No previous settings to copy unchanged settings from:\n'+str(e))
+            self.previous_settings = None
+        self.settings_hashes = hashes
+        try:
+            # recursively add all properties
+            x = f.create_group('settings')
+            self.toHDF5(x)
+        finally:
+            self.settings_hashes = None
+            if self.previous_settings is not None:
+                self.previous_settings.close()
+                self.previous_settings = None
         f.flush()
         return f
         # you will need to do autosave().close() wherever this is called
@@ -401,29 +447,38 @@ class Experiment(Prop):
 
             #start by saving settings
             logger.debug('Autosaving')
-            autosave_file = self.autosave()
+            self.autosave().close()
             logger.debug('Done autosaving')
 
+            # Keep a snapshot of the settings next to the results, and refer to it with an external link instead of
+            # copying the settings into the results file.  A relative link is found in the directory of the results
+            # file, so the two files can be moved together.
             try:
-                logger.debug('Copying autosave data to current HDF5')
-                autosave_file['settings'].copy(autosave_file['settings'], self.hdf5)
+                logger.debug('Linking autosave data to current HDF5')
+                if self.saveData:
+                    snapshot = os.path.join(self.path, 'settings.hdf5')
+                    link = 'settings.hdf5'
+                else:
+                    snapshot = os.path.join(self.cache_dir, 'results_settings.hdf5')
+                    link = snapshot
+                shutil.copyfile(self.setting_path, snapshot)
+                self.hdf5['settings'] = h5py.ExternalLink(link, '/settings')
             except:
-                logger.warning('Problem trying to copy autosave settings to HDF5 results file.')
+                logger.exception('Problem trying to link autosave settings to HDF5 results file.')
                 raise PauseError
-            finally:
-                autosave_file.close()
-                logger.debug('Autosave closed')
 
         #store independent variable data for experiment
         t = time.time()
         self.hdf5.attrs['start_time'] = t
         self.hdf5.attrs['start_time_str'] = self.date2str(t)
         self.hdf5.attrs['ivarNames'] = self.ivarNames
-        #self.hdf5.attrs['ivarValueLists'] = self.ivarValueLists  # temporarily disabled because HDF5 cannot handle arbitrary length lists of lists
+        # the ivar values are stored in the scan_plan table, once the ivars are evaluated in reset()
         self.hdf5.attrs['ivarSteps'] = self.ivarSteps
 
         #create a group to hold iterations in the hdf5 file
         self.hdf5.create_group('iterations')
+        # the ivar index -> iteration lookup is rebuilt as iterations are created
+        self.iterationIndex = {}
 
         #store notes.  They will be stored again at the end of the experiment.
         self.hdf5['notes'] = self.notes
@@ -441,6 +496,7 @@ class Experiment(Prop):
         self.iterationResults.attrs['ivarValues'] = [i.currentValue for i in self.independentVariables]
         self.iterationResults.attrs['ivarIndex'] = self.ivarIndex
         self.iterationResults['report'] = self.variableReport.value
+        self.add_to_iteration_index()
 
         #store the independent and dependent variable space
         v = self.iterationResults.create_group('variables')
@@ -456,6 +512,27 @@ class Experiment(Prop):
                 except Exception as e:
                     logger.warning('Could not save variable '+key+' as an hdf5 dataset with value: '+str(value)+'\n'+str(e))
 
+    def add_to_iteration_index(self):
+        """Record this iteration's ivar indices, in memory and in the 'iteration_index' table of the results file.
+
+        Each row of the table is (iteration, ivarIndex[0], ivarIndex[1], ...).  This lets the shots browser find an
+        iteration by its ivar indices without reading the attributes of every iteration group, including when an old
+        results file is reopened.
+        """
+        key = tuple(int(i) for i in self.ivarIndex)
+        # keep the first matching iteration, optimizer loops can revisit the same indices
+        self.iterationIndex.setdefault(key, self.iteration)
+        row = (self.iteration,) + key
+        if 'iteration_index' not in self.hdf5:
+            self.hdf5.create_dataset('iteration_index', shape=(0, len(row)), maxshape=(None, len(row)), dtype='int64')
+        table = self.hdf5['iteration_index']
+        if table.shape[1] != len(row):
+            logger.warning('Number of independent variables changed, iteration {} not added to iteration_index.'.format(self.iteration))
+            return
+        n = table.shape[0]
+        table.resize((n + 1, len(row)))
+        table[n] = row
+
     def create_optimizer_iteration(self):
         """
         This method sets up the hdf5 storage for a new optimization loop.  It is called whenever a new iteration is
@@ -599,11 +676,9 @@ class Experiment(Prop):
             self.ivarSteps = [i.steps for i in self.independentVariables]
             self.totalIterations = int(numpy.product(self.ivarSteps))
 
-            # figure out how often each ivar will update with iterations (the "base")
+            # plan the ivar indices of every iteration
             # the first (i.e. top) ivar becomes the "inner loop"
-            self.ivarBases = numpy.roll(numpy.cumprod(self.ivarSteps), 1)
-            if len(self.ivarBases>0):
-                self.ivarBases[0] = 1
+            self.scanPlan = ScanPlan(self.ivarNames, self.ivarValueLists, self.ivarOrdering, self.ivarSeed)
 
     def goThread(self):
         if self.progress == 100:
@@ -633,13 +708,17 @@ class Experiment(Prop):
             logger.debug('Before go() loop: status = {}, and optimizer.is_done = {}'.format(self.status, self.optimizer.is_done))
             while (self.status == 'running') and ((not self.optimizer.enable) or (not self.optimizer.is_done)):
                 logger.debug("starting new iteration")
+                profiler.enabled = self.profileStages
+                profiler.iteration = self.iteration
 
                 # at the start of a new iteration, or every time if requested
                 if self.instrument_update_needed or self.reload_settings_after_pause:
                     logger.debug("evaluating")
-                    self.evaluate()  # update ivars to current iteration and re-calculate dependent variables
+                    with profiler.span('evaluate'):
+                        self.evaluate()  # update ivars to current iteration and re-calculate dependent variables
                     logger.debug("updating instruments")
-                    self.update()  # send current values to hardware
+                    with profiler.span('update'):
+                        self.update()  # send current values to hardware
                     self.instrument_update_needed = False  # no need to update the settings until the next iteration
 
                 # only at the start of a new iteration
@@ -654,7 +733,8 @@ class Experiment(Prop):
 
                 # loop until the desired number of measurements are taken
                 # self.measurement = 0
-                while (self.goodMeasurements < self.measurementsPerIteration) and (self.status == 'running'):
+                done = self.iterationDone()
+                while (not done) and (self.status == 'running'):
                     self.set_gui({'valid': True})  # reset all the red error background graphics to show no-error
                     logger.info('iteration {} measurement {}'.format(self.iteration, self.measurement))
                     self.measure()  # tell all instruments to do the experiment sequence and acquire data
@@ -663,10 +743,12 @@ class Experiment(Prop):
 
                     # make sure results are written to disk
                     logger.debug('flushing hdf5')
-                    self.hdf5.flush()
+                    with profiler.span('hdf5 flush'):
+                        self.hdf5.flush()
 
                     # increment the measurement counter, except at the end
-                    if self.goodMeasurements < self.measurementsPerIteration:
+                    done = self.iterationDone()
+                    if not done:
                         self.measurement += 1
                     else:
                         break
@@ -684,12 +766,18 @@ class Experiment(Prop):
 
                 # Measurement loop exited, but that might mean we are paused, or an error.
                 # So check to see if we completed the iteration.
-                if self.goodMeasurements >= self.measurementsPerIteration:
+                if done:
 
                     # We have completed this iteration, move on to the next one
                     logger.info("Finished iteration")
+                    if self.adaptiveMeasurements:
+                        error = self.standardError()
+                        self.iterationResults.attrs['standard_error'] = numpy.nan if error is None else error
 
                     self.postIteration()  # run analysis
+                    if self.profileStages:
+                        profiler.toHDF5(self.iterationResults, self.iteration)
+                        self.set_gui({'profileReport': profiler.report(self.iteration)})
 
                     # if this was the last iteration in this optimization loop, then run analysis and run optimizer
                     if (self.iteration % self.totalIterations) == self.totalIterations-1:
@@ -868,25 +956,36 @@ class Experiment(Prop):
                     # let each instrument begin measurement
                     # put each in a different thread, so they can proceed simultaneously
                     if self.enable_instrument_threads:
-                        threading.Thread(target=i.start).start()
+                        threading.Thread(target=profiler.timed('start ' + i.name, i.start)).start()
                     else:
-                        i.start()
+                        with profiler.span('start ' + i.name):
+                            i.start()
         logger.debug('all instruments started')
 
         # loop until all instruments are done
         # TODO: can we do this with a callback?
+        run_start = time.time()
         while (not all([i.isDone for i in self.instruments])) and (self.status == 'running'):
             if time.time() - start_time > self.measurementTimeout:  # break if timeout exceeded
                 self.timeOutExpired = True
                 logger.warning('The following instruments timed out: '+str([i.name for i in self.instruments if not i.isDone]))
                 return  # exit without saving results
             time.sleep(.01)  # wait a bit, then check again
+        profiler.record('run', run_start, time.time() - run_start)
         logger.debug('all instruments done')
 
         # give each instrument a chance to acquire final data
+        # instruments that can request their data without waiting for it (ZMQ
+        # servers) are all asked first, and then awaited together
+        requests = [(i, i.request_results()) for i in self.instruments
+                    if i.enable and hasattr(i, 'request_results')]
         for i in self.instruments:
-            if i.enable:
-                i.acquire_data()
+            if i.enable and not hasattr(i, 'request_results'):
+                with profiler.span('acquire ' + i.name):
+                    i.acquire_data()
+        for i, request in requests:
+            with profiler.span('collect ' + i.name):
+                i.collect_results(request)
 
         # record results to hdf5
         self.measurementResults = self.hdf5.create_group('iterations/'+str(self.iteration)+'/measurements/'+str(self.measurement))
@@ -899,7 +998,8 @@ class Experiment(Prop):
             # to it.  We do it here because h5py is not thread safe, and also
             # this way we avoid saving results for aborted measurements.
             if i.enable:
-                i.writeResults(self.measurementResults['data'])
+                with profiler.span('writeResults ' + i.name):
+                    i.writeResults(self.measurementResults['data'])
 
         self.postMeasurement()
 
@@ -1029,20 +1129,14 @@ class Experiment(Prop):
         # run analyses
         analysisList = []
         callback = self.postMeasurementCallBack(analysisList)
+        # the time each analysis takes is recorded by the stage profiler
         for i in self.analyses:
-            #print(i.name)
-            #time_debug=time.time()  # Start time measurement
-            #logger.info('Running :{0}'.format(i))
             i.postMeasurement(
                 callback(i),
                 self.measurementResults,
                 self.iterationResults,
                 self.hdf5
             )
-            #time2_debug=1000.0*(time.time()-time_debug)
-            # To measure how long do analyses take.
-            #if (time2_debug>0.5): # Don't display if the process takes less than 0.5 ms
-            #logger.info('Completed Running :{0}, time usage : {1}ms'.format(i,round(time2_debug,0)))
 
     def preExperiment(self):
         # run analyses
@@ -1083,6 +1177,7 @@ class Experiment(Prop):
         self.goodMeasurements = 0
         self.completedMeasurementsByIteration = []
         self.progress = 0
+        profiler.clear()
 
         self.update_gui()
 
@@ -1090,10 +1185,12 @@ class Experiment(Prop):
         self.create_data_files()
 
         # evaluate the constants and independent variables
+        self.ivarSeed = numpy.random.randint(2**31)
         self.evaluate_constants()
         self.evaluateIndependentVariables()
         self.updateIndependentVariables()
         self.hdf5['constant_report'] = self.constantReport.value
+        self.scanPlan.toHDF5(self.hdf5)
 
         # run analyses preExperiment
         self.preExperiment()
@@ -1171,18 +1268,34 @@ class Experiment(Prop):
         Does not explicitly call evaluate, to avoid duplication of effort.
         All calls to evaluate should already have been accomplished."""
 
+        requests = []
         for i in self.instruments:
             if i.enable:
                 #check that the instruments are initialized
                 if not i.isInitialized:
                     i.initialize()  # reinitialize
-                i.update()  # put the settings to where they should be at this iteration
+                # put the settings to where they should be at this iteration
+                if hasattr(i, 'update_async'):
+                    # send now, wait for the reply after the other instruments
+                    requests.append((i, i.update_async()))
+                else:
+                    i.update()
+        for i, request in requests:
+            i.check_response(request.result())
+
+    def goodMeasurementsString(self):
+        if self.adaptiveMeasurements:
+            error = self.standardError()
+            return '{} of {}-{}, error {}'.format(self.goodMeasurements, self.minMeasurementsPerIteration,
+                                                  self.maxMeasurementsPerIteration,
+                                                  'n/a' if error is None else '{:.3g}'.format(error))
+        return '{} of {}'.format(self.goodMeasurements, self.measurementsPerIteration-1)
 
     def update_gui(self):
         logger.debug('experiment.update_gui()')
         self.set_gui({'measurementStr': str(self.measurement),
                     'iterationStr': '{} of {}'.format(self.iteration, self.totalIterations-1),
-                    'goodMeasurementsStr': '{} of {}'.format(self.goodMeasurements, self.measurementsPerIteration-1),
+                    'goodMeasurementsStr': self.goodMeasurementsString(),
                     'statusStr': self.status,
                     'timeStartedStr': self.date2str(self.timeStarted),
                     'currentTimeStr': self.date2str(self.currentTime),
@@ -1196,14 +1309,44 @@ class Experiment(Prop):
     def updateIndependentVariables(self):
         """takes the iteration number and figures out which index number each independent variable should have"""
 
-        # find the current index for each
-        index = (self.iteration//self.ivarBases) % self.ivarSteps
+        # look up the current index for each
+        index = self.scanPlan.indices_at(self.iteration).copy()
 
         for i, x in enumerate(self.independentVariables):
            if (not self.optimizer.enable) or (not x.optimize):  # update the variable is
                 index[i] = x.setIndex(index[i])  # update each variable object
         self.ivarIndex = index
 
+    def standardError(self):
+        """The largest running standard error that the analyses report for this iteration, or None if none do."""
+        errors = [e for e in (a.standard_error() for a in self.analyses) if e is not None]
+        if errors:
+            return max(errors)
+        return None
+
+    def iterationDone(self):
+        """Whether the current iteration has enough good measurements.
+
+        That is measurementsPerIteration, or with adaptiveMeasurements, once the standard error reported by the
+        analyses is down to targetStandardError, but no fewer than minMeasurementsPerIteration and no more than
+        maxMeasurementsPerIteration.  An iteration that no analysis reports an error for runs to the maximum.
+        """
+        if not self.adaptiveMeasurements:
+            return self.goodMeasurements >= self.measurementsPerIteration
+        if self.goodMeasurements < self.minMeasurementsPerIteration:
+            return False
+        if self.goodMeasurements >= self.maxMeasurementsPerIteration:
+            return True
+        error = self.standardError()
+        return (error is not None) and (error <= self.targetStandardError)
+
+    def expectedMeasurementsPerIteration(self):
+        """The number of good measurements an iteration is expected to take, before any have finished."""
+        if self.adaptiveMeasurements:
+            return min(max(self.measurementsPerIteration, self.minMeasurementsPerIteration),
+                       self.maxMeasurementsPerIteration)
+        return self.measurementsPerIteration
+
     def updateTime(self):
         """Updates the GUI clock and recalculates the time-to-completion predictions."""
 
@@ -1214,16 +1357,20 @@ class Experiment(Prop):
 
         #calculate time per measurement
         completedMeasurements = sum(self.completedMeasurementsByIteration)
-        if self.timeElapsed != 0:
-            timePerMeasurement = completedMeasurements/self.timeElapsed
+        if completedMeasurements != 0:
+            timePerMeasurement = self.timeElapsed/completedMeasurements
         else:
             timePerMeasurement = 1
         if len(self.completedMeasurementsByIteration) <= 1:
             #if we're still in the first iteration, use the intended number of measurements
-            estTotalMeasurements = self.measurementsPerIteration*self.totalIterations
+            estTotalMeasurements = self.expectedMeasurementsPerIteration()*self.totalIterations
         else:
-            #if we're after the first iteration, we have more information to work with, use the actual average number of measurements per iteration
-            estTotalMeasurements = numpy.mean(self.completedMeasurementsByIteration[:-1])*self.totalIterations
+            #if we're after the first iteration, we have more information to work with, use the actual average number
+            #of measurements per iteration.  With adaptive allocation this follows how quickly the points converge.
+            finished = self.completedMeasurementsByIteration[:-1]
+            estTotalMeasurements = numpy.mean(finished)*self.totalIterations
+            # the current iteration has taken at least as many as it has so far
+            estTotalMeasurements += max(0, self.completedMeasurementsByIteration[-1] - numpy.mean(finished))
         if estTotalMeasurements > 0:
             self.progress = int(100*completedMeasurements/estTotalMeasurements)
         else:
@@ -21,6 +21,7 @@ logger = logging.getLogger(__name__)
 
 
 import traceback
+import hashlib
 import numpy as np
 from atom.api import Str, Member, Float, Bool, observe
 import os
@@ -29,6 +30,7 @@ import cs_evaluate
 from analysis import AnalysisWithFigure
 from cs_instruments import Instrument
 from cs_errors import PauseError
+from instrument_property import value_hash
 
 
 class FunctionalWaveforms(Instrument):
@@ -49,6 +51,17 @@ class FunctionalWaveforms(Instrument):
     filename = Str()  # File from which to load functional waveforms if load_file is true.
     file_text = Str()  # Text loaded from a file
     text = Str()  # Text string in the GUI field
+    # if true, the waveforms are only executed again when a variable they use has changed.  Only the variables named in
+    # the waveform text are checked, so this must not be used if the waveforms depend on anything else.
+    memoize = Bool()
+
+    compiled = Member()  # the code object for waveform_text
+    compiled_hash = Str()  # the hash of the text that was compiled
+    global_names = Member()  # the global names that the compiled code uses
+    written = Member()  # the text last written to SETTINGS_WAVEFORM, and the file's modification time and size after
+    memo_key = Member()  # the variable values that the current waveforms were made with, if memoize
+    unchanged = Bool()  # true if the waveforms were not executed again in the last evaluate
+    memo_repeats = Member()  # the HSDIO repeats that the current waveforms made, for its overlap check
 
     def __init__(self, name, experiment, description=''):
         super(FunctionalWaveforms, self).__init__(name, experiment, description)
@@ -59,7 +72,8 @@ class FunctionalWaveforms(Instrument):
             'waveform_text',
             'load_file',
             'load_from_settings',
-            'filename']
+            'filename',
+            'memoize']
 
         # Create the settings wavefrom file if it doesn't already exist
         if not os.path.isfile(self.SETTINGS_WAVEFORM):
@@ -70,7 +84,7 @@ class FunctionalWaveforms(Instrument):
     def evaluate(self):
         if self.enable and self.experiment.allow_evaluation:
             logger.debug('FunctionalWaveforms.evaluate()')
-            self.experiment.LabView.HSDIO.repeat_list = []  # Prevents buildup
+            HSDIO = self.experiment.LabView.HSDIO
 
             self.update_settings_waveform()
 
@@ -83,18 +97,76 @@ class FunctionalWaveforms(Instrument):
                 self.load_text_from_file(filename)
                 self.waveform_text = self.file_text
 
-            #localvars = self.experiment.vars.copy()
-            cs_evaluate.execWithGlobalDict(self.waveform_text) #, localvars)
+            self.compile_waveform()
+
+            # skip the waveforms if they would come out the same as last time
+            key = self.variables_key() if self.memoize else None
+            self.unchanged = (key is not None) and (key == self.memo_key)
+            if self.unchanged:
+                # HSDIO.toHardware empties the repeats after checking them for overlaps, so give them back
+                HSDIO.repeat_list = list(self.memo_repeats)
+            else:
+                self.memo_key = None
+                HSDIO.repeat_list = []  # Prevents buildup
+                self.clear_transitions()
+                cs_evaluate.execCodeWithGlobalDict(self.compiled, self.global_names, self.waveform_text)
+                self.memo_repeats = list(HSDIO.repeat_list)
+                self.memo_key = key
 
             super(FunctionalWaveforms, self).evaluate()
+        elif self.experiment.allow_evaluation:
+            # the output instruments get no transitions
+            self.unchanged = False
+            self.memo_key = None
+            self.clear_transitions()
+
+    def clear_transitions(self):
+        """Empty the transition lists of the output instruments before the waveforms add to them."""
+        LabView = self.experiment.LabView
+        for instrument in (LabView.HSDIO, LabView.DAQmxDO, LabView.AnalogOutput):
+            instrument.transition_list.clear()
+
+    def compile_waveform(self):
+        """Compile waveform_text, unless it is the same text that was compiled last time."""
+        text = self.waveform_text
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        text_hash = hashlib.sha1(text).hexdigest()
+        if (self.compiled is not None) and (text_hash == self.compiled_hash):
+            return
+        try:
+            self.compiled = compile(self.waveform_text, '<functional waveforms>', 'exec')
+        except Exception as e:
+            logger.warning('Could not compile functional waveforms:\n{}\n{}\n'.format(e, traceback.format_exc()))
+            self.compiled = None
+            raise PauseError
+        self.compiled_hash = text_hash
+        self.global_names = cs_evaluate.globalNames(self.compiled)
+        self.memo_key = None
+
+    def variables_key(self):
+        """A key that changes whenever a variable used by the waveforms changes."""
+        memo = {}
+        variables = self.experiment.vars
+        key = [self.compiled_hash]
+        for name in sorted(self.global_names.intersection(variables)):
+            if name != 'experiment':
+                key.append((name, value_hash(variables[name], memo)))
+        return tuple(key)
 
     def update_settings_waveform(self):
         """
         Write the current waveform used by the experiment to the temporary file specified in
-        FunctionalWaveforms.SETTINGS_WAVEFORM
+        FunctionalWaveforms.SETTINGS_WAVEFORM, if it is not already there
         """
+        if (self.written is not None) and os.path.isfile(self.SETTINGS_WAVEFORM):
+            stat = os.stat(self.SETTINGS_WAVEFORM)
+            if self.written == (self.waveform_text, stat.st_mtime, stat.st_size):
+                return
         with open(self.SETTINGS_WAVEFORM, 'w') as f:
             f.write(self.waveform_text)
+        stat = os.stat(self.SETTINGS_WAVEFORM)
+        self.written = (self.waveform_text, stat.st_mtime, stat.st_size)
 
     def load_text_from_file(self, filename):
         """
@@ -113,11 +185,9 @@ class FunctionalWaveforms(Instrument):
             )
             return
 
-        txt = ""
         try:
             with open(filename, 'r') as f:
-                for line in f:
-                    txt = txt + line
+                txt = f.read()
         except IOError as e:
             logger.exception(
                 "Opening file {} in FunctionalWaveforms. Waveform not updated\n{}".format(
@@ -181,6 +251,10 @@ class FunctionalWaveformGraph(AnalysisWithFigure):
 
     def evaluate(self):
         if self.enable and self.experiment.allow_evaluation:
+            if self.experiment.functional_waveforms.unchanged:
+                # the waveforms were not executed again, so the labels and the plot are the same as last time
+                return
+
             # save the labels for plotting
             self.saved_labels = self.labels
             self.saved_spans = self.spans
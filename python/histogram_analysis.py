@@ -12,11 +12,26 @@ import matplotlib as mpl
 from atom.api import Bool, Member, Str, observe, Int
 
 from analysis import AnalysisWithFigure, ROIAnalysis
+from SquareROIAnalysis import SquareROIAnalysis
 
 logger = logging.getLogger(__name__)
 mpl.use('PDF')
 
 
+def shots_by_roi(all_shots_array, square_rois=False):
+    """Reshape the iteration's ROI sums to (measurements, shots, rois).
+
+    The square ROI sums are (measurements, shots, ROI rows, ROI columns), other
+    sources can be (measurements, sub-measurements, shots, rois).
+    """
+    if square_rois:
+        return all_shots_array.reshape(all_shots_array.shape[:2] + (-1,))
+    # flatten sub-measurements
+    if len(all_shots_array.shape) == 4:
+        return all_shots_array.reshape(-1, *all_shots_array.shape[2:])
+    return all_shots_array
+
+
 class HistogramAnalysis(AnalysisWithFigure):
     """This class live updates a histogram as data comes in."""
     enable = Bool()
@@ -166,10 +181,10 @@ class HistogramGrid(ROIAnalysis):
             # all_shots_array will be shape (measurements,shots,rois)
             # or (measurements, sub-measurements shots, rois)
             data_path = self.ROI_source.iter_analysis_path
-            all_shots_array = iteration_results[data_path].value
-            # flatten sub-measurements
-            if len(all_shots_array.shape) == 4:
-                all_shots_array = all_shots_array.reshape(-1, *all_shots_array.shape[2:])
+            all_shots_array = shots_by_roi(
+                iteration_results[data_path].value,
+                isinstance(self.ROI_source, SquareROIAnalysis)
+            )
 
             # perform histogram calculations and fits on all shots and regions
             self.calculate_all_histograms(all_shots_array)
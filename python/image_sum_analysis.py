@@ -29,7 +29,10 @@ class ImageSumAnalysis(AnalysisWithFigure):
     enable = Bool()
     sum_array = Member()  # holds the sum of each shot
     count_array = Member()  # holds the number of measurements summed
-    mean_array = Member()  # holds the mean image for each shot
+    mean_array = Member()  # holds the mean image for each shot, computed on demand by get_mean()
+    mean_stale = Bool(True)  # True if sum_array has changed since mean_array was computed
+    frame_buffer = Member()  # preallocated buffer that each measurement's shots are read into
+    scratch = Member()  # preallocated buffer for the background subtracted min/max
     background_array = Member()
     showROIs = Bool(False)  # should we superimpose ROIs?
     shot = Int()  # which shot to display
@@ -58,7 +61,21 @@ class ImageSumAnalysis(AnalysisWithFigure):
         self.measurementDependencies += [self.experiment.squareROIAnalysis]
 
     def set_background(self):
-        self.background_array = self.mean_array[self.shot]
+        # copy, because the mean_array buffer is reused
+        self.background_array = np.array(self.get_mean()[self.shot])
+
+    def get_mean(self):
+        """Returns the mean image for each shot, computing it from the running sum only if it has changed."""
+        if self.count_array is None:
+            return None
+        if self.mean_stale:
+            if (self.mean_array is None) or (self.mean_array.shape != self.sum_array.shape):
+                self.mean_array = np.empty_like(self.sum_array)
+            # broadcast the per shot count over the image dimensions
+            count = self.count_array.reshape((-1,) + (1,)*(self.sum_array.ndim - 1))
+            np.divide(self.sum_array, count, out=self.mean_array)
+            self.mean_stale = False
+        return self.mean_array
 
     def preExperiment(self, experimentResults):
         # call therading setup code
@@ -74,44 +91,58 @@ class ImageSumAnalysis(AnalysisWithFigure):
             self.pdf_path = os.path.join(pdf_path, '{}_image_mean'.format(self.experiment.experimentPath))
 
     def preIteration(self, iterationResults, experimentResults):
-        #clear old data
-        self.mean_array = None
+        #clear old data, the buffers are kept and zeroed on the first measurement
+        self.count_array = None
+        self.mean_stale = True
 
     def analyzeMeasurement(self, measurementResults, iterationResults, experimentResults):
 
         self.iteration = iterationResults.attrs['iteration']
-        #print("shots_path ", self.shots_path)
-        #print([el for el in measurementResults])#, measurementResults.value)
         if self.shots_path in measurementResults:
-            if self.mean_array is None:
-                #print("None", [el for el in measurementResults[self.shots_path].itervalues()])
-                #start a sum array of the right shape
-                self.sum_array = np.array([shot for shot in measurementResults[self.shots_path].itervalues()], dtype=np.float64)
-                self.count_array = np.zeros(len(self.sum_array), dtype=np.float64)
-                self.mean_array = self.sum_array.astype(np.float64)
-
+            shots = list(measurementResults[self.shots_path].itervalues())
+            shape = (len(shots),) + shots[0].shape
+            if (self.frame_buffer is None) or (self.frame_buffer.shape != shape):
+                # (re)allocate for a new camera configuration
+                self.frame_buffer = np.empty(shape, dtype=np.float64)
+                self.sum_array = np.zeros(shape, dtype=np.float64)
+                self.scratch = np.empty(shape[1:], dtype=np.float64)
+                self.count_array = None
+            # read every shot straight into the stacked float buffer, hdf5 does the type conversion
+            for i, shot in enumerate(shots):
+                shot.read_direct(self.frame_buffer[i])
+            if self.count_array is None:
+                #start a new sum
+                self.sum_array[...] = self.frame_buffer
+                self.count_array = np.ones(len(shots), dtype=np.float64)
             else:
                 #add new data
-                #print("Some", [el for el in measurementResults[self.shots_path].itervalues()])
-                for i, shot in enumerate(measurementResults[self.shots_path].itervalues()):
-                    #print shot.value
-                    self.sum_array[i] += shot
-                    self.count_array[i] += 1.0
-                    self.mean_array[i] = self.sum_array[i]/self.count_array[i]
+                np.add(self.sum_array, self.frame_buffer, out=self.sum_array)
+                self.count_array += 1.0
+            # the mean is only recalculated when someone asks for it
+            self.mean_stale = True
             self.update_min_max()
             self.updateFigure()  # only update figure if image was loaded
 
     def update_min_max(self):
-        if (self.mean_array is not None) and (self.shot < len(self.mean_array)):
-            #update the min/max that this and other image plots will use
-            if self.min_str == '':
-                self.min = np.amin(self.mean_array[self.shot])
+        if (self.count_array is not None) and (self.shot < len(self.count_array)):
+            # The mean image is sum/count, so its min and max can be taken from the sum without forming the mean.
+            shot_sum = self.sum_array[self.shot]
+            count = self.count_array[self.shot]
+            if self.subtract_background and ((self.min_str == '') or (self.max_str == '')):
+                # form the background subtracted mean in a reusable buffer rather than a temporary
                 try:
-                    if self.subtract_background:
-                        self.min_minus_bg = np.amin(self.mean_array[self.shot]-self.background_array)
+                    np.divide(shot_sum, count, out=self.scratch)
+                    np.subtract(self.scratch, self.background_array, out=self.scratch)
+                    bg_ok = True
                 except:
-                    logger.warning('Could not subtract background array to create min in ImageSumAnalysis.analyzeMeasurement')
-                    logger.warning('array shapes: mean_array: {} background_array: {}'.format(self.mean_array[self.shot].shape, self.background_array.shape))
+                    bg_ok = False
+                    logger.warning('Could not subtract background array to create min/max in ImageSumAnalysis.analyzeMeasurement')
+                    logger.warning('array shapes: mean_array: {} background_array: {}'.format(shot_sum.shape, np.shape(self.background_array)))
+            #update the min/max that this and other image plots will use
+            if self.min_str == '':
+                self.min = np.amin(shot_sum)/count
+                if self.subtract_background and bg_ok:
+                    self.min_minus_bg = np.amin(self.scratch)
             else:
                 try:
                     self.min = float(self.min_str)
@@ -119,12 +150,9 @@ class ImageSumAnalysis(AnalysisWithFigure):
                 except:
                     logger.warning('Could not cast string to float in to create min in ImageSumAnalysis.analyzeMeasurement')
             if self.max_str == '':
-                self.max = np.amax(self.mean_array[self.shot])
-                try:
-                    if self.subtract_background:
-                        self.max_minus_bg = np.amax(self.mean_array[self.shot]-self.background_array)
-                except:
-                    logger.warning('Could not subtract background array to create max in ImageSumAnalysis.analyzeMeasurement')
+                self.max = np.amax(shot_sum)/count
+                if self.subtract_background and bg_ok:
+                    self.max_minus_bg = np.amax(self.scratch)
             else:
                 try:
                     self.max = float(self.max_str)
@@ -133,9 +161,9 @@ class ImageSumAnalysis(AnalysisWithFigure):
                     logger.warning('Could not cast string to float in to create max in ImageSumAnalysis.analyzeMeasurement')
 
     def analyzeIteration(self, iterationResults, experimentResults):
-        if self.enable:
+        if self.enable and (self.count_array is not None):
             iterationResults['sum_array'] = self.sum_array
-            iterationResults['mean_array'] = self.mean_array
+            iterationResults['mean_array'] = self.get_mean()
 
             # create image of all shots for pdf
             self.savefig(iterationResults.attrs['iteration'])
@@ -153,7 +181,7 @@ class ImageSumAnalysis(AnalysisWithFigure):
         try:
             # save to PDF
             if self.experiment.saveData:
-                for shot in xrange(self.mean_array.shape[0]):
+                for shot in xrange(len(self.get_mean())):
 
                     fig = plt.figure(figsize=(8, 6))
                     dpi = 80
@@ -168,17 +196,18 @@ class ImageSumAnalysis(AnalysisWithFigure):
 
 
     def draw_figure(self, fig, iteration, shot):
-        if (self.mean_array is not None) and (shot < len(self.mean_array)):
+        mean_array = self.get_mean()
+        if (mean_array is not None) and (shot < len(mean_array)):
             #gs = GridSpec(1, 2, width_ratios=[20, 1])
             #ax = fig.add_subplot(gs[0, 0])
             ax = fig.add_subplot(111)
 
             if self.subtract_background:
-                data = self.mean_array[shot] - self.background_array
+                data = mean_array[shot] - self.background_array
                 min = self.min_minus_bg
                 max = self.max_minus_bg
             else:
-                data = self.mean_array[shot]
+                data = mean_array[shot]
                 min = self.min
                 max = self.max
 
@@ -14,9 +14,28 @@ from cs_errors import PauseError
 from atom.api import Atom, Str, Bool, Int, Float, List, Member, Value, observe
 from enaml.application import deferred_call
 
-import pickle, h5py, numpy
+import pickle, h5py, numpy, hashlib, uuid
 import cs_evaluate
 
+# the HDF5 attribute that holds the content hash of a saved Prop, so that unchanged Props can be copied from the
+# previous settings file instead of being serialized again
+SETTINGS_HASH = 'settings_hash'
+
+
+def value_hash(o, memo):
+    """A content hash of one item of a Prop's properties list.  If the content cannot be identified, a random string is
+    returned, so that the item is always saved."""
+    if hasattr(o, 'settings_hash'):
+        return o.settings_hash(memo)
+    if isinstance(o, numpy.ndarray) and not o.dtype.hasobject:
+        return '{}{}{}'.format(o.dtype.str, o.shape, hashlib.sha1(numpy.ascontiguousarray(o)).hexdigest())
+    if isinstance(o, (basestring, int, long, float, bool, numpy.generic)) or (o is None):
+        return type(o).__name__ + repr(o)
+    try:
+        return hashlib.sha1(pickle.dumps(o)).hexdigest()
+    except Exception:
+        return uuid.uuid4().hex
+
 
 # class myBool(Bool):
 #     """This class extends an Atom.Bool to make it more robust against loading settings from HDF5.
@@ -75,6 +94,43 @@ class Prop(Atom):
             #if self.GUI is not None and hasattr(self.GUI, 'update'):
             #    self.GUI.update()
 
+    def settings_hash(self, memo):
+        """A content hash of this Prop and everything below it.  memo holds the hashes of the Props already visited
+        during this save, by id."""
+        key = id(self)
+        if key not in memo:
+            h = hashlib.sha1(type(self).__name__)
+            for p in self.properties:
+                h.update(p)
+                h.update(value_hash(getattr(self, p, None), memo))
+            memo[key] = h.hexdigest()
+        return memo[key]
+
+    def copy_unchanged_HDF5(self, hdf_parent_node, name):
+        """During an incremental settings save, copy this Prop's group from the previous settings file if its content
+        has not changed since then.  Returns the new node, or None if the Prop must be saved."""
+        memo = getattr(self.experiment, 'settings_hashes', None)
+        previous = getattr(self.experiment, 'previous_settings', None)
+        if (memo is None) or (previous is None) or (name in hdf_parent_node):
+            return None
+        path = hdf_parent_node.name.rstrip('/') + '/' + name
+        if (path in previous) and (previous[path].attrs.get(SETTINGS_HASH) == self.settings_hash(memo)):
+            previous.copy(previous[path], hdf_parent_node, name)
+            return hdf_parent_node[name]
+        return None
+
+    def mark_HDF5(self, node):
+        """Store the content hash of this Prop on its node during an incremental settings save.  On any other save the
+        hashes of the node and its parents are removed, as they may no longer match what is stored."""
+        memo = getattr(self.experiment, 'settings_hashes', None)
+        if memo is not None:
+            node.attrs[SETTINGS_HASH] = self.settings_hash(memo)
+            return
+        while node.name != '/':
+            if SETTINGS_HASH in node.attrs:
+                del node.attrs[SETTINGS_HASH]
+            node = node.parent
+
     def toHDF5(self, hdf_parent_node, name=None):
         """This function provides generic behavior to save a Prop as an HDF5 group.  The choice of group has been made
         because a Prop in general can have subproperties, and using a dataset would limit this behavior.  We go through
@@ -88,6 +144,11 @@ class Prop(Atom):
             #if no name suggestion is given (usually used for ListProps) then use self.name
             name = self.name
 
+        #if nothing changed since the last settings save, copy the group from there
+        my_node = self.copy_unchanged_HDF5(hdf_parent_node, name)
+        if my_node is not None:
+            return my_node
+
         #create the group that represents this Prop
         try:
             my_node = hdf_parent_node.require_group(name)
@@ -145,6 +206,7 @@ class Prop(Atom):
                             except:
                                 logger.exception('While picking '+p+' in Prop.toHDF5() in')
                                 raise PauseError
+        self.mark_HDF5(my_node)
         return my_node
 
     def fromHDF5(self, hdf):
@@ -170,7 +232,7 @@ class Prop(Atom):
 
         #go through all attributes of hdf node and try to load them
         for i in hdf.attrs:
-            if i != 'version':
+            if i not in ('version', SETTINGS_HASH):
                 #check to see if this is one of the properties we care to load
                 if i not in self.properties:
                     logger.info('Prop.fromHDF5(): HDF5 has attribute: '+i+', but this is not in the '+self.name+'.properties list.  It will not be loaded.\n')
@@ -654,6 +716,11 @@ class ListProp(Prop):
         """ListProp has a special toHDF5 method because we do not save any of the normal properties for a listProp.
           It would be confusing to do so, as that is not what a ListProp is for."""
 
+        #if nothing changed since the last settings save, copy the group from there
+        list_node = self.copy_unchanged_HDF5(hdf, self.name)
+        if list_node is not None:
+            return list_node
+
         list_node=hdf.require_group(self.name)
 
         #go through the listProperty and toHDF5 each item
@@ -672,8 +739,20 @@ class ListProp(Prop):
                 except Exception as e:
                     logger.exception('Uncaught exception on list item {} in ListProp.toHDF5item() in {}.'.format(i,self.name))
                     raise PauseError
+        self.mark_HDF5(list_node)
         return list_node
 
+    def settings_hash(self, memo):
+        """Only the listProperty is saved, so only it is hashed."""
+        key = id(self)
+        if key not in memo:
+            h = hashlib.sha1(type(self).__name__)
+            for i, o in enumerate(self.listProperty):
+                h.update(str(getattr(o, 'name', i)))
+                h.update(value_hash(o, memo))
+            memo[key] = h.hexdigest()
+        return memo[key]
+
     def toHDF5item(self, list_node, name, o):
         #try to save it in various ways
         if hasattr(o, 'toHDF5'):
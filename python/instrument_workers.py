@@ -0,0 +1,131 @@
+"""instrument_workers.py
+Part of the CsPyController experiment control software
+
+created = 2026.10.19
+
+Persistent worker threads for instruments that can be read out concurrently,
+such as several cameras in one container instrument (Andors, PICams).  Each
+instrument is always driven from the same worker thread, so thread-local driver
+state (e.g. the Andor SDK current camera) is not shuffled between threads, and
+no thread is created per measurement.
+
+The output instruments (HSDIO, AnalogOutput, DAQmxDO) use the same workers to
+compile their waveforms side by side, so that an iteration waits for the
+slowest instrument instead of the sum of them.
+
+Only the readout is run on the workers.  Writing to hdf5 stays on the
+experiment thread, because h5py is not thread safe.
+"""
+
+import logging
+import sys
+import threading
+import time
+import Queue
+
+from cs_errors import PauseError
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+    """A function call handed to an InstrumentWorker.  wait() blocks until the
+    call has finished, after which either result or exc_info is set."""
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.exc_info = None
+        self.elapsed = None  # seconds the call took
+        self.done = threading.Event()
+
+    def run(self):
+        start = time.time()
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.elapsed = time.time() - start
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """Returns True if the job finished within timeout seconds."""
+        return self.done.wait(timeout)
+
+
+class InstrumentWorker(object):
+    """A daemon thread that runs submitted jobs one at a time, in order."""
+
+    def __init__(self, name='instrument_worker'):
+        self.jobs = Queue.Queue()
+        self.thread = threading.Thread(target=self.loop, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            job.run()
+
+    def submit(self, func, *args):
+        job = Job(func, args)
+        self.jobs.put(job)
+        return job
+
+    def stop(self):
+        """Let the thread exit once the jobs already submitted are done."""
+        self.jobs.put(None)
+
+
+def call_in_parallel(instruments, workers, method, timeout=None):
+    """Call the named method on each instrument from its persistent worker and
+    wait for all of them.
+
+    workers is a dict of instrument -> InstrumentWorker owned by the caller, and
+    is filled in as needed.  Each instrument gets timeout seconds from the start
+    of the call, or as long as it takes if timeout is None.  Every instrument is
+    waited on before any failure is reported, so that a failure in one
+    instrument does not leave the others midway.
+    Returns a list of (instrument, result, elapsed seconds), in order.
+    Raises PauseError if any instrument failed or timed out.
+    """
+    jobs = []
+    for instrument in instruments:
+        worker = workers.get(instrument)
+        if worker is None:
+            worker = InstrumentWorker(name='{}_worker'.format(instrument.name))
+            workers[instrument] = worker
+        jobs.append((instrument, worker.submit(getattr(instrument, method))))
+
+    if timeout is not None:
+        deadline = time.time() + timeout
+    failed = []
+    for instrument, job in jobs:
+        if not job.wait(None if timeout is None else max(0, deadline - time.time())):
+            logger.error('{} did not finish {} within {} s.'.format(instrument.name, method, timeout))
+            failed.append(instrument.name)
+        elif job.exc_info is not None:
+            if not issubclass(job.exc_info[0], PauseError):  # a PauseError has already been logged
+                logger.error('Problem in {}.{}.'.format(instrument.name, method), exc_info=job.exc_info)
+            failed.append(instrument.name)
+    if failed:
+        raise PauseError
+    return [(instrument, job.result, job.elapsed) for instrument, job in jobs]
+
+
+def acquire_in_parallel(instruments, workers, timeout):
+    """Call acquire_data() on each instrument from its persistent worker and
+    wait for all of them.  See call_in_parallel.
+    """
+    call_in_parallel(instruments, workers, 'acquire_data', timeout)
+
+
+def stop_workers(workers):
+    """Stop and forget all the workers in a dict made by acquire_in_parallel."""
+    for worker in workers.itervalues():
+        worker.stop()
+    workers.clear()
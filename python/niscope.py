@@ -52,6 +52,7 @@ except:
 # imports for viewer
 from analysis import AnalysisWithFigure, Analysis
 from enaml.application import deferred_call
+from video import VideoEngine, Blitter, downsampled
 
 class NIScopeInstrument(Instrument):
 
@@ -61,6 +62,7 @@ class NIScopeInstrument(Instrument):
     FFTdata = Member()
     mode = Str('experiment')  # experiment vs. video
     analysis = Member()  # holds a link to the GUI display
+    video = Member()  # VideoEngine running while in video mode
     
     scope = Member()
 
@@ -207,16 +209,21 @@ class NIScopeInstrument(Instrument):
 
 
     def start_video_thread(self):
-        while self.mode == 'video':
-            if self.getData():
-                # if there is new data, then redraw image
-                self.analysis.redraw_video()
-            time.sleep(.1)
+        # the scope has no new-trace event, so getData is polled adaptively
+        self.video = VideoEngine(
+            '{}_video'.format(self.name),
+            self.getData,
+            lambda: self.data,
+            self.analysis.redraw_video
+        )
+        self.video.start()
 
     def stop_video(self):
         # stop the video thread from looping
         self.mode = 'idle'
-        time.sleep(.01)
+        if self.video is not None:
+            self.video.stop()
+            self.video = None
         self.AbortAcquisition()
 
     def acquire_data(self):
@@ -260,6 +267,7 @@ class NIScopeViewer(AnalysisWithFigure):
     FFTdata = Member()
     update_lock = Bool(False)
     artist = Member()
+    blitter = Member()  # redraws artist in video mode
     mycam=Member()
 
     maxPixel0 = Float(0)
@@ -349,20 +357,25 @@ class NIScopeViewer(AnalysisWithFigure):
         fig.clf()
         ax = fig.add_subplot(111)
 
-        self.artist = ax.plot(data)
+        #data format: 0: x values, 1: CH0 y, 2: CH1 y
+        self.artist = ax.plot(data[0], data[1], 'b-', data[0], data[2], 'r-')
+        self.blitter = Blitter(self.artist)
         super(NIScopeViewer, self).updateFigure()
 
-    def redraw_video(self):
-        """First update self.data using NIScope methods, then redraw screen using this."""
-        if (self.mycam.autoscale):
-            self.artist.autoscale()
-        else:
-            self.artist.set_data(self.data)
-        deferred_call(self.figure.canvas.draw)
-        self.maxPixel0 = numpy.max(self.data[1])
-        self.meanPixel0 = numpy.mean(self.data[1])
-        self.maxPixel1 = numpy.max(self.data[2])
-        self.meanPixel1 = numpy.mean(self.data[2])
+    def redraw_video(self, frame=None):
+        """Draw a video trace.  Called on the GUI thread by the scope's
+        VideoEngine with the newest trace."""
+        if frame is None:
+            frame = self.data
+        self.artist[0].set_data(frame[0], frame[1])
+        self.artist[1].set_data(frame[0], frame[2])
+        self.blitter.draw()
+        ch0 = downsampled(frame[1])
+        ch1 = downsampled(frame[2])
+        self.maxPixel0 = numpy.max(ch0)
+        self.meanPixel0 = numpy.mean(ch0)
+        self.maxPixel1 = numpy.max(ch1)
+        self.meanPixel1 = numpy.mean(ch1)
 
 
 class NIScope(Instrument):
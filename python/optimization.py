@@ -11,10 +11,25 @@ The analysis evaluates how good the current set point is, based on the results o
 The set point is then updated by the optimization routine.
 
 Three methods are available:  Nelder-Mead simplex, gradient descent, and genetic.
+A surrogate model (Bayesian) method fits a Gaussian process to all the costs measured so far, and picks the next point
+by expected improvement, to reach a good point in fewer experiment loops.
+
+A method may propose a batch of points at once, by yielding a 2D array (one row per point) instead of a single point.
+Each point of a batch is run as its own experiment, back to back, and the method is only resumed once the whole batch
+has been measured, with the costs in self.batch_yi (in the same order as the rows).  Points that do not depend on each
+other's costs, such as the simplex exploration and reduction steps, the gradient axes, and a generation of the genetic
+method, are proposed as batches.
 
 The cost function is specified on the front panel, and must define 'self.yi ='
+It is compiled once per experiment, and runs in its own namespace holding numpy, self, hdf5, experimentResults, and
+the iteration level results of the analyses (see COST_FUNCTION_AGGREGATES) stacked into arrays with one row per
+iteration, so it does not have to walk through the measurements, and scan_plan, the planned ivar indices and values of
+those iterations (see scan_planner; optimized ivars take the optimizer's values instead).  Only the results that the
+cost function refers to by name are read, so they cannot be reached through globals() or eval.
+It may also set 'self.y_stat_sigma ='
 For example:
-self.yi = -numpy.sum(numpy.array([m['analysis/squareROIthresholded'][1] for m in iterationResults['measurements'].itervalues()]))
+self.yi = -numpy.mean(retention)
+self.y_stat_sigma = numpy.sqrt(numpy.sum(retention_sigma**2))/retention_sigma.size
 """
 
 from __future__ import division
@@ -22,7 +37,7 @@ __author__ = 'Martin Lichtman'
 import logging
 logger = logging.getLogger(__name__)
 
-import traceback, os
+import traceback, os, threading
 import numpy
 from math import isnan
 
@@ -30,10 +45,43 @@ import matplotlib as mpl
 mpl.use('PDF')
 import matplotlib.pyplot as plt
 
+from scipy.stats import norm
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, RBF, WhiteKernel
+
 from atom.api import Bool, Member, Float, Int, Str
 from analysis import AnalysisWithFigure
 
 
+# the names under which iteration level analysis results are given to the cost function, and their path in each
+# iteration of the results file
+COST_FUNCTION_AGGREGATES = {
+    'roi_sums': 'analysis/square_roi/sums',
+    'thresholds': 'analysis/ROI_Thresholds/cuts',
+    'loading': 'analysis/loading_retention/loading',
+    'retention': 'analysis/loading_retention/retention',
+    'retention_sigma': 'analysis/loading_retention/retention_sigma',
+    'atoms': 'analysis/loading_retention/atoms',
+}
+
+
+def code_names(code):
+    """The global names that a code object, and any function or class defined in it, refers to."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names |= code_names(const)
+    return names
+
+
+def expected_improvement(mu, sigma, best):
+    """The expected amount by which a point with predicted cost mu and uncertainty sigma improves on (is lower than)
+    the best cost so far."""
+    sigma = numpy.maximum(sigma, 1e-12)
+    z = (best - mu) / sigma
+    return (best - mu) * norm.cdf(z) + sigma * norm.pdf(z)
+
+
 class Optimization(AnalysisWithFigure):
     """
     self.xi: initial values of the x-axis, i.e. variables themselves
@@ -66,14 +114,28 @@ class Optimization(AnalysisWithFigure):
     end_condition_step = Float(.0001)
     end_tolerances = Member()
     cost_function = Str()
+    compiled_cost_function = Member()  # the code object of cost_function
+    compiled_cost_function_text = Str()  # the cost_function text that was compiled
+    cost_function_names = Member()  # the global names that the compiled cost function refers to
     optimization_variables = Member()
     is_done = Bool()
     firstrun = Member()
+    batch_size = Int(1)  # the number of points proposed together by the genetic method
+    batch = Member()  # the points of the current batch (shape=(points,axes))
+    batch_number = Int()  # how many batches have been proposed
+    batch_yi = Member()  # the costs of the last completed batch
+    batch_y_stat_sigma = Member()  # the statistical uncertainty of the costs of the last completed batch
+    figure_lock = Member()  # held while the figure is drawn
+    figure_request_lock = Member()  # guards figure_dirty and figure_busy
+    figure_dirty = Bool()  # the history has changed since the background redraw started
+    figure_busy = Bool()  # a background redraw thread is running
 
     def __init__(self, name, experiment, description=''):
         super(Optimization, self).__init__(name, experiment, description)
+        self.figure_lock = threading.Lock()
+        self.figure_request_lock = threading.Lock()
         self.properties += ['version', 'enable', 'initial_step', 'line_search_initial_step', 'end_condition_step',
-                            'cost_function', 'optimization_method', 'enable_override']
+                            'cost_function', 'optimization_method', 'enable_override', 'batch_size']
 
     def setup(self, hdf5):
         """
@@ -98,6 +160,7 @@ class Optimization(AnalysisWithFigure):
 
             self.is_done = False
             self.firstrun = True  # so we can record the initial cost
+            self.compile_cost_function()
 
             # start all the independent variables at the value given for the 0th iteration
             self.xi = numpy.array([i.valueList[0] for i in self.optimization_variables], dtype=float)
@@ -112,17 +175,26 @@ class Optimization(AnalysisWithFigure):
             hdf5['analysis/optimizer'].create_dataset('values', [0, self.axes], maxshape=[None, self.axes])
             hdf5['analysis/optimizer'].create_dataset('costs', [0], maxshape=[None])
             hdf5['analysis/optimizer'].create_dataset('statistical_uncertainty', [0], maxshape=[None])
+            # which experiment and which batch each row of values and costs came from
+            hdf5['analysis/optimizer'].create_dataset('experiment_numbers', [0], maxshape=[None], dtype=int)
+            hdf5['analysis/optimizer'].create_dataset('batches', [0], maxshape=[None], dtype=int)
             hdf5['analysis/optimizer/best_values'] = numpy.zeros(self.axes, dtype=float)
             hdf5['analysis/optimizer/best_cost'] = numpy.inf
             hdf5['analysis/optimizer/best_experiment_number'] = 0
 
             #create a new generator to choose optimization points
-            methods = [self.simplex, self.genetic, self.gradient_descent, self.weighted_simplex, self.smart_simplex]
+            methods = [self.simplex, self.genetic, self.gradient_descent, self.weighted_simplex, self.smart_simplex,
+                       self.bayesian]
             self.generator = methods[self.optimization_method](self.xi)
 
             self.xlist = []
             self.ylist = []
             self.y_stat_sigma_list = []
+            # the initial point is a batch of one
+            self.batch = self.xi[numpy.newaxis]
+            self.batch_number = 0
+            self.batch_yi = []
+            self.batch_y_stat_sigma = []
             self.best_xi = None
             self.best_yi = numpy.inf
         else:
@@ -131,13 +203,13 @@ class Optimization(AnalysisWithFigure):
     def update(self, hdf5, experimentResults):
         if self.enable:
 
-            # evaluate the cost function, with access to all backend variables
-            # The cost function must define 'self.yi ='
-            # For example:
-            # self.yi = -numpy.sum(numpy.array([m['analysis/squareROIthresholded'][1] for m in iterationResults['measurements'].itervalues()]))
-
+            # evaluate the cost function, which must define 'self.yi ='
             try:
-                exec(self.cost_function, globals(), locals())
+                if self.cost_function != self.compiled_cost_function_text:
+                    # the cost function was edited during the experiment
+                    self.compile_cost_function()
+                namespace = self.cost_function_namespace(hdf5, experimentResults, self.cost_function_names)
+                exec(self.compiled_cost_function, namespace)
             except Exception as e:
                 logger.error('Exception evaluating cost function:\n{}\n{}'.format(e, traceback.format_exc()))
                 self.yi = numpy.inf
@@ -168,6 +240,12 @@ class Optimization(AnalysisWithFigure):
             bb = hdf5['analysis/optimizer/statistical_uncertainty']
             bb.resize(bb.len()+1, axis=0)
             bb[-1] = self.y_stat_sigma
+            # record which experiment and batch this point belongs to
+            experiment_number = experimentResults.attrs['experiment_number']
+            for name, value in (('experiment_numbers', experiment_number), ('batches', self.batch_number)):
+                c = hdf5['analysis/optimizer/'+name]
+                c.resize(c.len()+1, axis=0)
+                c[-1] = value
 
             if self.firstrun:
                 self.set_gui({'yi0_str': str(self.yi)})
@@ -178,7 +256,7 @@ class Optimization(AnalysisWithFigure):
                 # update instance variables; maybe it will be a good idea to establish a range to extract the best
                 self.best_xi = self.xi
                 self.best_yi = self.yi
-                self.best_experiment_number = experimentResults.attrs['experiment_number']
+                self.best_experiment_number = experiment_number
                 # update hdf5
                 hdf5['analysis/optimizer/best_values'][...] = self.xi
                 hdf5['analysis/optimizer/best_cost'][...] = self.yi
@@ -194,20 +272,99 @@ class Optimization(AnalysisWithFigure):
             self.set_gui({'yi_str': str(self.yi), 'best_yi_str': str(self.best_yi),
                           'best_experiment_number_str': str(self.best_experiment_number)})
 
-            # let the generator decide on the next point to look at
-            try:
-                self.xi = self.generator.next()
-            except StopIteration:
-                # the optimizer has reached an end condition
-                logger.info('optimizer reached end condition')
-                self.is_done = True
-                self.experiment.set_status('end')
-                return
+            # attribute this cost to its point in the batch
+            self.batch_yi.append(self.yi)
+            self.batch_y_stat_sigma.append(self.y_stat_sigma)
+            if len(self.batch_yi) < len(self.batch):
+                # run the next point of the batch
+                self.xi = self.batch[len(self.batch_yi)]
+            else:
+                # the batch is complete, let the generator decide on the next point or batch to look at
+                self.batch_yi = numpy.array(self.batch_yi)
+                self.batch_y_stat_sigma = numpy.array(self.batch_y_stat_sigma)
+                try:
+                    batch = self.generator.next()
+                except StopIteration:
+                    # the optimizer has reached an end condition
+                    logger.info('optimizer reached end condition')
+                    self.is_done = True
+                    self.experiment.set_status('end')
+                    return
+                # a single point is a batch of one
+                self.batch = numpy.array(batch, dtype=float, ndmin=2)
+                self.batch_number += 1
+                self.batch_yi = []
+                self.batch_y_stat_sigma = []
+                self.xi = self.batch[0]
+                if len(self.batch) > 1:
+                    logger.info('optimizer: batch {} of {} points'.format(self.batch_number, len(self.batch)))
             self.setVars(self.xi)
-            self.updateFigure()
+            self.update_figure_in_background()
         else:
             self.is_done = True
 
+    def compile_cost_function(self):
+        """Compile the cost function text once, instead of parsing it on every update."""
+        self.compiled_cost_function_text = self.cost_function
+        try:
+            self.compiled_cost_function = compile(self.cost_function, '<cost function>', 'exec')
+        except SyntaxError as e:
+            logger.error('Syntax error in cost function:\n{}'.format(e))
+            self.compiled_cost_function = compile('raise SyntaxError({!r})'.format(str(e)), '<cost function>', 'exec')
+        self.cost_function_names = code_names(self.compiled_cost_function)
+
+    def cost_function_namespace(self, hdf5, experimentResults, names=None):
+        """The variables available to the cost function.  Each entry of COST_FUNCTION_AGGREGATES that the analyses
+        stored for this experiment is read once per iteration and stacked into an array (iterations first).
+        If names is given, only the aggregates (and scan_plan) among them are read, so that a cost function does not
+        pay for the results it does not use."""
+        namespace = {'numpy': numpy, 'isnan': isnan, 'logger': logger, 'self': self, 'hdf5': hdf5,
+                     'experimentResults': experimentResults}
+        aggregates = COST_FUNCTION_AGGREGATES
+        if names is not None:
+            aggregates = {name: path for name, path in aggregates.iteritems() if name in names}
+        use_plan = (names is None) or ('scan_plan' in names)
+        iterations = []
+        if (aggregates or use_plan) and ('iterations' in experimentResults):
+            group = experimentResults['iterations']
+            numbers = sorted(group.keys(), key=int)
+            iterations = [group[i] for i in numbers]
+            # each optimizer loop runs through the scan plan from its start
+            if use_plan and ('scan_plan' in hdf5) and numbers:
+                plan = hdf5['scan_plan'][()]
+                namespace['scan_plan'] = plan[numpy.array(numbers, dtype=int) % len(plan)]
+        for name, path in aggregates.iteritems():
+            values = [i[path][()] for i in iterations if path in i]
+            if values:
+                namespace[name] = numpy.array(values)
+        return namespace
+
+    def update_figure_in_background(self):
+        """Redraw the cost history on a separate thread, so the next experiment loop does not wait for it.  If the
+        previous redraw has not finished, the thread draws again once it is done, so requests that come in the
+        meantime are combined into one redraw, but the newest points are always drawn."""
+        with self.figure_request_lock:
+            self.figure_dirty = True
+            if self.figure_busy:
+                return
+            self.figure_busy = True
+        thread = threading.Thread(target=self.update_figure_until_clean, name='optimizer figure')
+        thread.daemon = True
+        thread.start()
+
+    def update_figure_until_clean(self):
+        while True:
+            with self.figure_request_lock:
+                if not self.figure_dirty:
+                    self.figure_busy = False
+                    return
+                self.figure_dirty = False
+            with self.figure_lock:
+                try:
+                    self.updateFigure()
+                except Exception as e:
+                    logger.warning('Problem updating optimizer figure:\n{}\n{}'.format(e, traceback.format_exc()))
+
     def finalize(self, hdf5):
         if self.enable:
             # store the cost graph to a pdf
@@ -218,31 +375,39 @@ class Optimization(AnalysisWithFigure):
                         os.mkdir(pdf_path)
                     filename = os.path.join(pdf_path, '{}_optimizer.pdf'.format(self.experiment.experimentPath))
 
-                    fig = plt.figure(figsize=(22.5, 1.25*(1+len(self.optimization_variables))))
-                    dpi = 80
-                    fig.set_dpi(dpi)
-                    fig.suptitle(self.experiment.experimentPath)
-                    self.draw_figure(fig)
-                    plt.savefig(filename,
-                                format='pdf', dpi=dpi, transparent=True, bbox_inches='tight',
-                                pad_inches=.25, frameon=False)
-                    plt.close(fig)
+                    # matplotlib is not thread safe, so wait for a background redraw to finish
+                    with self.figure_lock:
+                        fig = plt.figure(figsize=(22.5, 1.25*(1+len(self.optimization_variables))))
+                        dpi = 80
+                        fig.set_dpi(dpi)
+                        fig.suptitle(self.experiment.experimentPath)
+                        self.draw_figure(fig)
+                        plt.savefig(filename,
+                                    format='pdf', dpi=dpi, transparent=True, bbox_inches='tight',
+                                    pad_inches=.25, frameon=False)
+                        plt.close(fig)
                 except Exception as e:
                     logger.warning('Problem saving optimizer pdf:\n{}\n'.format(e))
 
     def draw_figure(self, fig):
+        # copy the history, which may grow on the experiment thread while this draws
+        n = min(len(self.xlist), len(self.ylist), len(self.y_stat_sigma_list))
+        ylist = self.ylist[:n]
+        y_stat_sigma_list = self.y_stat_sigma_list[:n]
+        xlist = self.xlist[:n]
+
         # plot cost
         ax = fig.add_subplot(self.axes+2, 1, 1)
-        ax.plot(self.ylist)
+        ax.plot(ylist)
         ax.set_ylabel('cost')
 
         # plot cost with statistical error bars
         ax = fig.add_subplot(self.axes+2, 1, 2)
-        ax.errorbar(range(len(self.ylist)), self.ylist, yerr=self.y_stat_sigma_list, fmt='o')
+        ax.errorbar(range(n), ylist, yerr=y_stat_sigma_list, fmt='o')
         ax.set_ylabel('cost with error bar')
 
         # plot settings
-        d = numpy.array(self.xlist).T
+        d = numpy.array(xlist).T
         for i in range(self.axes):
             ax = fig.add_subplot(self.axes+2, 1, i+3)
             ax.plot(d[i])
@@ -274,16 +439,18 @@ class Optimization(AnalysisWithFigure):
         xi = x0
         while True:  # TODO:  Some exit condition?  We don't have any notion of reducing step size for this algorithm.
 
-            # take random step on each axis, gaussian distribution with mean=0 and variance=initial_step
-            x_test = xi + self.initial_step * numpy.random.randn(self.axes)
+            # take random step on each axis, gaussian distribution with mean=0 and variance=initial_step,
+            # for each of the batch_size points in this generation
+            x_test = xi + self.initial_step * numpy.random.randn(max(self.batch_size, 1), self.axes)
 
-            # test the new point
+            # test the new points
             yield x_test
 
-            # if the new point is better, keep it
-            if self.yi < yi:
-                xi = x_test
-                yi = self.yi
+            # if the best new point is better, keep it
+            best = numpy.argmin(self.batch_yi)
+            if self.batch_yi[best] < yi:
+                xi = x_test[best]
+                yi = self.batch_yi[best]
 
     def gradient_descent(self, x0):
         """An optimization algorithm that finds the local gradient, then moves in the direction of fastest descent.
@@ -295,16 +462,12 @@ class Optimization(AnalysisWithFigure):
         step_size = self.line_search_initial_step
         y0 = self.yi
         while True:
-            # find gradient at the current point by making a small move on each axis
-            dx = numpy.zeros(axes)
-            dy = numpy.zeros(axes)
-            for i in xrange(axes):
-                logger.info('testing gradient on axis' + str(i))
-                x_test = x0.copy()
-                x_test[i] += self.initial_step[i]
-                yield x_test
-                dx[i] = x_test[i]-x0[i]
-                dy[i] = self.yi-y0
+            # find gradient at the current point by making a small move on each axis, all axes in one batch
+            logger.info('testing gradient on {} axes'.format(axes))
+            x_test = x0 + numpy.diag(self.initial_step)
+            yield x_test
+            dx = numpy.diagonal(x_test)-x0
+            dy = self.batch_yi-y0
             gradient = dy / dx
 
             # try a point in this new direction
@@ -359,15 +522,11 @@ class Optimization(AnalysisWithFigure):
         y[0] = self.yi
 
         # for the first several measurements, we just explore the cardinal axes to create the simplex
-        for i in xrange(axes):
-            logger.info('simplex: exploring axis' + str(i))
-            # for the new settings, start with the initial settings and then modify them by unit vectors
-            xi = x0.copy()
-            # add the initial step size as the first offset
-            xi[i] += self.initial_step[i]
-            yield xi
-            x[i+1] = xi
-            y[i+1] = self.yi
+        logger.info('simplex: exploring {} axes'.format(axes))
+        # for the new settings, start with the initial settings and then add the initial step size along each axis
+        x[1:] = x0 + numpy.diag(self.initial_step)
+        yield x[1:].copy()
+        y[1:] = self.batch_yi
 
         logger.debug('Finished simplex exploration.')
 
@@ -444,11 +603,10 @@ class Optimization(AnalysisWithFigure):
                     # we don't technically need to re-evaluate x[0] here, as it does not change
                     # however, due to noise in the system it is preferable to re-evaluate x[0] occasionally,
                     # and now is a good time to do it
-                    for i in xrange(axes):
-                        x[i] = x[0]+d*(x[i]-x[0])
-                        # yield so we can take a datapoint
-                        yield x[i]
-                        y[i] = self.yi
+                    x[:axes] = x[0]+d*(x[:axes]-x[0])
+                    # yield so we can take a datapoint at all the reduced points in one batch
+                    yield x[:axes].copy()
+                    y[:axes] = self.batch_yi
 
 
     #Nelder-Mead downhill simplex method using a weighted centroid
@@ -469,15 +627,11 @@ class Optimization(AnalysisWithFigure):
         y[0] = self.yi
 
         # for the first several measurements, we just explore the cardinal axes to create the simplex
-        for i in xrange(axes):
-            logger.info('simplex: exploring axis' + str(i))
-            # for the new settings, start with the initial settings and then modify them by unit vectors
-            xi = x0.copy()
-            # add the initial step size as the first offset
-            xi[i] += self.initial_step[i]
-            yield xi
-            x[i+1] = xi
-            y[i+1] = self.yi
+        logger.info('simplex: exploring {} axes'.format(axes))
+        # for the new settings, start with the initial settings and then add the initial step size along each axis
+        x[1:] = x0 + numpy.diag(self.initial_step)
+        yield x[1:].copy()
+        y[1:] = self.batch_yi
 
         logger.debug('Finished simplex exploration.')
 
@@ -556,11 +710,10 @@ class Optimization(AnalysisWithFigure):
                     # we don't technically need to re-evaluate x[0] here, as it does not change
                     # however, due to noise in the system it is preferable to re-evaluate x[0] occasionally,
                     # and now is a good time to do it
-                    for i in xrange(axes):
-                        x[i] = x[0]+d*(x[i]-x[0])
-                        # yield so we can take a datapoint
-                        yield x[i]
-                        y[i] = self.yi
+                    x[:axes] = x[0]+d*(x[:axes]-x[0])
+                    # yield so we can take a datapoint at all the reduced points in one batch
+                    yield x[:axes].copy()
+                    y[:axes] = self.batch_yi
 
     # Nelder-Mead downhill simplex method, with modifications to better suit AQuA reality
     def smart_simplex(self, x0): # i think this is the smart Nelder-mead
@@ -568,7 +721,8 @@ class Optimization(AnalysisWithFigure):
           robust against the slow/sudden drift experienced a lot in this experimental project.
         x is 2D array of settings.  y is a 1D array of costs at each of those settings.
         When comparisons are made, lower is better.
-        A note about yield: always yield one set of x, and then get the corresponding y.
+        A note about yield: yield one set of x and then get the corresponding self.yi, or yield a batch of x (2D)
+        and then get the corresponding self.batch_yi.
         """
 
         # x0 is assigned when this generator is created, but nothing else is done until the first time next() is called
@@ -581,15 +735,11 @@ class Optimization(AnalysisWithFigure):
         y[0] = self.yi
 
         # for the first several measurements, we just explore the cardinal axes to create the simplex
-        for i in xrange(axes):
-            logger.info('simplex: exploring axis' + str(i))
-            # for the new settings, start with the initial settings and then modify them by unit vectors
-            xi = x0.copy()
-            # add the initial step size as the first offset
-            xi[i] += self.initial_step[i]
-            yield xi
-            x[i+1] = xi
-            y[i+1] = self.yi
+        logger.info('simplex: exploring {} axes'.format(axes))
+        # for the new settings, start with the initial settings and then add the initial step size along each axis
+        x[1:] = x0 + numpy.diag(self.initial_step)
+        yield x[1:].copy()
+        y[1:] = self.batch_yi
 
         logger.debug('Finished simplex exploration.')
 
@@ -667,8 +817,65 @@ class Optimization(AnalysisWithFigure):
                     # we don't technically need to re-evaluate x[0] here, as it does not change
                     # however, due to noise in the system it is preferable to re-evaluate x[0] occasionally,
                     # and now is a good time to do it
-                    for i in xrange(axes):
-                        x[i] = x[0]+d*(x[i]-x[0])
-                        # yield so we can take a datapoint
-                        yield x[i]
-                        y[i] = self.yi
+                    x[:axes] = x[0]+d*(x[:axes]-x[0])
+                    # yield so we can take a datapoint at all the reduced points in one batch
+                    yield x[:axes].copy()
+                    y[:axes] = self.batch_yi
+
+    def bayesian(self, x0):
+        """Surrogate model optimization.  A Gaussian process is fit to all the points measured so far (xlist, ylist,
+        and y_stat_sigma_list as the noise on each cost), and the next point is the candidate with the largest expected
+        improvement over the best predicted cost.
+        Each variable's optimizer_initial_step is used as its length scale, and the optimization ends when three
+        proposals in a row are within optimizer_end_tolerance of the best point on every axis."""
+
+        axes = len(x0)
+        scale = numpy.where(self.initial_step > 0, self.initial_step, 1)
+        lower = numpy.array([i.optimizer_min for i in self.optimization_variables], dtype=float)
+        upper = numpy.array([i.optimizer_max for i in self.optimization_variables], dtype=float)
+
+        # start by stepping both ways along each axis, as one batch
+        logger.info('bayesian: exploring {} axes'.format(axes))
+        steps = numpy.diag(self.initial_step)
+        yield numpy.clip(numpy.concatenate([x0 + steps, x0 - steps]), lower, upper)
+
+        converged = 0
+        while converged < 3:
+            # work in units of the initial step, relative to the starting point
+            x = numpy.array(self.xlist)
+            u = (x - x0) / scale
+            y = numpy.array(self.ylist, dtype=float)
+            sigma = numpy.array(self.y_stat_sigma_list, dtype=float)
+            finite = numpy.isfinite(y)
+            if not numpy.any(finite):
+                logger.warning('bayesian: no finite costs yet, taking a random step')
+                yield numpy.clip(x0 + self.initial_step * numpy.random.randn(axes), lower, upper)
+                continue
+            # failed points (infinite cost) are treated as the worst point so far
+            y[~finite] = numpy.amax(y[finite])
+            y_mean = numpy.mean(y)
+            y_std = numpy.std(y)
+            if y_std == 0:
+                y_std = 1
+            kernel = (ConstantKernel(1.0, (1e-3, 1e3)) * RBF(numpy.ones(axes), (1e-2, 1e2)) +
+                      WhiteKernel(1e-2, (1e-6, 1)))
+            gp = GaussianProcessRegressor(kernel, alpha=(sigma / y_std)**2 + 1e-6)
+            gp.fit(u, (y - y_mean) / y_std)
+
+            # compare against the best predicted cost, which is less sensitive to noise than the best measured cost
+            mu = gp.predict(u)
+            best = numpy.argmin(mu)
+
+            # candidates are scattered around the best point at a few scales
+            candidates = numpy.concatenate([u[best] + s * numpy.random.randn(500, axes) for s in (3, 1, .3, .1)])
+            candidates = numpy.clip(candidates, (lower - x0) / scale, (upper - x0) / scale)
+            mu_c, sigma_c = gp.predict(candidates, return_std=True)
+            ei = expected_improvement(mu_c, sigma_c, mu[best])
+            x_next = x0 + candidates[numpy.argmax(ei)] * scale
+
+            if numpy.all(numpy.abs(x_next - x[best]) <= self.end_tolerances):
+                converged += 1
+            else:
+                converged = 0
+            logger.info('bayesian: expected improvement {}'.format(numpy.amax(ei) * y_std))
+            yield x_next
@@ -24,12 +24,14 @@ from atom.api import Int, Str, Member, Bool, Long
 from instrument_property import Prop, ListProp
 
 from analysis import Analysis
+from origin_publisher import Publisher, DROP_OLDEST, DROP_NEWEST
 
 from h5py import Dataset, File
 import traceback
 import os.path
 import inspect
 import time
+import re
 
 import numpy as np
 
@@ -135,6 +137,40 @@ class Stream(Prop):
         self.properties += ['name', 'dtype', 'stream', 'streamName', 'fullPath']
         self.properties += ['streamNameFull', 'channels', 'fieldsStr', 'fieldsList']
 
+    # ==========================================================================
+    def relative_path(self, level):
+        '''The path of the dataset within its measurement or iteration group,
+        taken from the full path it was first found at.  level is
+        'measurements' or 'iterations'.  Returns '' if the full path does not
+        contain that level.
+        '''
+        match = re.match(r'.*?/{}/[^/]+/(.+)'.format(level), self.fullPath)
+        if match is None:
+            return ''
+        return match.group(1)
+
+    # ==========================================================================
+    def read(self, dset, ts):
+        '''Take the data for the next record from the dataset, cast to the
+        stream's type if it differs.  Returns True if the data was read.
+        '''
+        if self.dtype == str(dset.dtype):
+            self.time = ts
+            channels, self.data = formatData(dset[()])
+            return True
+        try:
+            msg = 'Attempting to cast dataset `{}` of type `{}` to type `{}` to match stream definition.'
+            logger.debug(msg.format(self.name, dset.dtype, self.dtype))
+            data = eval('np.'+self.dtype+'(dset[()])')
+            channels, self.data = formatData(data)
+            self.time = ts
+            return True
+        except Exception as e:
+            logger.error('Uncaught Exception in origin.postExperiment:\n{}\n{}'.format(e, traceback.format_exc()))
+            msg = "Dataset `{}` type mismatch with stored type. new: `{}`, old: `{}`"
+            logger.error(msg.format(self.name, dset.dtype, self.dtype))
+            return False
+
     # ==========================================================================
     def new_entry(self, name, dset, ts):
         # initialize the non-user settable parameters
@@ -203,19 +239,8 @@ class Stream(Prop):
         # define the stream name with the experiment namespace
         self.streamNameFull = namespace + self.streamName
 
-        # build the records dictionary
-        records = { self.name: self.dtype }
-        if self.channels != 1:
-            records = {}
-            for i in xrange(self.channels):
-                records[str(i)] = self.dtype
-
         # register the stream
-        self.connection = server.registerStream(
-            stream=self.streamNameFull,
-            records=records,
-            timeout=20000
-        )
+        self.connection = self.registerStream(server)
 
         # error checking
         if not self.connection:
@@ -232,14 +257,36 @@ class Stream(Prop):
             return True
 
     # ==========================================================================
-    def logData(self):
+    def registerStream(self, server):
+        '''Register the stream with the server, and return the connection.
+        Also used by the publisher to reconnect.
+        '''
+        # build the records dictionary
+        records = { self.name: self.dtype }
+        if self.channels != 1:
+            records = {}
+            for i in xrange(self.channels):
+                records[str(i)] = self.dtype
+        return server.registerStream(
+            stream=self.streamNameFull,
+            records=records,
+            timeout=20000
+        )
+
+    # ==========================================================================
+    def record(self):
+        '''The current data as the keyword arguments for connection.send'''
         if self.channels == 1:
             data = { TIMESTAMP: self.time, self.name: self.data }
         else:
             data = { TIMESTAMP: self.time }
             for i, d in enumerate(self.data):
                 data[str(i)] = d
-        self.connection.send(**data)
+        return data
+
+    # ==========================================================================
+    def logData(self):
+        self.connection.send(**self.record())
         msg = 'Stream `{}` for dataset `{}` logged to Origin server.'
         logger.debug(msg.format(self.streamName, self.name))
 
@@ -279,6 +326,22 @@ class Origin(Analysis):
     #timeout = Typed(FloatProp)
     measurementDataList = Member()
     iterationDataList = Member()
+    # (path, stream) for each registered stream, with the path of its dataset
+    # relative to the measurement or iteration group.  Resolved in
+    # preExperiment so that each shot reads only the streamed datasets.
+    measurementPaths = Member()
+    iterationPaths = Member()
+    # crawl the first measurement and iteration of an experiment for new
+    # datasets that could be streamed
+    discoverMeasurement = Bool()
+    discoverIteration = Bool()
+    # sends the records from a background thread, kept across experiments
+    publisher = Member()
+    queueSize = Int()  # records held per stream while the server is slow
+    dropOldest = Bool()  # when a queue is full, drop the oldest record, otherwise the newest
+    recordsQueued = Int()
+    recordsSent = Int()
+    recordsDropped = Int()
     ts = Member()
     # hold the hdf5 group object so I can save resave the settings after the
     # experiment is finished
@@ -295,6 +358,10 @@ class Origin(Analysis):
         #self.timeout = FloatProp('timeout', experiment, 'how long before TCP gives up [s]', '1.0')
         self.isInitialized = False
         self.streamNameSpace = ''
+        self.measurementPaths = []
+        self.iterationPaths = []
+        self.queueSize = 1000
+        self.dropOldest = True
 
         self.measurementDataList = ListProp(
           'measurementDataList',
@@ -312,7 +379,7 @@ class Origin(Analysis):
         )
 
         self.properties += ['measurementDataList', 'iterationDataList', 'enable']
-        self.properties += ['streamNameSpace', 'version']
+        self.properties += ['streamNameSpace', 'version', 'queueSize', 'dropOldest']
 
         # threading stuff
         self.queueAfterMeasurement = True
@@ -363,6 +430,14 @@ class Origin(Analysis):
     def preExperiment(self, experimentResults):
         """This is called before an experiment."""
 
+        self.measurementPaths = []
+        self.iterationPaths = []
+        self.discoverMeasurement = self.enable
+        self.discoverIteration = self.enable
+        # a disabled Origin should cost nothing per measurement, so don't queue
+        # its measurements to wait on all the other analyses
+        self.queueAfterMeasurement = self.enable
+
         # check to make sure origin has been configured
         if self.IP == '':
             self.configure()
@@ -405,6 +480,16 @@ class Origin(Analysis):
 
         logger.debug('Registering streams...done')
         logger.debug('Origin streams registered: {}'.format(cnt))
+
+        self.measurementPaths = self.resolve(self.measurementDataList, 'measurements')
+        self.iterationPaths = self.resolve(self.iterationDataList, 'iterations')
+
+        if self.publisher is None:
+            self.publisher = Publisher()
+        self.publisher.size = max(1, self.queueSize)
+        self.publisher.policy = DROP_OLDEST if self.dropOldest else DROP_NEWEST
+        for path, item in self.measurementPaths + self.iterationPaths:
+            self.publisher.add_stream(item.streamNameFull, item.connection, self.reregister(item))
         logger.debug('Initializing Origin server interface...done')
         return 0
 
@@ -419,33 +504,35 @@ class Origin(Analysis):
         (measurementResult, iterationResult, experimentResult) references to HDF5
         nodes for this measurement.
         """
+        if not self.enable:
+            return 0
+
         # set TIMESTAMP
         self.ts = long(measurementResults.attrs.get('start_time')*2**32)  # ts when measurement was taken
-        measurementResults.visititems(self.processDatasets(self.measurementDataList, pass_measurement))
+        if self.discoverMeasurement:
+            # list any new datasets in the settings, once per experiment
+            self.discoverMeasurement = False
+            measurementResults.visititems(self.processDatasets(self.measurementDataList, pass_measurement))
 
         # process measurement data from hdf5 file
-        if not self.enable:
-            return 0
-
-        for i in self.measurementDataList:
-            if i.stream and not i.error:
-                i.logData()
+        self.send(self.readStreams(measurementResults, self.measurementPaths))
         return 0
 
     # ==========================================================================
     def analyzeIteration(self, iterationResults, experimentResults):
         # log any per iteration parameters here
-        # set TIMESTAMP
-        self.ts = long(time.time()*2**32)
-        # process iteration data from hdf5 file
-        iterationResults.visititems(self.processDatasets(self.iterationDataList, pass_iteration))
-
         if not self.enable:
             return 0
 
-        for i in self.iterationDataList:
-            if i.stream and not i.error:
-                i.logData()
+        # set TIMESTAMP
+        self.ts = long(time.time()*2**32)
+        if self.discoverIteration:
+            # list any new datasets in the settings, once per experiment
+            self.discoverIteration = False
+            iterationResults.visititems(self.processDatasets(self.iterationDataList, pass_iteration))
+
+        # process iteration data from hdf5 file
+        self.send(self.readStreams(iterationResults, self.iterationPaths))
         return 0
 
     # ==========================================================================
@@ -463,10 +550,75 @@ class Origin(Analysis):
             f.close()  # close the file
         return 0
 
+    # ==========================================================================
+    def postExperiment(self, experimentResults):
+        super(Origin, self).postExperiment(experimentResults)
+        # the publisher is kept for the next experiment, and sends what is
+        # still queued in the background, so do not wait for it here
+        if self.publisher is not None:
+            self.recordsQueued, self.recordsSent, self.recordsDropped = self.publisher.counters()
+            if self.recordsQueued:
+                logger.debug('{} records still queued for the Origin server.'.format(self.recordsQueued))
+        return 0
+
     # ==========================================================================
     def finalize(self,experimentResults):
         return 0
 
+    # ==========================================================================
+    def resolve(self, data_list, level):
+        '''Returns (path, stream) for each registered stream in the list, with
+        the path of its dataset relative to the measurement or iteration group.
+        '''
+        paths = []
+        for item in data_list:
+            if item.stream and not item.error:
+                path = item.relative_path(level)
+                if path:
+                    paths.append((path, item))
+                else:
+                    msg = 'Cannot tell where dataset `{}` is stored from `{}`, it will not be logged.'
+                    logger.warning(msg.format(item.name, item.fullPath))
+        return paths
+
+    # ==========================================================================
+    def readStreams(self, group, paths):
+        '''Read the streamed datasets directly from the hdf5 group.
+        Returns the (stream, record) pairs to send.
+        '''
+        batch = []
+        for path, item in paths:
+            dset = group.get(path)
+            if dset is None:
+                logger.debug('dataset `{}` not found in `{}`'.format(path, group.name))
+            elif item.read(dset, self.ts):
+                batch.append((item, item.record()))
+        return batch
+
+    # ==========================================================================
+    def reregister(self, item):
+        '''Returns a function for the publisher to get a new connection for
+        the stream, if the old one fails.
+        '''
+        def register():
+            return item.registerStream(self.server)
+        return register
+
+    # ==========================================================================
+    def send(self, batch):
+        '''Queue the records of one measurement or iteration together, once
+        every dataset has been read.  The publisher sends them in the
+        background.
+        '''
+        if self.publisher is None:
+            # no streams were registered, e.g. without a namespace
+            return
+        for item, record in batch:
+            self.publisher.publish(item.streamNameFull, record)
+        self.recordsQueued, self.recordsSent, self.recordsDropped = self.publisher.counters()
+        if batch:
+            logger.debug('{} streams queued for the Origin server.'.format(len(batch)))
+
     # ==========================================================================
     def newEntry(self, dset):
         return Stream(dset.name, self.experiment, dset, self.ts, '')
@@ -485,20 +637,6 @@ class Origin(Analysis):
                     for item in data_list:
                         if item.name == parsedName:
                             logger.debug("dataset `{}` already exists in list".format(parsedName))
-                            if item.dtype == str(obj.dtype):
-                                item.time = self.ts
-                                channels, item.data = formatData(obj[()])
-                            else:
-                                try:
-                                    msg = 'Attempting to cast dataset `{}` of type `{}` to type `{}` to match stream definition.'
-                                    logger.debug(msg.format(parsedName, obj.dtype, item.dtype))
-                                    data = eval('np.'+item.dtype+'(obj[()])')
-                                    channels, item.data = formatData(data)
-                                    item.time = self.ts
-                                except Exception as e:
-                                    logger.error('Uncaught Exception in origin.postExperiment:\n{}\n{}'.format(e, traceback.format_exc()))
-                                    msg = "Dataset `{}` type mismatch with stored type. new: `{}`, old: `{}`"
-                                    logger.error(msg.format(parsedName, obj.dtype, item.dtype))
                             append = False
                             break
                     if append:
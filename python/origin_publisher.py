@@ -0,0 +1,208 @@
+"""origin_publisher.py
+Part of the CsPyController experiment control software
+
+created = 2026.10.19
+
+Sends records to the Origin data server from a background thread, so that a
+slow or unreachable server never holds up the analysis of the measurements.
+
+Each stream has a bounded queue.  When a queue is full, either the oldest
+record is dropped to make room (DROP_OLDEST), or the new record is dropped
+(DROP_NEWEST).  The thread sends up to `batch` records of a stream at a time.
+If a send fails, the unsent records go back on the queue, and the stream is
+registered again after an exponentially growing wait.
+
+Counters of the records queued, sent and dropped are kept for the GUI.
+"""
+
+from __future__ import division
+import logging
+import threading
+import time
+from collections import deque, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop oldest'
+DROP_NEWEST = 'drop newest'
+
+
+class PublishedStream(object):
+    """The queue and connection for one stream."""
+
+    def __init__(self, name, connection, register):
+        self.name = name
+        self.connection = connection
+        self.given = connection  # the connection from add_stream, before any reconnect
+        # returns a new connection, or something false if the server could not be reached
+        self.register = register
+        self.records = deque()
+        self.backoff = 0  # seconds to wait before the next reconnect, 0 when connected
+        self.retry_time = 0
+
+
+class Publisher(object):
+    """A background sender of Origin records, with a bounded queue per stream.
+
+    publish() only appends to a queue and never waits on the server.
+    """
+
+    def __init__(self, size=1000, batch=100, policy=DROP_OLDEST, backoff=.5, max_backoff=30.):
+        self.size = size
+        self.batch = batch
+        self.policy = policy
+        self.min_backoff = backoff
+        self.max_backoff = max_backoff
+        self.streams = OrderedDict()
+        self.queued = 0  # records waiting to be sent
+        self.sent = 0
+        self.dropped = 0
+        self.sending = False
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.loop, name='origin_publisher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_stream(self, name, connection, register):
+        """Send the records published under name on connection.  register() is called to get a new connection if a
+        send fails.  Records already queued for a stream of the same name are kept."""
+        with self.condition:
+            stream = self.streams.get(name)
+            if stream is None:
+                self.streams[name] = PublishedStream(name, connection, register)
+            else:
+                stream.register = register
+                # a reconnected stream keeps its new connection, unless a new one is given
+                if connection is not stream.given:
+                    stream.connection = connection
+                    stream.given = connection
+                    stream.backoff = 0
+            self.condition.notify()
+
+    def publish(self, name, record):
+        """Queue a record (the keyword arguments for connection.send) for the named stream."""
+        with self.condition:
+            records = self.streams[name].records
+            if len(records) >= self.size:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                records.popleft()
+                self.queued -= 1
+            records.append(record)
+            self.queued += 1
+            self.condition.notify()
+
+    def counters(self):
+        """(queued, sent, dropped)"""
+        with self.condition:
+            return self.queued, self.sent, self.dropped
+
+    def flush(self, timeout):
+        """Wait up to timeout seconds for the queued records to be sent.  Returns True if they were."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.queued or self.sending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+    def stop(self, timeout=None):
+        """Stop the thread, waiting up to timeout seconds for it to finish a send in progress.  Returns True if it
+        did.  Records still queued are not sent."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def next_batch(self):
+        """Wait for a stream that has records and a connection, and take up to self.batch of its records.
+        Returns (stream, records), or (stream, None) for a stream that is due to reconnect, or (None, None) when
+        stopped.  Called with the condition held."""
+        while self.running:
+            now = time.time()
+            wait = None
+            for stream in self.streams.values():
+                if not stream.records:
+                    continue
+                if stream.backoff:
+                    if stream.retry_time <= now:
+                        return stream, None
+                    wait = stream.retry_time - now if wait is None else min(wait, stream.retry_time - now)
+                    continue
+                n = min(self.batch, len(stream.records))
+                records = [stream.records.popleft() for i in xrange(n)]
+                self.queued -= n
+                # rotate the streams, so that a busy stream does not starve the others
+                self.streams[stream.name] = self.streams.pop(stream.name)
+                return stream, records
+            self.condition.wait(wait)
+        return None, None
+
+    def loop(self):
+        while True:
+            with self.condition:
+                self.sending = False
+                self.condition.notify_all()
+                stream, records = self.next_batch()
+                if stream is None:
+                    return
+                self.sending = True
+                connection = stream.connection
+            if records is None:
+                self.reconnect(stream)
+            else:
+                self.send(stream, connection, records)
+
+    def send(self, stream, connection, records):
+        sent = 0
+        try:
+            for record in records:
+                connection.send(**record)
+                sent += 1
+        except Exception as e:
+            logger.warning('Lost the Origin connection for stream `{}`: {}'.format(stream.name, e))
+            try:
+                connection.close()
+            except Exception:
+                pass
+            with self.condition:
+                # put the unsent records back in front, within the queue size
+                unsent = records[sent:]
+                room = max(0, self.size - len(stream.records))
+                if self.policy == DROP_OLDEST:
+                    keep = unsent[len(unsent) - min(room, len(unsent)):]
+                else:
+                    keep = unsent[:room]
+                stream.records.extendleft(reversed(keep))
+                self.queued += len(keep)
+                self.dropped += len(unsent) - len(keep)
+                self.sent += sent
+                self.retry_later(stream)
+            return
+        with self.condition:
+            self.sent += sent
+
+    def reconnect(self, stream):
+        try:
+            connection = stream.register()
+        except Exception as e:
+            logger.debug('Problem registering Origin stream `{}`: {}'.format(stream.name, e))
+            connection = None
+        with self.condition:
+            if connection:
+                logger.info('Reconnected Origin stream `{}`.'.format(stream.name))
+                stream.connection = connection
+                stream.backoff = 0
+            else:
+                self.retry_later(stream)
+
+    def retry_later(self, stream):
+        """Double the wait before the next reconnect.  Called with the condition held."""
+        stream.backoff = min(self.max_backoff, 2*stream.backoff) if stream.backoff else self.min_backoff
+        stream.retry_time = time.time() + stream.backoff
+        logger.debug('Reconnecting Origin stream `{}` in {} s.'.format(stream.name, stream.backoff))
@@ -32,6 +32,7 @@ import numpy
 from atom.api import Int, Tuple, List, Str, Float, Bool, Member, observe
 from instrument_property import IntProp, FloatProp, ListProp, StrProp
 from cs_instruments import Instrument
+from instrument_workers import acquire_in_parallel, stop_workers
 
 from PiParameterLookup import *
 try:
@@ -49,6 +50,7 @@ except:
 from analysis import AnalysisWithFigure, Analysis
 from colors import my_cmap
 from enaml.application import deferred_call
+from video import VideoEngine, Blitter, downsampled
 
 def pointer(x):
     """Returns a ctypes pointer"""
@@ -126,8 +128,11 @@ class PICamCamera(Instrument):
     mostrecentresult = Member()
 
     data = Member()  # holds acquired images until they are written
+    acquisition_config = Member()  # the (shots, height, width) acquisition_buffer was made for
+    acquisition_buffer = Member()  # uint16 [shots, height, width] filled by GetAcquiredData
     mode = Str('experiment')  # experiment vs. video
     analysis = Member()  # holds a link to the GUI display
+    video = Member()  # VideoEngine running while in video mode
     dll = Member()
 
     roilowh = Int(0)
@@ -236,6 +241,9 @@ class PICamCamera(Instrument):
                     logger.error('{} Parameters failed. Parameter {} failed.'.format(failed_parameter_count.value, failed_parameter_array[0]))
                     raise PauseError
 
+            # the readout layout only changes when the parameters do
+            self.getReadoutStride()
+            self.AllocateAcquisitionBuffer()
 
 
     def setup_video_thread(self, analysis):
@@ -418,16 +426,22 @@ class PICamCamera(Instrument):
         return
 
     def start_video_thread(self):
-        while self.mode == 'video':
-            if self.GetMostRecentImage():
-                # if there is new data, then redraw image
-                self.analysis.redraw_video()
-            time.sleep(.1)
+        # Picam_Acquire blocks until the camera delivers a frame, so the
+        # adaptive polling interval settles at its minimum while frames flow
+        self.video = VideoEngine(
+            '{}_video'.format(self.name),
+            self.GetMostRecentImage,
+            lambda: self.data,
+            self.analysis.redraw_video
+        )
+        self.video.start()
 
     def stop_video(self):
         # stop the video thread from looping
         self.mode = 'idle'
-        time.sleep(.01)
+        if self.video is not None:
+            self.video.stop()
+            self.video = None
         self.AbortAcquisition()
 
     def acquire_data(self):
@@ -684,9 +698,6 @@ class PICamCamera(Instrument):
 
 
     def StartAcquisition(self):
-        logger.debug('Getting Readout Stride')
-        self.getReadoutStride()
-
         logger.debug('Committing Parameters')
         self.commitParameters()
 
@@ -696,49 +707,45 @@ class PICamCamera(Instrument):
         self.DLLError(sys._getframe().f_code.co_name, error)
 
 
+    def AllocateAcquisitionBuffer(self):
+        """Returns the uint16 [shots, height, width] array that GetAcquiredData
+        copies readouts into.  It is only reallocated when its shape changes."""
+        config = (self.shotsPerMeasurement.value, self.height, self.width)
+        if config != self.acquisition_config:
+            logger.debug('Allocating PICam acquisition buffer for (shots, height, width) = {}'.format(config))
+            self.acquisition_buffer = numpy.zeros(config, dtype=numpy.uint16)
+            self.acquisition_config = config
+        return self.acquisition_buffer
+
     def GetAcquiredData(self, dump=False):
-        #print "calling dll"
+        data = self.AllocateAcquisitionBuffer()
+        shots = len(data)
+        frame_bytes = self.height * self.width * data.itemsize
+        if frame_bytes > self.framesize:
+            logger.error('PICam frame is {} bytes, but {}x{} pixels were expected.'.format(self.framesize, self.height, self.width))
+            raise PauseError
         status = PicamAcquisitionStatus()
-        available_array_type = PicamAvailableData*self.shotsPerMeasurement.value
-        self.available = available_array_type
         status.running = True
         readout_time_out = piint(100000)
         readoutnum = 0
-        while status.running and readoutnum < self.shotsPerMeasurement.value:
+        while status.running and readoutnum < shots:
             available = PicamAvailableData(0,0)
             error = Picam_WaitForAcquisitionUpdate(self.currentHandle, readout_time_out, byref(available), byref(status))
             logger.debug('Acquisition status: {}'.format(status.running))
             if status.errors != 0:
                 logger.warning('Acquisition error {}'.format(status.errors))
             self.DLLError(sys._getframe().f_code.co_name, error, dump)
-            readoutnum += available.readout_count
-
-            self.getReadoutStride()
-            sz = self.framesize/2
 
-            logger.info('Getting DataPointer. Readout_count={}'.format(available.readout_count))
-
-            DataArrayPointerType = ctypes.POINTER(pi16u*sz)
-
-            readout=0
-            while readout < available.readout_count:
-                DataPointer = ctypes.cast(available.initial_readout+self.readoutstride*readout,DataArrayPointerType)
-                dat = DataPointer.contents
-
-                try:
-                    data = numpy.append(data, numpy.reshape(dat, (1, self.height, self.width)),axis=0)
-                except:
-                    try:
-                        data = numpy.reshape(dat, (1, self.height, self.width))
-                    except:
-                        logger.info("dat.shape={}".format(
-                            numpy.array(dat).shape))
-                        logger.info("available.readout_count={}, self.height={}"
-                                    ", self.width={}, a*h*w={}".format
-                                    (available.readout_count, self.height,
-                                     self.width, available.readout_count *
-                                     self.height * self.width))
-                readout += 1
+            logger.debug('Copying readouts. Readout_count={}'.format(available.readout_count))
+            # one copy per frame, straight from the PICam buffer into its slot
+            new = min(available.readout_count, shots - readoutnum)
+            for readout in xrange(new):
+                ctypes.memmove(data[readoutnum + readout].ctypes.data,
+                               available.initial_readout + self.readoutstride * readout,
+                               frame_bytes)
+            if new < available.readout_count:
+                logger.warning('PICam returned {} readouts more than the {} expected.'.format(available.readout_count - new, shots))
+            readoutnum += new
         self.AbortAcquisition()
         carp = PicamAvailableData(0,0)
         while status.running:
@@ -750,6 +757,9 @@ class PICamCamera(Instrument):
             logger.warning ('{} Discarded Readout. Triggering issue?'.format(carp.readout_count))
 
 
+        if readoutnum < shots:
+            logger.warning('PICam acquired {} readouts, but was expecting {}.'.format(readoutnum, shots))
+            data = data[:readoutnum]
         logger.debug('data.shape = {}'.format(data.shape))
         return data
 
@@ -807,6 +817,7 @@ class PICamViewer(AnalysisWithFigure):
     shot = Int(0)
     update_lock = Bool(False)
     artist = Member()
+    blitter = Member()  # redraws artist in video mode
     mycam=Member()
     ax = Member()
     bgsub = Bool(False)
@@ -887,18 +898,21 @@ class PICamViewer(AnalysisWithFigure):
         ax = fig.add_subplot(111)
 
         self.artist = ax.imshow(data, vmin=self.mycam.minPlot.value, vmax=self.mycam.maxPlot.value,interpolation='None')
+        self.blitter = Blitter([self.artist])
         super(PICamViewer, self).updateFigure()
 
-    def redraw_video(self):
-        """First update self.data using Andor methods, then redraw screen using this."""
+    def redraw_video(self, frame=None):
+        """Draw a video frame.  Called on the GUI thread by the camera's
+        VideoEngine with the newest frame."""
+        if frame is None:
+            frame = self.data
+        self.artist.set_data(frame)
         if (self.mycam.autoscale):
-            self.artist.set_data(self.data)
             self.artist.autoscale()
-        else:
-            self.artist.set_data(self.data)
-        deferred_call(self.figure.canvas.draw)
-        self.maxPixel = int(numpy.max(self.data))              #What does "shot" mean in video mode?
-        self.meanPixel = int(numpy.mean(self.data))
+        self.blitter.draw()
+        sample = downsampled(frame)
+        self.maxPixel = int(numpy.max(sample))
+        self.meanPixel = int(numpy.mean(sample))
 
 
 
@@ -920,12 +934,17 @@ class PICams(Instrument,Analysis):
     version = '2016.06.02'
     motors = Member()
     dll = Member()
+    parallelAcquisition = Bool(False)  # read out all cameras concurrently
+    acquireTimeout = Member()  # seconds each camera gets in a parallel readout
+    workers = Member()  # camera -> InstrumentWorker, kept between measurements
 
     def __init__(self, name, experiment, description=''):
         super(PICams, self).__init__(name, experiment, description)
         self.motors = ListProp('motors', experiment, 'A list of individual Princeton Instruments cameras', listElementType=PICam,
                                listElementName='motor')
-        self.properties += ['version', 'motors']
+        self.acquireTimeout = FloatProp('acquireTimeout', experiment, 'seconds to wait for each camera in a parallel readout', '10')
+        self.workers = {}
+        self.properties += ['version', 'motors', 'parallelAcquisition', 'acquireTimeout']
         self.initialize(True)
 
     def initializecameras(self):
@@ -987,6 +1006,7 @@ class PICams(Instrument,Analysis):
     def evaluate(self):
         msg = ''
         try:
+            self.acquireTimeout.evaluate()
             for i in self.motors:
                 msg = i.evaluate()
         except Exception as e:
@@ -1008,6 +1028,10 @@ class PICams(Instrument,Analysis):
     def acquire_data(self):
         msg = ''
         try:
+            if self.parallelAcquisition:
+                cameras = [i.camera for i in self.motors if i.camera.enable]
+                acquire_in_parallel(cameras, self.workers, self.acquireTimeout.value)
+                return
             for i in self.motors:
                 if i.camera.enable:
                     msg = i.camera.acquire_data()
@@ -1017,6 +1041,7 @@ class PICams(Instrument,Analysis):
             raise PauseError
 
     def __del__(self):
+        stop_workers(self.workers)
         if self.isInitialized:
             for i in self.motors:
                 try:
@@ -12,11 +12,58 @@ class RetentionAnalysis(Analysis):
     # Text output that can be updated back to the GUI
     enable = Bool()
     text = Str()
+    # running counts for the current iteration, per ROI, for the adaptive measurement allocation
+    loaded = Member()
+    retained = Member()
 
     def __init__(self, name, experiment, description=''):
         super(RetentionAnalysis, self).__init__(name, experiment, description)
         self.properties += ['enable', 'text']
 
+    def preExperiment(self, experimentResults):
+        # keep a running retention only when the experiment asks for it, because it has to wait on the threshold
+        # analysis of each measurement
+        self.queueAfterMeasurement = self.enable and getattr(self.experiment, 'adaptiveMeasurements', False)
+        if self.queueAfterMeasurement:
+            self.measurementDependencies = [self.experiment.thresholdROIAnalysis]
+        super(RetentionAnalysis, self).preExperiment(experimentResults)
+
+    def preIteration(self, iterationResults, experimentResults):
+        self.loaded = None
+        self.retained = None
+
+    def analyzeMeasurement(self, measurementResults, iterationResults, experimentResults):
+        if self.enable and self.queueAfterMeasurement:
+            path = self.experiment.thresholdROIAnalysis.meas_analysis_path
+            if path in measurementResults:
+                # (sub-measurements, shots, rois)
+                atoms = measurementResults[path][()]
+                self.count(atoms[:, 0, :], np.logical_and(atoms[:, 0, :], atoms[:, 1, :]))
+
+    def count(self, loaded, retained):
+        """Add the loaded and retained atoms of some sub-measurements (sub-measurements, rois) to the running
+        counts."""
+        loaded = np.sum(loaded, axis=0)
+        retained = np.sum(retained, axis=0)
+        if self.loaded is None:
+            self.loaded = loaded
+            self.retained = retained
+        else:
+            self.loaded = self.loaded + loaded
+            self.retained = self.retained + retained
+
+    def standard_error(self):
+        """The largest retention standard error among the ROIs that have loaded, so far in this iteration.
+
+        One retained and one lost atom are added to the counts (the Agresti-Coull interval), so that an ROI that has
+        retained every atom so far is not taken as certain.
+        """
+        if self.loaded is None or not np.any(self.loaded):
+            return None
+        loaded = self.loaded[self.loaded > 0] + 2.
+        retention = (self.retained[self.loaded > 0] + 1.) / loaded
+        return float(np.max(np.sqrt(retention * (1 - retention) / loaded)))
+
     def analyzeIteration(self, iterationResults, experimentResults):
         if self.enable:
             self.retention(iterationResults)
@@ -101,6 +148,7 @@ class RetentionGraph(AnalysisWithFigure):
     enable = Bool()
     mean = Member()
     sigma = Member()
+    ivar_indices = Member()  # the ivar indices of each iteration in mean, as the scan may not visit them in order
     current_iteration_data = Member()
     update_lock = Bool(False)
     list_of_what_to_plot = Str()
@@ -124,6 +172,7 @@ class RetentionGraph(AnalysisWithFigure):
         # erase the old data at the start of the experiment
         self.mean = None
         self.sigma = None
+        self.ivar_indices = []
 
     def preIteration(self, iterationResults, experimentResults):
         self.current_iteration_data = None
@@ -144,6 +193,7 @@ class RetentionGraph(AnalysisWithFigure):
                     # append
                     self.mean = np.append(self.mean, retention, axis=0)
                     self.sigma = np.append(self.sigma, sigma, axis=0)
+                self.ivar_indices.append(list(iterationResults.attrs['ivarIndex']))
                 self.updateFigure()
 
     def analyzeMeasurement(self, measurementResults, iterationResults, experimentResults):
@@ -193,6 +243,27 @@ class RetentionGraph(AnalysisWithFigure):
     def reload(self, change):
         self.updateFigure()
 
+    def x_values(self):
+        """The x axis label, and the x value of each iteration in mean.
+
+        The x values are those of the first ivar that takes more than one
+        value, or else the iteration numbers.  The scan plan can visit the ivar
+        values in any order, so each iteration's value is looked up from its
+        ivar indices rather than from its position.
+        """
+        n = len(self.mean)
+        try:
+            for i, ivar in enumerate(self.experiment.ivarNames):
+                values = self.experiment.ivarValueLists[i]
+                if len(values) > 1:
+                    logger.debug("found iterated variable: {}".format(ivar))
+                    indices = np.array(self.ivar_indices[:n], dtype=int)[:, i]
+                    return ivar, np.asarray(values)[indices]
+        except TypeError:
+            logger.debug("unable to iterate over "
+                         "{}".format(self.experiment.ivarNames))
+        return 'iteration', np.arange(n)
+
     def updateFigure(self):
         if self.draw_fig:
             if not self.update_lock:
@@ -201,22 +272,11 @@ class RetentionGraph(AnalysisWithFigure):
                     fig = self.backFigure
                     fig.clf()
 
-                    x_label = 'iteration'
-                    x_vals = []
-                    try:
-                        for i, ivar in enumerate(self.experiment.ivarNames):
-                            if len(self.experiment.ivarValueLists[i]) > 1:
-                                logger.info("found iterated variable: "
-                                            "{}".format(ivar))
-                                x_label = ivar
-                                logger.info("Values of iterated variable:"
-                                            " {}".format(self.experiment.ivarValueLists[i]))
-                                x_vals = self.experiment.ivarValueLists[i]
-                                break
-                    except TypeError:
-                        logger.debug("unable to iterate over "
-                                     "{}".format(self.experiment.ivarNames))
                     if self.mean is not None:
+                        x_label, x_vals = self.x_values()
+                        # plot in order of the x values, whatever order they were taken in
+                        order = np.argsort(x_vals, kind='mergesort')
+                        x_vals = x_vals[order]
                         # parse the list of what to plot from a string to a
                         # list of numbers
                         try:
@@ -229,28 +289,27 @@ class RetentionGraph(AnalysisWithFigure):
                         ax = fig.add_subplot(111)
                         for i in plotlist:
                             try:
-                                mean = self.mean[:, i]
-                                sigma = self.sigma[:, i]
+                                mean = self.mean[order, i]
+                                sigma = self.sigma[order, i]
                             except:
                                 logger.warning('Trying to plot data that does '
                                                'not exist in RetentionGraph: '
                                                'roi {}'.format(i))
                                 continue
-                            if x_vals == []:
-                                x_vals = np.arange(len(mean))
                             label = '({})'.format(i)
                             linestyle = '-o' if self.draw_connecting_lines else 'o'
                             if self.draw_error_bars:
-                                ax.errorbar(x_vals[:len(mean)], mean, yerr=sigma, fmt=linestyle, label=label)
+                                ax.errorbar(x_vals, mean, yerr=sigma, fmt=linestyle, label=label)
                             else:
-                                ax.plot(x_vals[:len(mean)], mean, linestyle, label=label)
+                                ax.plot(x_vals, mean, linestyle, label=label)
                         # adjust the limits so that the data isn't right on the
                         # edge of the graph
-                        if len(x_vals) > 1:
-                            delta = abs(x_vals[1] - x_vals[0])
+                        steps = np.diff(np.unique(x_vals))
+                        if len(steps) > 0:
+                            delta = steps.min()
                         else:
                             delta = 1
-                        ax.set_xlim(min(x_vals[:len(mean)]) - 0.3*delta, max(x_vals[:len(mean)]) + 0.3*delta)
+                        ax.set_xlim(min(x_vals) - 0.3*delta, max(x_vals) + 0.3*delta)
                         if self.ymin != '':
                             ax.set_ylim(bottom=float(self.ymin))
                         if self.ymax != '':
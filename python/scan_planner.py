@@ -0,0 +1,162 @@
+"""scan_planner.py
+Part of the CsPyController experiment control software
+
+created = 2026.10.19
+
+Plans the scan over the independent variables when an experiment starts: the
+ivar indices and values of every iteration are computed at once into a table,
+so each iteration is a row lookup, and the table is saved in the results file
+as 'scan_plan'.
+
+The iterations can be ordered other than the usual nested loops (the first ivar
+is the inner loop), to keep slow drifts from looking like a dependence on the
+ivars:
+    sequential:  the nested loops
+    serpentine:  the nested loops, with each inner loop running back and forth,
+                 so that only one ivar changes by one step between iterations
+    interleaved: the points of the nested loops in bit reversed order, so that
+                 each pass through the scan falls between the points of the
+                 earlier passes and covers the whole range at a coarser step
+    randomized:  the points of the nested loops shuffled
+"""
+
+from __future__ import division
+import logging
+
+import numpy
+
+from cs_errors import PauseError
+
+logger = logging.getLogger(__name__)
+
+ORDERINGS = ['sequential', 'serpentine', 'interleaved', 'randomized']
+
+
+def grid_indices(steps, serpentine=False):
+    """The ivar indices for each point of the nested loops, with the first ivar as the inner loop.
+
+    :param steps: the number of values of each ivar
+    :param serpentine: if True, each loop runs backwards on every other pass of the loop outside it
+    :return: an int64 array of shape (product of steps, number of ivars)
+    """
+    steps = numpy.asarray(steps, dtype=numpy.int64)
+    total = int(numpy.prod(steps))
+    # how many iterations each ivar stays at the same index
+    bases = numpy.ones(len(steps), dtype=numpy.int64)
+    bases[1:] = numpy.cumprod(steps)[:-1]
+    iterations = numpy.arange(total, dtype=numpy.int64)[:, numpy.newaxis]
+    indices = (iterations // bases) % steps
+    if serpentine:
+        # the number of passes each ivar has completed decides its direction
+        backwards = (iterations // (bases * steps)) % 2 == 1
+        indices = numpy.where(backwards, steps - 1 - indices, indices)
+    return indices.reshape((total, len(steps)))
+
+
+def bit_reversed_order(total):
+    """The numbers 0 to total-1, in the order of their bit reversals."""
+    bits = max(1, int(numpy.ceil(numpy.log2(max(total, 1)))))
+    n = numpy.arange(2**bits, dtype=numpy.int64)
+    reversed_n = numpy.zeros_like(n)
+    for bit in xrange(bits):
+        reversed_n |= ((n >> bit) & 1) << (bits - 1 - bit)
+    return reversed_n[reversed_n < total]
+
+
+def iteration_order(total, ordering, seed=None):
+    """The order in which to visit the points of the nested loops."""
+    if ordering == 'interleaved':
+        return bit_reversed_order(total)
+    if ordering == 'randomized':
+        return numpy.random.RandomState(seed).permutation(total)
+    return numpy.arange(total)
+
+
+def storable(values):
+    """The values as an array that hdf5 can store, with objects and unicode as byte strings."""
+    values = numpy.asarray(values)
+    if values.dtype.kind in 'OU':
+        values = numpy.array([str(v) for v in values.ravel()], dtype=str)
+    return values
+
+
+def check_names(names):
+    """The table has a field for each ivar, so the ivars need distinct, non-empty names.  Raises PauseError."""
+    seen = set()
+    for i, name in enumerate(names):
+        if not name:
+            logger.error('Independent variable {} has no name.  Name it before starting the experiment.'.format(i))
+            raise PauseError
+        if name in seen:
+            logger.error('More than one independent variable is named `{}`.  Give them different names.'.format(name))
+            raise PauseError
+        seen.add(name)
+
+
+class ScanPlan(object):
+    """The ivar indices and values of every iteration of an experiment.
+
+    An ivar with no values takes index 0 and a nan value, to keep the shape of the scan, as setIndex gives it a
+    current value of None.
+    """
+
+    def __init__(self, names, value_lists, ordering='sequential', seed=None):
+        check_names(names)
+        if ordering not in ORDERINGS:
+            logger.warning('Unknown ivar ordering `{}`, using sequential.'.format(ordering))
+            ordering = 'sequential'
+        self.names = list(names)
+        self.ordering = ordering
+        self.seed = seed
+        value_lists = [storable(v) if len(v) else numpy.array([numpy.nan]) for v in value_lists]
+        steps = [len(v) for v in value_lists]
+
+        points = grid_indices(steps, serpentine=(ordering == 'serpentine'))
+        self.indices = points[iteration_order(len(points), ordering, seed)]
+        self.total = len(self.indices)
+
+        # one row per iteration: the iteration number, then the index and value of each ivar
+        fields = [('iteration', numpy.int64)]
+        if self.names:
+            fields += [('index', [(name, numpy.int64) for name in self.names]),
+                       ('value', [(name, v.dtype) for name, v in zip(self.names, value_lists)])]
+        self.table = numpy.zeros(self.total, dtype=fields)
+        self.table['iteration'] = numpy.arange(self.total)
+        for i, (name, values) in enumerate(zip(self.names, value_lists)):
+            self.table['index'][name] = self.indices[:, i]
+            self.table['value'][name] = values[self.indices[:, i]]
+
+        # the first planned iteration for each combination of ivar indices
+        self.iterations = {}
+        for iteration, index in enumerate(self.indices.tolist()):
+            self.iterations.setdefault(tuple(index), iteration)
+
+    def indices_at(self, iteration):
+        """The ivar indices for an iteration.  Iterations past the end of the plan (in optimizer loops) start over."""
+        return self.indices[iteration % self.total]
+
+    def iteration_of(self, index):
+        """The first planned iteration with the given ivar indices, or None."""
+        return self.iterations.get(tuple(int(i) for i in index))
+
+    def toHDF5(self, hdf5, name='scan_plan'):
+        if name in hdf5:
+            del hdf5[name]
+        dataset = hdf5.create_dataset(name, data=self.table)
+        dataset.attrs['ordering'] = self.ordering
+        if self.seed is not None:
+            dataset.attrs['seed'] = self.seed
+        return dataset
+
+
+def value_lists(table):
+    """The value list of each ivar, from a scan_plan table read from a results file."""
+    if 'index' not in table.dtype.names:
+        return []
+    lists = []
+    for name in table.dtype['index'].names:
+        index = table['index'][name]
+        values = numpy.empty(index.max() + 1, dtype=table.dtype['value'][name])
+        values[index] = table['value'][name]
+        lists.append(values)
+    return lists
@@ -0,0 +1,163 @@
+"""stage_profiler.py
+Part of the CsPyController experiment control software
+
+created = 2026.10.19
+
+Records how long each stage of the experiment loop takes (evaluate, update,
+each instrument's start, run, acquire_data and writeResults, the hdf5 flush,
+each analysis, and how long measurements wait in the analysis queues), so
+that the dead time between measurements can be seen and tuned.
+
+The spans go into a fixed size ring buffer of numpy records, so recording is
+a few attribute lookups and an array write, and nothing is kept once the
+buffer wraps.  A summary of each iteration (count, mean, p50, p95 and max per
+stage) is written to the iteration in the results file, and report() gives
+the same as text for the GUI.
+
+There is one profiler for the program, `profiler`, which the experiment
+enables.  While it is disabled, span() returns a shared do-nothing context.
+"""
+
+from __future__ import division
+import logging
+import itertools
+import threading
+import time
+
+import numpy
+
+logger = logging.getLogger(__name__)
+
+SPAN_DTYPE = [('stage', numpy.int32), ('iteration', numpy.int64), ('start', numpy.float64),
+              ('duration', numpy.float64)]
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.stage, self.start, time.time() - self.start)
+        return False
+
+
+class Profiler(object):
+    """A ring buffer of (stage, iteration, start, duration) spans."""
+
+    def __init__(self, size=2**16):
+        self.enabled = False
+        self.iteration = 0  # the iteration that new spans belong to
+        self.stages = []
+        self.stage_ids = {}
+        self.lock = threading.Lock()  # only for adding new stage names
+        self.resize(size)
+
+    def resize(self, size):
+        """Empty the buffer and set its size."""
+        self.size = size
+        self.spans = numpy.zeros(size, dtype=SPAN_DTYPE)
+        # next() on a count is atomic, so threads never share a slot
+        self.counter = itertools.count()
+        self.recorded = 0
+
+    def clear(self):
+        self.resize(self.size)
+
+    def span(self, stage):
+        """A context that records the time spent in it under the stage name."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage)
+
+    def timed(self, stage, function):
+        """Wrap a function so that each call is recorded, for functions run in other threads."""
+        def wrapper(*args, **kwargs):
+            with self.span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def record(self, stage, start, duration):
+        if not self.enabled:
+            return
+        stage_id = self.stage_ids.get(stage)
+        if stage_id is None:
+            stage_id = self.add_stage(stage)
+        n = next(self.counter)
+        self.spans[n % self.size] = (stage_id, self.iteration, start, duration)
+        self.recorded = n + 1
+
+    def add_stage(self, stage):
+        with self.lock:
+            if stage not in self.stage_ids:
+                self.stage_ids[stage] = len(self.stages)
+                self.stages.append(stage)
+            return self.stage_ids[stage]
+
+    def recent(self):
+        """The spans still in the buffer, oldest first."""
+        n = self.recorded
+        if n <= self.size:
+            return self.spans[:n].copy()
+        return numpy.roll(self.spans, -(n % self.size))
+
+    def summary(self, iteration=None):
+        """Statistics of the durations per stage, for one iteration or for everything still in the buffer.
+
+        :return: a structured array with one row per stage: (stage, count, mean, p50, p95, max, total), in seconds
+        """
+        spans = self.recent()
+        if iteration is not None:
+            spans = spans[spans['iteration'] == iteration]
+        width = max([1] + [len(s) for s in self.stages])
+        rows = numpy.zeros(0, dtype=[('stage', 'S{}'.format(width)), ('count', numpy.int64),
+                                     ('mean', numpy.float64), ('p50', numpy.float64), ('p95', numpy.float64),
+                                     ('max', numpy.float64), ('total', numpy.float64)])
+        if len(spans) == 0:
+            return rows
+        order = numpy.argsort(spans['stage'], kind='mergesort')
+        stage_ids, starts = numpy.unique(spans['stage'][order], return_index=True)
+        durations = numpy.split(spans['duration'][order], starts[1:])
+        rows = numpy.resize(rows, len(stage_ids))
+        for row, (stage_id, d) in enumerate(zip(stage_ids, durations)):
+            p50, p95 = numpy.percentile(d, [50, 95])
+            rows[row] = (self.stages[stage_id], len(d), numpy.mean(d), p50, p95, numpy.max(d), numpy.sum(d))
+        return rows
+
+    def report(self, iteration=None):
+        """The summary as a text table, in milliseconds, with the stages that take the most time first."""
+        rows = self.summary(iteration)
+        rows = rows[numpy.argsort(-rows['total'], kind='mergesort')]
+        width = max([5] + [len(r) for r in rows['stage']])
+        lines = ['{:<{w}} {:>7} {:>9} {:>9} {:>9} {:>10}'.format('stage', 'count', 'p50 ms', 'p95 ms', 'max ms',
+                                                                   'total s', w=width)]
+        for r in rows:
+            lines.append('{:<{w}} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.3f}'.format(
+                r['stage'], r['count'], 1000*r['p50'], 1000*r['p95'], 1000*r['max'], r['total'], w=width))
+        return '\n'.join(lines)
+
+    def toHDF5(self, group, iteration, name='profile'):
+        """Write the summary of an iteration to an hdf5 group."""
+        rows = self.summary(iteration)
+        if len(rows):
+            if name in group:
+                del group[name]
+            group[name] = rows
+
+
+profiler = Profiler()
@@ -0,0 +1,306 @@
+"""A headless harness that measures the controller's own overhead, with fake instruments in place of the hardware.
+
+An Experiment is built with a FakeCamera (stacks of images with atom spots), a
+FakeCounter and a FakeAnalogInput, of configurable sizes and measurement
+times, and the usual camera analysis chain: SquareROIAnalysis,
+ThresholdROIAnalysis, RetentionAnalysis, HistogramGrid and ImageSumAnalysis.
+It runs a number of iterations through Experiment.go() without the GUI, with
+the stage profiler on, and reports the measurements per second, the latency of
+each stage and the peak memory of the process.  The results can be saved as
+json, and compared to a saved baseline to catch performance regressions.
+
+Run it directly:
+
+    python benchmark_harness.py [--iterations 3 --measurements 50 ...] [--save new.json] [--compare baseline.json]
+
+The peak memory is that of the whole process, so compare runs that were each
+started on their own.
+"""
+
+import argparse
+import ConfigParser
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+sys.path.append("..")
+from atom.api import Int, Member
+from ConfigInstrument import Config
+from experiments import Experiment, IndependentVariable
+import FakeInstrument
+from SquareROIAnalysis import SquareROIAnalysis
+from threshold_analysis import ThresholdROIAnalysis
+from retention_analysis import RetentionAnalysis
+from histogram_analysis import HistogramGrid
+from image_sum_analysis import ImageSumAnalysis
+from stage_profiler import profiler
+
+DEFAULTS = {
+    'iterations': 3,
+    'measurements': 50,  # good measurements per iteration
+    'roi_rows': 4,
+    'roi_columns': 4,
+    'height': 128,  # camera image size
+    'width': 128,
+    'shots': 2,
+    'counter_bins': 1000,
+    'ai_channels': 8,
+    'ai_samples': 1000,
+    'period': 0.,  # seconds each fake instrument takes per measurement
+    'instrument_threads': True,
+}
+
+# where the analyses find the camera, and which ROI sums feed the threshold and histograms
+CONFIG = {
+    'EXPERIMENT': {'Name': 'benchmark'},
+    'CAMERA': {'IsCamera': 'True', 'DataGroup': 'FakeCamera', 'CameraObj': 'camera', 'CameraIdx': '-1',
+               'ThresholdROISource': 'squareROIAnalysis', 'HistogramROISource': 'squareROIAnalysis'},
+    'DEV': {'EnableFakeData': 'True'},
+}
+
+
+def make_config():
+    parser = ConfigParser.ConfigParser()
+    for section, items in CONFIG.iteritems():
+        parser.add_section(section)
+        for key, value in items.iteritems():
+            parser.set(section, key, value)
+    return Config('Config', None, 'Configuration File', config=parser)
+
+
+def peak_memory():
+    """The peak resident memory of this process in MB, or None if it can't be found."""
+    try:
+        import resource
+    except ImportError:
+        pass
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on linux, bytes on mac
+        return peak / 2.**20 if sys.platform == 'darwin' else peak / 2.**10
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in
+                ['PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                 'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage']]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                                 counters.cb)
+        return counters.PeakWorkingSetSize / 2.**20
+    except (AttributeError, OSError):
+        return None
+
+
+class BenchmarkExperiment(Experiment):
+    """An Experiment with only fake instruments and the camera analysis chain."""
+    camera = Member()
+    counter = Member()
+    analog_input = Member()
+    squareROIAnalysis = Member()
+    thresholdROIAnalysis = Member()
+    retention_analysis = Member()
+    histogram_grid = Member()
+    imageSumAnalysis = Member()
+    measurements_taken = Int()  # including the ones that are not good
+    ROI_rows = Int(1)
+    ROI_columns = Int(1)
+    ROI_bg_rows = Int(0)
+    ROI_bg_columns = Int(0)
+
+    def __init__(self, roi_rows, roi_columns, **kwargs):
+        super(BenchmarkExperiment, self).__init__(**kwargs)
+        self.ROI_rows = roi_rows
+        self.ROI_columns = roi_columns
+        self.camera = FakeInstrument.FakeCamera('camera', self, 'fake camera')
+        self.counter = FakeInstrument.FakeCounter('counter', self, 'fake counter')
+        self.analog_input = FakeInstrument.FakeAnalogInput('analog_input', self, 'fake analog input')
+        self.instruments += [self.camera, self.counter, self.analog_input]
+
+        self.squareROIAnalysis = SquareROIAnalysis(self)
+        self.thresholdROIAnalysis = ThresholdROIAnalysis(self)
+        self.retention_analysis = RetentionAnalysis('retention_analysis', self, 'calculate the loading and retention')
+        self.histogram_grid = HistogramGrid('histogram_grid', self, 'histograms of every ROI')
+        self.imageSumAnalysis = ImageSumAnalysis(self)
+        self.analyses += [self.squareROIAnalysis, self.histogram_grid, self.thresholdROIAnalysis,
+                          self.retention_analysis, self.imageSumAnalysis]
+        self.squareROIAnalysis.camera = self.camera
+        self.histogram_grid.camera = self.camera
+
+        self.properties += ['camera', 'counter', 'analog_input', 'squareROIAnalysis', 'thresholdROIAnalysis',
+                            'retention_analysis', 'histogram_grid', 'imageSumAnalysis', 'ROI_rows', 'ROI_columns']
+        self.allow_evaluation = True
+
+    def measure(self):
+        self.measurements_taken += 1
+        super(BenchmarkExperiment, self).measure()
+
+
+class Benchmark(object):
+    """One headless run of the measurement loop, with the settings of DEFAULTS, overridden by keyword."""
+
+    def __init__(self, **settings):
+        unknown = set(settings) - set(DEFAULTS)
+        if unknown:
+            raise ValueError('Unknown benchmark settings: {}'.format(sorted(unknown)))
+        self.settings = dict(DEFAULTS, **settings)
+        s = self.settings
+        self.directory = tempfile.mkdtemp(prefix='cspy_benchmark_')
+        exp = self.experiment = BenchmarkExperiment(
+            s['roi_rows'], s['roi_columns'], config_instrument=make_config(), cache_location=self.directory,
+            settings_location=os.path.join(self.directory, 'settings.hdf5'),
+            temp_location=os.path.join(self.directory, 'previous_settings.hdf5'))
+
+        # the results are written to disk, as in the lab, into a temporary directory
+        exp.saveData = True
+        exp.saveSettings = False
+        exp.pauseAfterError = True
+        exp.localDataPath = self.directory
+        exp.measurementTimeout = 10 + s['period']
+        exp.measurementsPerIteration = s['measurements']
+        exp.enable_instrument_threads = s['instrument_threads']
+        exp.profileStages = True
+        exp.independentVariables.append(IndependentVariable('iteration', exp, function='arange({})'.format(
+            s['iterations'])))
+
+        size = max(s['roi_rows'], s['roi_columns']) * exp.camera.spacing + exp.camera.spacing
+        if size > min(s['height'], s['width']):
+            raise ValueError('The {}x{} ROI grid does not fit in a {}x{} image'.format(
+                s['roi_rows'], s['roi_columns'], s['height'], s['width']))
+        exp.camera.height, exp.camera.width = s['height'], s['width']
+        exp.camera.shotsPerMeasurement.function = str(s['shots'])
+        exp.counter.bins = s['counter_bins']
+        exp.analog_input.channels, exp.analog_input.samples = s['ai_channels'], s['ai_samples']
+        for i in exp.instruments:
+            i.enable = True
+            i.period = s['period']
+
+        for a in exp.analyses:
+            a.enable = True
+        roi = exp.squareROIAnalysis
+        roi.ROIs = np.array(exp.camera.rois(), dtype=roi.ROIs.dtype)
+        threshold = exp.thresholdROIAnalysis
+        threshold.shots = s['shots']
+        threshold.threshold_array = np.zeros((s['shots'], s['roi_rows'] * s['roi_columns']),
+                                             dtype=threshold.threshold_array.dtype)
+        threshold.threshold_array['1'] = exp.camera.threshold()
+        # as the GUI does once the settings are loaded
+        exp.evaluateAll()
+
+    def run(self):
+        """Run all the iterations, and return the results."""
+        exp = self.experiment
+        if not exp.reset():
+            raise RuntimeError('The experiment could not be reset, status: {}'.format(exp.status))
+        start = time.time()
+        exp.go()
+        elapsed = time.time() - start
+        if exp.status != 'idle':
+            raise RuntimeError('The experiment did not finish, status: {}'.format(exp.status))
+
+        stages = {}
+        for row in profiler.summary():
+            stages[row['stage']] = dict((field, row[field].item()) for field in row.dtype.names[1:])
+        return {
+            'settings': self.settings,
+            'time': time.time(),
+            'elapsed': elapsed,
+            'measurements': exp.measurements_taken,
+            'measurements_per_second': exp.measurements_taken / elapsed,
+            'peak_memory_MB': peak_memory(),
+            'stages': stages,
+        }
+
+    def close(self, timeout=60):
+        exp = self.experiment
+        # the histogram figures are drawn and saved in a process pool, let them finish before closing it
+        grid = exp.histogram_grid
+        end = time.time() + timeout
+        while (None in grid.figures) and (time.time() < end):
+            time.sleep(.1)
+        grid.pool.close()
+        grid.pool.join()
+        if exp.hdf5 is not None:
+            exp.hdf5.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def report(results):
+    print 'settings: {}'.format(', '.join('{}={}'.format(k, v) for k, v in sorted(results['settings'].items())))
+    print '{} measurements in {:.2f} s: {:.2f} measurements/s, peak memory {} MB'.format(
+        results['measurements'], results['elapsed'], results['measurements_per_second'], results['peak_memory_MB'])
+    print profiler.report()
+
+
+def compare(results, baseline, tolerance=.2, floor=1.):
+    """Print how the results differ from a baseline, and return the measures that are more than tolerance worse.
+
+    The throughput, the peak memory, and the p50 and p95 of each stage of the baseline are compared.  Stage times
+    that changed by less than floor ms are not counted as regressions, as they are mostly noise.
+    """
+    if results['settings'] != baseline['settings']:
+        print 'warning: the baseline was run with different settings: {}'.format(baseline['settings'])
+    # (name, now, baseline, higher is better, smallest difference that counts)
+    measures = [('measurements/s', results['measurements_per_second'], baseline['measurements_per_second'], True, 0)]
+    if results['peak_memory_MB'] and baseline['peak_memory_MB']:
+        measures.append(('peak memory MB', results['peak_memory_MB'], baseline['peak_memory_MB'], False, 0))
+    for stage in sorted(baseline['stages']):
+        if stage in results['stages']:
+            for field in ('p50', 'p95'):
+                measures.append(('{} {} ms'.format(stage, field), 1000 * results['stages'][stage][field],
+                                 1000 * baseline['stages'][stage][field], False, floor))
+    regressions = []
+    width = max(len(m[0]) for m in measures)
+    print '{:<{w}} {:>10} {:>10} {:>8}'.format('', 'baseline', 'now', 'change', w=width)
+    for name, now, before, higher_is_better, smallest in measures:
+        change = (now - before) / before if before else 0.
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance and abs(now - before) > smallest:
+            regressions.append(name)
+            flag = '  <-- regression'
+        print '{:<{w}} {:>10.3f} {:>10.3f} {:>+7.0%}{}'.format(name, before, now, change, flag, w=width)
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Measure the overhead of the measurement loop with fake instruments.')
+    for name, default in sorted(DEFAULTS.items()):
+        if isinstance(default, bool):
+            parser.add_argument('--' + name, type=lambda x: x.lower() in ('1', 'true', 'yes'), default=default)
+        else:
+            parser.add_argument('--' + name, type=type(default), default=default)
+    parser.add_argument('--save', help='save the results to this json file')
+    parser.add_argument('--compare', help='compare the results to those saved in this json file')
+    parser.add_argument('--tolerance', type=float, default=.2, help='the fractional change that is a regression')
+    args = vars(parser.parse_args(argv))
+    logging.basicConfig(level=logging.WARNING)
+    save, baseline, tolerance = args.pop('save'), args.pop('compare'), args.pop('tolerance')
+
+    benchmark = Benchmark(**args)
+    try:
+        results = benchmark.run()
+    finally:
+        benchmark.close()
+    report(results)
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline:
+        with open(baseline) as f:
+            if compare(results, json.load(f), tolerance):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
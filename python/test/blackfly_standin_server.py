@@ -0,0 +1,105 @@
+"""A local stand-in for the Blackfly camera ZeroMQ server.
+
+It answers the requests BlackflyClient makes (ECHO, GET_CAMERAS, UPDATE, START,
+GET_RESULTS) with synthetic images, either as plain JSON or with the binary
+transport of zmq_instrument.send_binary.  Setting binary_supported=False
+mimics a server that predates the binary transport.
+
+Run it directly for a JSON vs. binary throughput benchmark:
+
+    python blackfly_standin_server.py [width height shots requests]
+"""
+
+import sys
+import threading
+import time
+import numpy as np
+import zmq
+sys.path.append("..")
+import zmq_instrument
+
+
+class StandInServer(object):
+
+    def __init__(self, serials=(1234,), shape=(2, 960, 1280), dtype=np.uint16, binary_supported=True):
+        self.serials = list(serials)
+        self.images = np.random.randint(0, 4096, size=shape).astype(dtype)
+        self.binary_supported = binary_supported
+        self.delays = {}  # action -> seconds to wait before answering
+        self.requests = []
+        self.context = zmq.Context()
+        self.sock = self.context.socket(zmq.REP)
+        self.sock.setsockopt(zmq.LINGER, 0)
+        self.port = self.sock.bind_to_random_port('tcp://127.0.0.1')
+        self.running = True
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def results(self, binary):
+        camera_data = {}
+        for serial in self.serials:
+            data = self.images if binary else self.images.tolist()
+            camera_data[str(serial)] = {
+                'error': 0,
+                'data': data,
+                'stats': {'mean': float(self.images.mean())},
+            }
+        return {'status': 0, 'camera_data': camera_data}
+
+    def handle(self, req):
+        action = req.get('action')
+        if action == 'GET_CAMERAS':
+            return {'status': 0, 'cameras': self.serials}
+        if action == 'GET_RESULTS':
+            return self.results(req.get('binary', False) and self.binary_supported)
+        return {'status': 0}
+
+    def loop(self):
+        poller = zmq.Poller()
+        poller.register(self.sock, zmq.POLLIN)
+        while self.running:
+            if not poller.poll(50):
+                continue
+            req = self.sock.recv_json()
+            self.requests.append(req)
+            time.sleep(self.delays.get(req.get('action'), 0))
+            resp = self.handle(req)
+            if req.get('binary', False) and self.binary_supported:
+                zmq_instrument.send_binary(self.sock, resp)
+            else:
+                self.sock.send_json(resp)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+        self.context.term()
+
+
+def benchmark(width=1280, height=960, shots=2, requests=20):
+    server = StandInServer(shape=(shots, height, width))
+    context = zmq.Context()
+    for binary in (False, True):
+        sock = context.socket(zmq.REQ)
+        sock.connect('tcp://127.0.0.1:{}'.format(server.port))
+        start = time.time()
+        for _ in xrange(requests):
+            sock.send_json({'action': 'GET_RESULTS', 'binary': binary})
+            if binary:
+                frames = sock.recv_multipart(copy=False)
+                resp = zmq_instrument.unpack_arrays(zmq_instrument.json.loads(frames[0].bytes), frames[1:])
+            else:
+                resp = sock.recv_json()
+            data = np.asarray(resp['camera_data']['1234']['data'])
+        elapsed = time.time() - start
+        mb = requests * server.images.nbytes / 1e6
+        print '{:>6}: {:.1f} requests/s, {:.1f} MB/s of image data ({})'.format(
+            'binary' if binary else 'json', requests / elapsed, mb / elapsed, data.shape)
+        sock.close()
+    context.term()
+    server.stop()
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,146 @@
+"""An offline harness that drives optimization.Optimization against synthetic cost functions.
+
+Each optimizer update stands in for one experiment loop: the harness reads the
+settings the optimizer applied to the independent variables, evaluates a
+synthetic cost with gaussian noise, stores it in the experiment group, and
+the cost function reads it back from there, as a real cost function reads
+the experiment results.
+
+Run it directly to compare evaluations-to-convergence across methods:
+
+    python optimizer_harness.py [repeats noise]
+"""
+
+import itertools
+import sys
+import numpy as np
+import h5py
+sys.path.append("..")
+import optimization
+
+METHODS = ['Nelder-Mead', 'genetic', 'gradient descent', 'weighted Nelder-Mead', 'smart Nelder-Mead', 'Bayesian']
+
+COST_FUNCTION = """self.yi = experimentResults.attrs['cost']
+self.y_stat_sigma = experimentResults.attrs['sigma']"""
+
+
+def quadratic(x, center=np.array([1.0, -2.0])):
+    return np.sum((x - center)**2)
+
+
+def rosenbrock(x):
+    return (1 - x[0])**2 + 10 * (x[1] - x[0]**2)**2
+
+
+class FakeIndependentVariable(object):
+    def __init__(self, name, value, step, tolerance=1e-3, limits=(-10, 10)):
+        self.name = name
+        self.valueList = [value]
+        self.optimize = True
+        self.optimizer_initial_step = step
+        self.optimizer_end_tolerance = tolerance
+        self.optimizer_min, self.optimizer_max = limits
+        self.currentValue = value
+
+    def setIndex(self, index):
+        return index
+
+    def set_gui(self, d):
+        pass
+
+
+class FakeRamsey(object):
+    def optimizer_update_guess(self):
+        pass
+
+
+class FakeExperiment(object):
+    allow_evaluation = False
+    gui = None
+
+    def __init__(self, ivars):
+        self.independentVariables = ivars
+        self.Ramsey = FakeRamsey()
+        self.status = 'running'
+
+    def set_status(self, status):
+        self.status = status
+
+
+class Optimization(optimization.Optimization):
+    def updateFigure(self):
+        pass  # redrawing the history every update is slow, and not needed offline
+
+
+files = itertools.count()
+
+
+class Run(object):
+    """One optimization of cost(x) + noise, from x0, for at most max_evaluations experiment loops."""
+
+    def __init__(self, method, cost=quadratic, x0=(0., 0.), step=.5, tolerance=1e-3, noise=0., batch_size=1,
+                 max_evaluations=300):
+        ivars = [FakeIndependentVariable('x{}'.format(i), v, step, tolerance) for i, v in enumerate(x0)]
+        self.experiment = FakeExperiment(ivars)
+        self.optimizer = Optimization('optimizer', self.experiment)
+        self.optimizer.enable_override = True
+        self.optimizer.optimization_method = method
+        self.optimizer.batch_size = batch_size
+        self.optimizer.cost_function = COST_FUNCTION
+        self.cost = cost
+        self.noise = noise
+        self.max_evaluations = max_evaluations
+        self.hdf5 = h5py.File('optimizer_harness_{}.hdf5'.format(next(files)), 'w', driver='core',
+                              backing_store=False)
+        self.hdf5.create_group('analysis/optimizer')
+        self.batch_sizes = []  # the size of the batch each evaluation belonged to
+        self.true_costs = []  # the noiseless cost of each evaluated point
+
+    def run(self):
+        opt = self.optimizer
+        opt.setup(self.hdf5)
+        for n in xrange(self.max_evaluations):
+            x = np.array([i.currentValue for i in self.experiment.independentVariables])
+            group = self.hdf5.create_group('experiments/{}'.format(n))
+            group.attrs['experiment_number'] = n
+            true_cost = self.cost(x)
+            group.attrs['cost'] = true_cost + self.noise * np.random.randn()
+            group.attrs['sigma'] = self.noise
+            self.true_costs.append(true_cost)
+            self.batch_sizes.append(len(opt.batch))
+            opt.update(self.hdf5, group)
+            if opt.is_done:
+                break
+        return self
+
+    def evaluations_to(self, target):
+        """The number of evaluations until the noiseless cost of an evaluated point was below target, or None."""
+        below = np.flatnonzero(np.array(self.true_costs) < target)
+        if len(below):
+            return below[0] + 1
+        return None
+
+    def close(self):
+        self.hdf5.close()
+
+
+def compare(repeats=5, noise=.01, target=.01, methods=range(len(METHODS)), costs=(quadratic, rosenbrock)):
+    """Print the median number of evaluations each method needs to reach target, on each cost function."""
+    for cost in costs:
+        print '{} (noise {}, target {}):'.format(cost.__name__, noise, target)
+        for method in methods:
+            results = []
+            for seed in xrange(repeats):
+                np.random.seed(seed)
+                run = Run(method, cost, noise=noise).run()
+                results.append(run.evaluations_to(target))
+                run.close()
+            reached = [r for r in results if r is not None]
+            median = np.median(reached) if reached else float('nan')
+            print '  {:>22}: {:>6.1f} evaluations (median), reached {}/{}'.format(
+                METHODS[method], median, len(reached), repeats)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    compare(*([int(args[0])] if args else []) + [float(a) for a in args[1:]])
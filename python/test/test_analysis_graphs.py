@@ -0,0 +1,90 @@
+import pytest
+import sys
+import numpy as np
+sys.path.append("..")
+from atom.api import Int
+from analysis import MeasurementsGraph, IterationsGraph, plot_points
+
+
+class FakeSource(object):
+    meas_analysis_path = 'analysis/roi_sums'
+
+    def __init__(self):
+        self.measurementDependents = []
+
+
+class FakeConfig(object):
+    def get(self, section, option):
+        return 'roi_source'
+
+
+class FakeExperiment(object):
+    allow_evaluation = False
+    gui = None
+    ROITypeString = 'roi_sums'
+    totalIterations = 2
+
+    def __init__(self):
+        self.Config = self
+        self.config = FakeConfig()
+        self.roi_source = FakeSource()
+        self.squareROIAnalysis = FakeSource()
+        self.loading_filters = FakeSource()
+
+
+class ShortMeasurementsGraph(MeasurementsGraph):
+    history_length = Int(5)
+
+
+def measurements(n, seed=0):
+    """n measurements of ROI sums shaped (shots, sub-measurements, rois)"""
+    return np.random.RandomState(seed).poisson(100, (n, 2, 1, 3)).astype(np.float64)
+
+
+def iterations_graph():
+    graph = IterationsGraph('iterations_graph', FakeExperiment())
+    graph.queueAfterMeasurement = False
+    graph.enable = True
+    graph.preExperiment(None)
+    return graph
+
+
+def test_iterations_graph_running_mean_and_sigma():
+    graph = iterations_graph()
+    data = [measurements(7, seed=1), measurements(1, seed=2), measurements(4, seed=3)]
+    for iteration, d in enumerate(data):
+        graph.preIteration(None, None)
+        for n, m in enumerate(d):
+            graph.analyzeMeasurement({'analysis/roi_sums': m}, None, None)
+            # the last row follows the measurements so far, from the first one on
+            np.testing.assert_allclose(graph.mean[-1], np.mean(d[:n+1], axis=0))
+            np.testing.assert_allclose(graph.sigma[-1], np.std(d[:n+1], axis=0)/np.sqrt(n+1), atol=1e-12)
+        assert len(graph.mean) == iteration + 1
+    # a single measurement has no spread
+    assert np.all(graph.sigma[1] == 0)
+    # earlier iterations are kept as they were, past the preallocated number of iterations
+    np.testing.assert_allclose(graph.mean[0], np.mean(data[0], axis=0))
+    np.testing.assert_allclose(graph.sigma[0], np.std(data[0], axis=0)/np.sqrt(7))
+
+
+def test_measurements_graph_keeps_the_newest_history():
+    graph = ShortMeasurementsGraph('measurements_graph', FakeExperiment())
+    graph.enable = True
+    d = measurements(12)
+    for m in d:
+        graph.analyzeMeasurement({'analysis/roi_sums': m}, None, None)
+    assert graph.total_measurements == 12
+    np.testing.assert_array_equal(graph.data, d[-5:])
+    # a new ROI configuration starts over
+    graph.analyzeMeasurement({'analysis/roi_sums': np.zeros((2, 1, 4))}, None, None)
+    assert graph.total_measurements == 1 and graph.data.shape == (1, 2, 1, 4)
+
+
+@pytest.mark.parametrize('n', [0, 1, 10, 2000, 2001, 2002, 4999, 10000])
+def test_plot_points_keep_the_last_point(n):
+    x = np.arange(n)[plot_points(n, 2000)]
+    assert len(x) <= 2000
+    if n:
+        assert x[-1] == n - 1
+    if n <= 2000:
+        assert len(x) == n
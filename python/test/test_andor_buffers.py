@@ -0,0 +1,94 @@
+import pytest
+import sys
+import numpy as np
+import h5py
+from ctypes import c_int
+sys.path.append("..")
+import andor
+
+
+class FakeAndorDLL(object):
+    """Stands in for the Andor SDK.  Each readout fills the buffer it is handed
+    with a ramp offset by the readout count, and remembers the buffer address."""
+
+    def __init__(self):
+        self.readouts = 0
+        self.addresses = []
+
+    def GetAcquiredData(self, ref, size):
+        buf = ref._obj
+        assert len(buf) == size
+        self.readouts += 1
+        self.addresses.append(np.ctypeslib.as_array(buf).ctypes.data)
+        np.ctypeslib.as_array(buf)[:] = np.arange(size, dtype=c_int) + self.readouts
+        return 20002  # DRV_SUCCESS
+
+
+@pytest.fixture()
+def camera():
+    cam = andor.AndorCamera('cam', None, 'test')
+    cam.dll = FakeAndorDLL()
+    cam.acquisitionMode = 0  # single scan
+    cam.binMode = 0
+    cam.subimage_size = [4, 3]
+    cam.shotsPerMeasurement.value = 2
+    cam.bit_depths = [16]
+    cam.channel = 0
+    return cam
+
+
+@pytest.fixture()
+def hdf5():
+    h5 = h5py.File('test_andor.hdf5', 'w', driver='core', backing_store=False)
+    yield h5
+    h5.close()
+
+
+def test_buffer_reused(camera):
+    first = camera.GetAcquiredData()
+    assert first.shape == (2, 3, 4)
+    assert first[0, 0, 0] == 1
+    second = camera.GetAcquiredData()
+    assert second[0, 0, 0] == 2
+    assert camera.dll.addresses[0] == camera.dll.addresses[1]
+    assert second.ctypes.data == first.ctypes.data
+
+
+@pytest.mark.parametrize('change, shape', [
+    (lambda cam: setattr(cam.shotsPerMeasurement, 'value', 3), (3, 3, 4)),
+    (lambda cam: setattr(cam, 'subimage_size', [6, 5]), (2, 5, 6)),
+    (lambda cam: setattr(cam, 'binMode', 1), (2, 1, 2)),
+])
+def test_buffer_reallocated_on_config_change(camera, change, shape):
+    camera.GetAcquiredData()
+    change(camera)
+    data = camera.GetAcquiredData()
+    assert data.shape == shape
+    np.testing.assert_array_equal(data.ravel(), np.arange(data.size) + 2)
+    # and reused again once the configuration is stable
+    camera.GetAcquiredData()
+    assert camera.dll.addresses[1] == camera.dll.addresses[2]
+
+
+def test_no_uint16_in_accumulate_mode(camera):
+    camera.storeUint16 = True
+    assert camera.storage_dtype() == np.uint16
+    camera.acquisitionMode = 1  # accumulate can overflow 16 bits
+    assert camera.storage_dtype() == np.int32
+
+
+@pytest.mark.parametrize('store_uint16, bit_depths, dtype', [
+    (False, [16], np.int32),
+    (True, [16], np.uint16),
+    (True, [18], np.int32),
+])
+def test_write_results_dtype(camera, hdf5, store_uint16, bit_depths, dtype):
+    camera.storeUint16 = store_uint16
+    camera.bit_depths = bit_depths
+    camera.enable = True
+    camera.data = camera.GetAcquiredData()
+    camera.writeResults(hdf5)
+    for i in range(2):
+        shot = hdf5['Andor_0/shots/{}'.format(i)]
+        assert shot.dtype == dtype
+        np.testing.assert_array_equal(shot[()], camera.data[i])
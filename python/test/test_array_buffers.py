@@ -0,0 +1,65 @@
+import pytest
+import sys
+import numpy as np
+sys.path.append("..")
+from array_buffers import GrowableArray
+
+
+def test_append_grows():
+    buf = GrowableArray(capacity=2)
+    rows = [np.full((3, 2), i) for i in range(10)]
+    for r in rows:
+        buf.append(r)
+    assert len(buf) == 10
+    assert buf.capacity >= 10
+    assert buf.view().shape == (10, 3, 2)
+    assert np.all(buf.view() == np.array(rows))
+    assert np.all(buf.last() == 9)
+
+
+def test_extend_matches_append():
+    a = GrowableArray(shape=(2,), dtype=np.float64, capacity=1)
+    b = GrowableArray(shape=(2,), dtype=np.float64, capacity=1)
+    data = np.arange(20, dtype=np.float64).reshape(10, 2)
+    for r in data:
+        a.append(r)
+    b.extend(data[:3])
+    b.extend(data[3:])
+    assert np.all(a.view() == b.view())
+
+
+@pytest.mark.parametrize('maxlen, n', [(1, 5), (4, 3), (4, 17), (5, 100)])
+def test_maxlen_keeps_most_recent(maxlen, n):
+    buf = GrowableArray(maxlen=maxlen)
+    for i in range(n):
+        buf.append(i)
+    expected = np.arange(n)[-maxlen:]
+    assert len(buf) == len(expected)
+    assert np.all(buf.view() == expected)
+    # storage does not grow beyond twice the maximum length
+    assert buf.capacity <= 2*maxlen
+
+
+def test_maxlen_extend():
+    buf = GrowableArray(maxlen=4)
+    buf.extend(np.arange(3))
+    buf.extend(np.arange(3, 10))
+    assert np.all(buf.view() == [6, 7, 8, 9])
+
+
+def test_shape_mismatch():
+    buf = GrowableArray()
+    buf.append(np.zeros(3))
+    with pytest.raises(ValueError):
+        buf.append(np.zeros(4))
+
+
+def test_reset():
+    buf = GrowableArray()
+    buf.append(np.zeros(3))
+    buf.reset()
+    assert len(buf) == 0
+    # a new row shape is accepted after a reset with a new shape
+    buf.reset(shape=(4,), dtype=np.float64)
+    buf.append(np.ones(4))
+    assert np.all(buf.view() == 1)
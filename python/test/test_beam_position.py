@@ -0,0 +1,34 @@
+import pytest
+import sys
+import numpy as np
+sys.path.append("..")
+import beam_position_analysis as bpa
+
+# make repeatable
+np.random.seed(seed=0)
+
+
+def gaussian_image(x0, y0, sigma=2.0, shape=(40, 50), amplitude=1000., background=100.):
+    rows, cols = np.indices(shape)
+    return amplitude*np.exp(-((cols - x0)**2 + (rows - y0)**2)/(2*sigma**2)) + background
+
+
+@pytest.mark.parametrize('x0, y0', [(25.0, 20.0), (10.3, 30.7), (40.5, 5.25)])
+def test_beam_centers_exact(x0, y0):
+    x, y = bpa.beam_centers(gaussian_image(x0, y0))
+    assert x[0] == pytest.approx(x0, abs=0.05)
+    assert y[0] == pytest.approx(y0, abs=0.05)
+
+
+def test_beam_centers_batch():
+    centers = np.random.uniform(8, 32, size=(20, 2))
+    images = np.array([gaussian_image(x0, y0) + np.random.normal(0, 1, (40, 50)) for x0, y0 in centers])
+    x, y = bpa.beam_centers(images)
+    assert x.shape == (20,)
+    assert np.allclose(x, centers[:, 0], atol=0.1)
+    assert np.allclose(y, centers[:, 1], atol=0.1)
+
+
+def test_no_peak_is_nan():
+    x, y = bpa.beam_centers(np.zeros((10, 10)))
+    assert np.isnan(x[0]) and np.isnan(y[0])
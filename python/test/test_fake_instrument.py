@@ -0,0 +1,64 @@
+import pytest
+import sys
+import numpy as np
+import h5py
+sys.path.append("..")
+import FakeInstrument
+from SquareROIAnalysis import roi_sums
+
+
+class FakeExperiment(object):
+    ROI_rows = 3
+    ROI_columns = 4
+    gui = None
+
+    def __init__(self):
+        self.experiment = self
+
+
+@pytest.fixture(autouse=True)
+def random_state():
+    """The fake instruments draw from the global numpy generator, so put it back as the other tests seeded it."""
+    state = np.random.get_state()
+    np.random.seed(0)
+    yield
+    np.random.set_state(state)
+
+
+def test_fake_camera_atoms_are_found_by_the_threshold():
+    camera = FakeInstrument.FakeCamera('camera', FakeExperiment())
+    camera.shotsPerMeasurement.value = 3
+    camera.data_sets = 4
+    camera.initialize()
+    assert len(camera.frames) == 4
+    dtype = [('left', np.uint16), ('top', np.uint16), ('right', np.uint16), ('bottom', np.uint16)]
+    rois = np.array(camera.rois(), dtype=dtype)
+    atoms = np.array([[roi_sums(rois, shot) > camera.threshold() for shot in stack] for stack in camera.frames])
+    assert atoms.shape == (4, 3, 12) and camera.frames[0].dtype == np.uint16
+    # some sites load, and an atom is only ever kept, never gained
+    assert 0 < atoms[:, 0].sum() < atoms[:, 0].size
+    assert not np.any(atoms[:, 1:] & ~atoms[:, :-1])
+
+    f = h5py.File('fake_camera.hdf5', 'w', driver='core', backing_store=False)
+    camera.writeResults(f)
+    assert sorted(f['FakeCamera/shots'].keys()) == ['0', '1', '2']
+
+
+def test_fake_data_shapes_and_timing():
+    experiment = FakeExperiment()
+    counter = FakeInstrument.FakeCounter('counter', experiment)
+    counter.bins, counter.counters = 100, 2
+    ai = FakeInstrument.FakeAnalogInput('ai', experiment)
+    ai.channels, ai.samples = 4, 50
+    f = h5py.File('fake_data.hdf5', 'w', driver='core', backing_store=False)
+    for i in (counter, ai):
+        i.initialize()
+        i.writeResults(f)
+    assert f['counter/data'].shape == (100, 2) and f['AI/data'].shape == (4, 50)
+
+    ai.period = .05
+    ai.isDone = False
+    ai.start()
+    assert not ai.isDone
+    ai.timer.join()
+    assert ai.isDone
@@ -0,0 +1,164 @@
+import pytest
+import sys
+import numpy as np
+sys.path.append("..")
+import cs_evaluate
+import timeline
+from functional_waveforms import FunctionalWaveforms
+
+WAVEFORMS = """experiment.runs += 1
+experiment.names = set(globals())
+HSDIO = experiment.LabView.HSDIO.add_transition
+
+def pulse(t, channel, duration):
+    HSDIO(t, channel, True)
+    HSDIO(t + duration, channel, False)
+    return t + duration
+
+pulse(1, 0, width)
+"""
+
+
+class FakeOutput(object):
+    def __init__(self):
+        self.transition_list = timeline.TransitionBuffer()
+        self.repeat_list = []
+
+    def add_transition(self, time, channel, state):
+        self.transition_list.append((time, channel, state))
+
+    def add_repeat(self, time, function, repeats):
+        self.repeat_list.append({'t0': time, 'tf': time + repeats})
+
+
+class FakeLabView(object):
+    def __init__(self):
+        self.HSDIO = FakeOutput()
+        self.DAQmxDO = FakeOutput()
+        self.AnalogOutput = FakeOutput()
+
+
+class FakeExperiment(object):
+    allow_evaluation = True
+    gui = None
+
+    def __init__(self):
+        self.LabView = FakeLabView()
+        self.runs = 0
+        self.names = set()
+        self.set_vars(width=2., other=[1, 2])
+
+    def set_vars(self, **kwargs):
+        self.vars = dict(kwargs, experiment=self)
+        cs_evaluate.execWithDict('', self.vars)
+
+
+@pytest.fixture()
+def waveforms(tmpdir):
+    cls = type('TestWaveforms', (FunctionalWaveforms,), {'SETTINGS_WAVEFORM': str(tmpdir.join('settings_waveform.py'))})
+    w = cls('functional_waveforms', FakeExperiment())
+    w.enable = True
+    w.text = WAVEFORMS
+    return w
+
+
+def transitions(w):
+    return w.experiment.LabView.HSDIO.transition_list.columns()[0].tolist()
+
+
+def test_compiled_once_per_text(waveforms):
+    waveforms.evaluate()
+    code = waveforms.compiled
+    waveforms.evaluate()
+    assert waveforms.compiled is code
+    assert waveforms.experiment.runs == 2
+    # the transitions of the previous run are cleared
+    assert transitions(waveforms) == [1, 3]
+    waveforms.text = WAVEFORMS + '\npulse(5, 1, 1)'
+    waveforms.evaluate()
+    assert waveforms.compiled is not code
+    assert transitions(waveforms) == [1, 3, 5, 6]
+
+
+def test_namespace_has_only_used_globals(waveforms):
+    waveforms.evaluate()
+    names = waveforms.experiment.names
+    # builtins like set and globals come from __builtins__
+    assert names == {'__builtins__', 'experiment', 'width'}
+
+
+def test_settings_file_written_when_changed(waveforms):
+    path = waveforms.SETTINGS_WAVEFORM
+    waveforms.evaluate()
+    waveforms.evaluate()
+    # the waveform from the previous evaluate is written
+    assert open(path).read() == WAVEFORMS
+    written = waveforms.written
+    waveforms.evaluate()
+    assert waveforms.written is written
+    # an edited file is written again
+    with open(path, 'w') as f:
+        f.write('edited')
+    waveforms.evaluate()
+    assert open(path).read() == WAVEFORMS
+
+
+def test_load_from_settings(waveforms):
+    waveforms.evaluate()
+    waveforms.load_from_settings = True
+    waveforms.text = ''
+    waveforms.evaluate()
+    assert waveforms.waveform_text == WAVEFORMS
+    assert transitions(waveforms) == [1, 3]
+
+
+def test_memo_skips_unchanged_variables(waveforms):
+    experiment = waveforms.experiment
+    waveforms.memoize = True
+    waveforms.evaluate()
+    waveforms.evaluate()
+    assert experiment.runs == 1 and waveforms.unchanged
+    # the transitions are kept for the instruments to compile again if they need to
+    assert transitions(waveforms) == [1, 3]
+    # a variable the waveforms don't use
+    experiment.set_vars(width=2., other=[3])
+    waveforms.evaluate()
+    assert experiment.runs == 1
+    # a variable they do use
+    experiment.set_vars(width=np.float64(4), other=[3])
+    waveforms.evaluate()
+    assert experiment.runs == 2 and not waveforms.unchanged
+    assert transitions(waveforms) == [1, 5]
+    # without the memo, always run
+    waveforms.memoize = False
+    waveforms.evaluate()
+    assert experiment.runs == 3
+
+
+def test_memo_keeps_the_repeats(waveforms):
+    HSDIO = waveforms.experiment.LabView.HSDIO
+    waveforms.memoize = True
+    waveforms.text = WAVEFORMS + '\nexperiment.LabView.HSDIO.add_repeat(10, None, 5)'
+    waveforms.evaluate()
+    assert HSDIO.repeat_list == [{'t0': 10, 'tf': 15}]
+    # HSDIO.toHardware empties the list, but the overlap check must see the repeats again after a memo hit
+    HSDIO.repeat_list = []
+    waveforms.evaluate()
+    assert waveforms.unchanged and HSDIO.repeat_list == [{'t0': 10, 'tf': 15}]
+    waveforms.evaluate()
+    assert len(HSDIO.repeat_list) == 1
+
+
+def test_disabled_waveforms_clear_transitions(waveforms):
+    waveforms.evaluate()
+    waveforms.enable = False
+    waveforms.evaluate()
+    assert transitions(waveforms) == []
+
+
+def test_syntax_error(waveforms):
+    waveforms.text = 'pulse(('
+    with pytest.raises(Exception) as e:
+        waveforms.evaluate()
+    assert e.typename == 'PauseError'
+    assert waveforms.compiled is None
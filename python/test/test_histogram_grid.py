@@ -0,0 +1,20 @@
+import sys
+import numpy as np
+sys.path.append("..")
+from histogram_analysis import shots_by_roi
+
+
+def test_square_roi_sums_are_not_sub_measurements():
+    # 5 measurements of 2 shots, on a 3 x 4 grid of ROIs
+    sums = np.arange(5 * 2 * 3 * 4).reshape(5, 2, 3, 4)
+    shots = shots_by_roi(sums, square_rois=True)
+    assert shots.shape == (5, 2, 12)
+    np.testing.assert_array_equal(shots[4, 1], sums[4, 1].ravel())
+
+
+def test_sub_measurements_are_flattened():
+    # 5 measurements of 3 sub-measurements, 2 shots and 7 ROIs
+    sums = np.arange(5 * 3 * 2 * 7).reshape(5, 3, 2, 7)
+    assert shots_by_roi(sums).shape == (15, 2, 7)
+    sums = np.zeros((5, 2, 7))
+    assert shots_by_roi(sums) is sums
@@ -0,0 +1,88 @@
+import pytest
+import sys
+import threading
+import time
+sys.path.append("..")
+import instrument_workers
+from cs_errors import PauseError
+
+
+class FakeCamera(object):
+    """Records which thread each readout ran on, and how long it took."""
+
+    def __init__(self, name, delay=0.05, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.threads = []
+        self.finished = 0
+
+    def acquire_data(self):
+        self.threads.append(threading.current_thread().ident)
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('readout failed')
+        self.finished += 1
+
+
+@pytest.fixture()
+def workers():
+    w = {}
+    yield w
+    instrument_workers.stop_workers(w)
+
+
+def test_cameras_read_out_concurrently(workers):
+    cameras = [FakeCamera('cam{}'.format(i), delay=0.2) for i in range(3)]
+    start = time.time()
+    instrument_workers.acquire_in_parallel(cameras, workers, timeout=5)
+    assert time.time() - start < 0.5
+    assert [c.finished for c in cameras] == [1, 1, 1]
+
+
+def test_workers_are_persistent(workers):
+    cameras = [FakeCamera('cam{}'.format(i), delay=0) for i in range(2)]
+    for _ in range(3):
+        instrument_workers.acquire_in_parallel(cameras, workers, timeout=5)
+    for c in cameras:
+        assert len(set(c.threads)) == 1
+    assert cameras[0].threads[0] != cameras[1].threads[0]
+    assert len(workers) == 2
+
+
+def test_failure_waits_for_other_cameras(workers):
+    good = FakeCamera('good', delay=0.2)
+    bad = FakeCamera('bad', delay=0, fail=True)
+    with pytest.raises(PauseError):
+        instrument_workers.acquire_in_parallel([bad, good], workers, timeout=5)
+    # the healthy camera was not left mid-readout
+    assert good.finished == 1
+
+
+def test_timeout(workers):
+    slow = FakeCamera('slow', delay=0.5)
+    fast = FakeCamera('fast', delay=0)
+    start = time.time()
+    with pytest.raises(PauseError):
+        instrument_workers.acquire_in_parallel([slow, fast], workers, timeout=0.1)
+    assert time.time() - start < 0.4
+    assert fast.finished == 1
+
+
+class FakeOutput(FakeCamera):
+    """An output instrument whose compile takes delay seconds."""
+
+    def parse_transition_list(self):
+        self.acquire_data()
+        return self.name
+
+
+def test_call_in_parallel_returns_results_and_timings(workers):
+    outputs = [FakeOutput('HSDIO', delay=0.3), FakeOutput('AnalogOutput', delay=0.1), FakeOutput('DAQmxDO', delay=0)]
+    start = time.time()
+    results = instrument_workers.call_in_parallel(outputs, workers, 'parse_transition_list')
+    # bounded by the slowest instrument, not the sum
+    assert time.time() - start < 0.39
+    assert [(i, r) for i, r, elapsed in results] == [(o, o.name) for o in outputs]
+    elapsed = [e for i, r, e in results]
+    assert elapsed[0] >= 0.3 and elapsed[1] >= 0.1 and elapsed[2] < 0.1
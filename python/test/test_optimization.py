@@ -0,0 +1,158 @@
+import pytest
+import sys
+import time
+import threading
+import warnings
+import numpy as np
+sys.path.append("..")
+import optimizer_harness
+from optimizer_harness import Run, quadratic
+
+CENTER = np.array([1.0, -2.0])
+
+
+def run(method, **kwargs):
+    r = Run(method, **kwargs).run()
+    r.close()
+    return r
+
+
+def optimizer_data(method, **kwargs):
+    r = Run(method, **kwargs).run()
+    data = {k: v[()] for k, v in r.hdf5['analysis/optimizer'].items()}
+    r.close()
+    return r, data
+
+
+@pytest.mark.parametrize('method', [0, 3, 4])
+def test_simplex_explores_axes_in_one_batch(method):
+    r, data = optimizer_data(method)
+    # the initial point, then both axes together
+    assert r.batch_sizes[:3] == [1, 2, 2]
+    np.testing.assert_array_equal(data['experiment_numbers'][:3], [0, 1, 2])
+    np.testing.assert_array_equal(data['batches'][:3], [0, 1, 1])
+    np.testing.assert_array_equal(data['values'][1:3], [[.5, 0], [0, .5]])
+    if method != 3:  # the weighted centroid uses negative costs as weights, which does not suit this cost function
+        assert r.optimizer.is_done
+        np.testing.assert_allclose(r.optimizer.best_xi, CENTER, atol=.05)
+
+
+def test_costs_are_attributed_by_experiment_number():
+    r, data = optimizer_data(0)
+    costs = data['costs']
+    np.testing.assert_allclose(costs, [quadratic(x) for x in data['values']], atol=1e-6)
+    assert data['best_experiment_number'] == np.argmin(costs)
+    np.testing.assert_array_equal(data['experiment_numbers'], np.arange(len(costs)))
+
+
+def test_gradient_batches_all_axes():
+    r, data = optimizer_data(2, max_evaluations=20)
+    assert r.batch_sizes[1] == 2
+    # the gradient of the quadratic at the origin is estimated from one batch
+    assert data['costs'][3] < data['costs'][0]
+
+
+def test_genetic_generation_batch():
+    np.random.seed(0)
+    r, data = optimizer_data(1, batch_size=5, max_evaluations=301)
+    assert r.batch_sizes[1:6] == [5] * 5
+    assert data['batches'][-1] == 60
+    assert r.optimizer.best_yi < .05
+
+
+def test_bayesian_converges():
+    np.random.seed(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        r = run(5, tolerance=.05, max_evaluations=60)
+    assert r.optimizer.is_done
+    # the start, then both ways along each axis in one batch
+    assert r.batch_sizes[:5] == [1, 4, 4, 4, 4]
+    np.testing.assert_allclose(r.optimizer.best_xi, CENTER, atol=.05)
+
+
+def test_bayesian_needs_fewer_evaluations_with_noise():
+    evaluations = {}
+    for method in (0, 5):
+        np.random.seed(1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            evaluations[method] = run(method, noise=.01, max_evaluations=40).evaluations_to(.01)
+    assert evaluations[5] is not None
+    assert (evaluations[0] is None) or (evaluations[5] < evaluations[0])
+
+
+def test_cost_function_gets_iteration_aggregates():
+    r = Run(0, max_evaluations=1)
+    opt = r.optimizer
+    opt.cost_function = 'self.yi = -numpy.mean(retention)\nself.y_stat_sigma = roi_sums.shape[0]'
+    opt.setup(r.hdf5)
+    code = opt.compiled_cost_function
+    for n in range(2):
+        group = r.hdf5.create_group('experiments/{}'.format(n))
+        group.attrs['experiment_number'] = n
+        for i in range(3):
+            iteration = group.create_group('iterations/{}'.format(i))
+            iteration['analysis/loading_retention/retention'] = np.array([.5, .7]) + n
+            iteration['analysis/square_roi/sums'] = np.ones((4, 2, 2))
+        opt.update(r.hdf5, group)
+        assert opt.ylist[-1] == pytest.approx(-.6 - n)
+        assert opt.y_stat_sigma_list[-1] == 3
+    # compiled once for the whole experiment
+    assert opt.compiled_cost_function is code
+    # only the results that the cost function uses are read
+    opt.cost_function = 'def cost():\n    return -numpy.mean(retention)\nself.yi = cost()'
+    opt.compile_cost_function()
+    namespace = opt.cost_function_namespace(r.hdf5, group, opt.cost_function_names)
+    assert 'retention' in namespace and 'roi_sums' not in namespace and 'scan_plan' not in namespace
+    r.close()
+
+
+def test_cost_function_syntax_error():
+    r = Run(0, max_evaluations=1)
+    r.optimizer.cost_function = 'self.yi = ('
+    r.run()
+    assert r.optimizer.ylist == [np.inf]
+    r.close()
+
+
+def test_cost_function_gets_scan_plan():
+    from scan_planner import ScanPlan
+    r = Run(0, max_evaluations=1)
+    ScanPlan(['x'], [np.array([.1, .2, .3])], 'interleaved').toHDF5(r.hdf5)
+    group = r.hdf5.create_group('experiments/0')
+    for i in range(5):
+        group.create_group('iterations/{}'.format(i))
+    namespace = r.optimizer.cost_function_namespace(r.hdf5, group)
+    # a new optimizer loop starts the plan over
+    np.testing.assert_array_equal(namespace['scan_plan']['value']['x'], [.1, .3, .2, .1, .3])
+    r.close()
+
+
+
+started = threading.Event()
+release = threading.Event()
+drawn = []
+
+
+class SlowFigureOptimization(optimizer_harness.Optimization):
+    def updateFigure(self):
+        drawn.append(len(self.ylist))
+        started.set()
+        release.wait(5)
+
+
+def test_figure_redraws_are_combined_but_not_lost():
+    opt = SlowFigureOptimization('optimizer', optimizer_harness.FakeExperiment([]))
+    opt.ylist = [1]
+    opt.update_figure_in_background()
+    assert started.wait(5)
+    # requests during a redraw are not dropped, they make one more redraw with the newest points
+    for n in range(2, 5):
+        opt.ylist = list(range(n))
+        opt.update_figure_in_background()
+    release.set()
+    deadline = time.time() + 5
+    while opt.figure_busy and time.time() < deadline:
+        time.sleep(.01)
+    assert drawn == [1, 4]
@@ -0,0 +1,125 @@
+import pytest
+import sys
+import threading
+import time
+sys.path.append("..")
+from origin_publisher import Publisher, DROP_OLDEST, DROP_NEWEST
+
+
+class StandInServer(object):
+    """Stands in for the Origin server: registers streams and stores what is sent to them.
+
+    The server can be made slow, taken down (sends fail and registration returns None), or held (sends block until
+    released).
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.up = True
+        self.released = threading.Event()
+        self.released.set()
+        self.registrations = []
+        self.received = {}
+
+    def registerStream(self, stream, records=None, timeout=None):
+        self.registrations.append((stream, time.time()))
+        if not self.up:
+            return None
+        return StandInConnection(self, stream)
+
+
+class StandInConnection(object):
+    def __init__(self, server, stream):
+        self.server = server
+        self.stream = stream
+        self.closed = False
+
+    def send(self, **record):
+        self.server.released.wait()
+        time.sleep(self.server.delay)
+        if self.closed or not self.server.up:
+            raise IOError('connection reset')
+        self.server.received.setdefault(self.stream, []).append(record['measurement'])
+
+    def close(self):
+        self.closed = True
+
+
+def add(publisher, server, name):
+    publisher.add_stream(name, server.registerStream(name), lambda: server.registerStream(name))
+
+
+@pytest.fixture()
+def server():
+    return StandInServer()
+
+
+def test_publish_does_not_wait_for_slow_server(server):
+    server.delay = .01
+    publisher = Publisher(batch=10)
+    add(publisher, server, 'a')
+    add(publisher, server, 'b')
+    start = time.time()
+    for i in range(50):
+        publisher.publish('a', {'measurement': i})
+        publisher.publish('b', {'measurement': -i})
+    assert time.time() - start < .1
+    assert publisher.flush(5)
+    assert server.received == {'a': list(range(50)), 'b': [-i for i in range(50)]}
+    assert publisher.counters() == (0, 100, 0)
+    publisher.stop()
+
+
+@pytest.mark.parametrize('policy, kept', [(DROP_OLDEST, [7, 8, 9]), (DROP_NEWEST, [0, 1, 2])])
+def test_drop_policy(server, policy, kept):
+    server.released.clear()
+    publisher = Publisher(size=3, batch=1, policy=policy)
+    add(publisher, server, 'a')
+    publisher.publish('a', {'measurement': 'in flight'})
+    time.sleep(.05)
+    for i in range(10):
+        publisher.publish('a', {'measurement': i})
+    assert publisher.counters() == (3, 0, 7)
+    server.released.set()
+    assert publisher.flush(5)
+    assert server.received['a'] == ['in flight'] + kept
+    publisher.stop()
+
+
+def test_reconnect_with_backoff(server):
+    publisher = Publisher(backoff=.05, max_backoff=.1)
+    add(publisher, server, 'a')
+    publisher.publish('a', {'measurement': 0})
+    assert publisher.flush(5)
+    server.up = False
+    for i in range(1, 4):
+        publisher.publish('a', {'measurement': i})
+    time.sleep(.4)
+    # nothing lost while the server is down, and the retries slow down
+    assert publisher.counters() == (3, 1, 0)
+    retries = [t for name, t in server.registrations[1:]]
+    assert len(retries) >= 2
+    gaps = [b - a for a, b in zip(retries, retries[1:])]
+    assert gaps[0] >= .09 and all(gap < .2 for gap in gaps)
+    server.up = True
+    assert publisher.flush(5)
+    assert server.received['a'] == [0, 1, 2, 3]
+    # a new connection from add_stream replaces the reconnected one, the same one is kept
+    connection = publisher.streams['a'].connection
+    publisher.add_stream('a', publisher.streams['a'].given, publisher.streams['a'].register)
+    assert publisher.streams['a'].connection is connection
+    publisher.stop()
+
+
+def test_stop_does_not_wait_for_a_held_send(server):
+    server.released.clear()
+    publisher = Publisher()
+    add(publisher, server, 'a')
+    publisher.publish('a', {'measurement': 0})
+    time.sleep(.05)
+    start = time.time()
+    assert not publisher.stop(.1)
+    assert time.time() - start < 1
+    server.released.set()
+    publisher.thread.join(5)
+    assert not publisher.thread.is_alive()
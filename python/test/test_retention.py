@@ -0,0 +1,77 @@
+import pytest
+import sys
+import threading
+import numpy as np
+import h5py
+sys.path.append("..")
+from retention_analysis import RetentionAnalysis, RetentionGraph
+from scan_planner import ScanPlan
+
+
+class FakeExperiment(object):
+    allow_evaluation = False
+    gui = None
+    settings_hashes = None
+    previous_settings = None
+
+
+def test_running_standard_error():
+    r = RetentionAnalysis('retention_analysis', FakeExperiment())
+    r.preIteration(None, None)
+    assert r.standard_error() is None
+    # 2 ROIs, the second never loads
+    loaded = np.array([[True, False]] * 4)
+    retained = np.array([[True, False]] * 3 + [[False, False]])
+    r.count(loaded, retained)
+    assert r.standard_error() == pytest.approx(np.sqrt(4/6. * 2/6. / 6))
+    r.count(np.tile(loaded, (24, 1)), np.tile(retained, (24, 1)))
+    np.testing.assert_array_equal(r.loaded, [100, 0])
+    np.testing.assert_array_equal(r.retained, [75, 0])
+    assert r.standard_error() == pytest.approx(np.sqrt(76/102. * 26/102. / 102))
+    # perfect retention is not taken as certain
+    r.preIteration(None, None)
+    r.count(loaded, loaded)
+    assert r.standard_error() > .1
+
+
+class FakeDependency(object):
+    analysisStatus = (0, 0)
+
+
+def test_dependency_wait_does_not_miss_the_wake_up():
+    r = RetentionAnalysis('retention_analysis', FakeExperiment())
+    dep = FakeDependency()
+    waiter = threading.Thread(target=r.wait_for_dependency, args=(dep, (0, 1)))
+    waiter.daemon = True
+    waiter.start()
+    # the dependency finishes without waking the waiting analysis, as when the wake up comes before the wait
+    dep.analysisStatus = (0, 1)
+    waiter.join(2)
+    assert not waiter.is_alive()
+
+
+def test_retention_graph_uses_each_iterations_ivar_value():
+    experiment = FakeExperiment()
+    experiment.ivarNames = ['x', 'y']
+    experiment.ivarValueLists = [np.array([5.]), np.array([.1, .2, .3, .4])]
+    plan = ScanPlan(experiment.ivarNames, experiment.ivarValueLists, 'interleaved')
+    graph = RetentionGraph('retention_graph', experiment)
+    graph.enable = True
+    graph.draw_fig = True
+    graph.list_of_what_to_plot = '[0]'
+    graph.preExperiment(None)
+    f = h5py.File('retention_graph.hdf5', 'w', driver='core', backing_store=False)
+    for iteration, index in enumerate(plan.indices.tolist()):
+        group = f.create_group('iterations/{}'.format(iteration))
+        group.attrs['ivarIndex'] = index
+        # the retention goes with the y value
+        group['analysis/loading_retention/retention'] = [plan.table['value']['y'][iteration]]
+        group['analysis/loading_retention/retention_sigma'] = [0.]
+        graph.analyzeIteration(group, f)
+    label, x = graph.x_values()
+    assert label == 'y'
+    np.testing.assert_array_equal(x, [.1, .3, .2, .4])
+    np.testing.assert_array_equal(x, graph.mean[:, 0])
+    line = graph.figure.axes[0].lines[0]
+    np.testing.assert_array_equal(line.get_xdata(), [.1, .2, .3, .4])
+    np.testing.assert_array_equal(line.get_ydata(), [.1, .2, .3, .4])
@@ -0,0 +1,86 @@
+import pytest
+import sys
+import numpy as np
+import h5py
+sys.path.append("..")
+import scan_planner
+from scan_planner import ScanPlan
+from cs_errors import PauseError
+
+
+def loop_indices(steps, iteration):
+    """The per-iteration calculation that Experiment.updateIndependentVariables used before the scan plan."""
+    bases = np.roll(np.cumprod(steps), 1)
+    bases[0] = 1
+    return (iteration // bases) % steps
+
+
+VALUES = [np.linspace(0, 1, 3), np.array([10, 20]), np.array(['a', 'bb', 'c', 'd'])]
+NAMES = ['x', 'y', 'z']
+
+
+def test_sequential_matches_loop():
+    plan = ScanPlan(NAMES, VALUES)
+    assert plan.total == 24
+    for iteration in range(60):
+        np.testing.assert_array_equal(plan.indices_at(iteration), loop_indices([3, 2, 4], iteration))
+    row = plan.table[5]
+    assert (row['iteration'], row['value']['x'], row['value']['y'], row['value']['z']) == (5, 1., 20, 'a')
+    assert plan.iteration_of([2, 1, 0]) == 5
+
+
+@pytest.mark.parametrize('ordering', scan_planner.ORDERINGS)
+def test_orderings_visit_every_point_once(ordering):
+    plan = ScanPlan(NAMES, VALUES, ordering, seed=3)
+    assert sorted(map(tuple, plan.indices.tolist())) == sorted(map(tuple, scan_planner.grid_indices([3, 2, 4]).tolist()))
+    for iteration, index in enumerate(plan.indices):
+        assert plan.iteration_of(index) == iteration
+
+
+def test_serpentine_changes_one_step_at_a_time():
+    indices = ScanPlan(NAMES, VALUES, 'serpentine').indices
+    steps = np.abs(np.diff(indices, axis=0)).sum(axis=1)
+    assert np.all(steps == 1)
+    np.testing.assert_array_equal(indices[:6, 0], [0, 1, 2, 2, 1, 0])
+
+
+def test_interleaved_passes_cover_the_range():
+    plan = ScanPlan(['x'], [np.arange(8.)], 'interleaved')
+    np.testing.assert_array_equal(plan.table['value']['x'], [0, 4, 2, 6, 1, 5, 3, 7])
+    # not a power of 2
+    np.testing.assert_array_equal(scan_planner.bit_reversed_order(5), [0, 4, 2, 1, 3])
+
+
+def test_randomized_is_repeatable():
+    a = ScanPlan(NAMES, VALUES, 'randomized', seed=1)
+    b = ScanPlan(NAMES, VALUES, 'randomized', seed=1)
+    np.testing.assert_array_equal(a.indices, b.indices)
+    assert not np.array_equal(a.indices, ScanPlan(NAMES, VALUES).indices)
+
+
+def test_no_ivars_and_empty_ivar():
+    plan = ScanPlan([], [])
+    assert plan.total == 1 and plan.indices.shape == (1, 0)
+    plan = ScanPlan(['x', 'y'], [np.array([]), np.array([1., 2.])])
+    np.testing.assert_array_equal(plan.indices, [[0, 0], [0, 1]])
+    assert np.isnan(plan.table['value']['x']).all()
+
+
+@pytest.mark.parametrize('names', [['x', 'y', 'x'], ['x', '', 'z']])
+def test_bad_names_pause(names):
+    with pytest.raises(PauseError):
+        ScanPlan(names, VALUES)
+
+
+def test_hdf5_round_trip():
+    f = h5py.File('scan_plan.hdf5', 'w', driver='core', backing_store=False)
+    plan = ScanPlan(NAMES, VALUES, 'randomized', seed=7)
+    plan.toHDF5(f)
+    table = f['scan_plan'][()]
+    assert f['scan_plan'].attrs['ordering'] == 'randomized' and f['scan_plan'].attrs['seed'] == 7
+    np.testing.assert_array_equal(table, plan.table)
+    for original, stored in zip(VALUES, scan_planner.value_lists(table)):
+        np.testing.assert_array_equal(stored, original)
+    # an empty plan can be stored too
+    ScanPlan([], []).toHDF5(f)
+    assert scan_planner.value_lists(f['scan_plan'][()]) == []
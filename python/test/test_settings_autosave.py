@@ -0,0 +1,127 @@
+import pytest
+import sys
+import itertools
+import numpy as np
+import h5py
+sys.path.append("..")
+from atom.api import Member, Str
+from instrument_property import Prop, ListProp, Numpy1DProp, SETTINGS_HASH
+
+
+class FakeExperiment(object):
+    allow_evaluation = False
+    gui = None
+    settings_hashes = None
+    previous_settings = None
+
+
+class Marker(object):
+    """Records which Leafs are actually serialized, rather than copied from the previous save."""
+
+    def settings_hash(self, memo):
+        return 'marker'
+
+    def toHDF5(self, hdf_parent_node, name):
+        Leaf.saves.append(hdf_parent_node.name.split('/')[-1])
+
+
+class Leaf(Prop):
+    value = Member()
+    text = Str()
+    marker = Member()
+    saves = []
+
+    def __init__(self, name, experiment, value=0):
+        super(Leaf, self).__init__(name, experiment)
+        self.value = value
+        self.marker = Marker()
+        self.properties += ['value', 'text', 'marker']
+
+
+class Branch(Prop):
+    a = Member()
+    b = Member()
+    items = Member()
+    array = Member()
+
+    def __init__(self, name, experiment):
+        super(Branch, self).__init__(name, experiment)
+        self.a = Leaf('a', experiment, 1)
+        self.b = Leaf('b', experiment, np.arange(5.))
+        self.items = ListProp('items', experiment, listProperty=[Leaf('x', experiment, 'x'), Leaf('y', experiment, 2.5)],
+                              listElementType=Leaf)
+        self.array = Numpy1DProp('array', experiment)
+        self.array.array = np.arange(3)
+        self.properties += ['a', 'b', 'items', 'array']
+
+
+files = itertools.count()
+
+
+def save(root, previous=None):
+    """Save the tree the way Experiment.autosave does."""
+    experiment = root.experiment
+    f = h5py.File('settings_{}.hdf5'.format(next(files)), 'w', driver='core', backing_store=False)
+    experiment.previous_settings = previous
+    experiment.settings_hashes = {}
+    del Leaf.saves[:]
+    root.toHDF5(f.create_group('settings'))
+    experiment.settings_hashes = None
+    experiment.previous_settings = None
+    return f
+
+
+@pytest.fixture()
+def root():
+    return Branch('experiment', FakeExperiment())
+
+
+def test_unchanged_tree_is_copied(root):
+    first = save(root)
+    assert sorted(Leaf.saves) == ['a', 'b', 'x', 'y']
+    second = save(root, first)
+    assert Leaf.saves == []
+    assert second['settings/experiment'].attrs[SETTINGS_HASH] == first['settings/experiment'].attrs[SETTINGS_HASH]
+    np.testing.assert_array_equal(second['settings/experiment/b/value'][()], np.arange(5.))
+    np.testing.assert_array_equal(second['settings/experiment/array'][()], np.arange(3))
+
+
+def test_only_changed_props_are_saved(root):
+    first = save(root)
+    root.b.value = np.arange(6.)
+    root.items.listProperty[0].text = 'changed'
+    second = save(root, first)
+    # a and y are copied from the previous save
+    assert sorted(Leaf.saves) == ['b', 'x']
+    np.testing.assert_array_equal(second['settings/experiment/b/value'][()], np.arange(6.))
+    assert second['settings/experiment/items/x/text'][()] == 'changed'
+    assert second['settings/experiment/a/value'][()] == 1
+
+
+def test_array_change_in_place_is_detected(root):
+    first = save(root)
+    root.b.value[0] = 10
+    save(root, first)
+    assert Leaf.saves == ['b']
+
+
+def test_load_ignores_hash(root):
+    f = save(root, save(root))
+    loaded = Branch('experiment', FakeExperiment())
+    loaded.a.value = None
+    loaded.fromHDF5(f['settings/experiment'])
+    assert loaded.a.value == 1
+    np.testing.assert_array_equal(loaded.b.value, np.arange(5.))
+
+
+def test_plain_save_clears_stale_hashes(root):
+    f = save(root)
+    # a save outside of autosave, like Origin rewriting its settings at the end of an experiment
+    root.a.toHDF5(f['settings/experiment'])
+    assert SETTINGS_HASH not in f['settings/experiment/a'].attrs
+    assert SETTINGS_HASH not in f['settings/experiment'].attrs
+    assert SETTINGS_HASH in f['settings/experiment/b'].attrs
+    # so the changed branch cannot be copied from this file
+    root.a.value = 1
+    save(root, f)
+    assert Leaf.saves == ['a']
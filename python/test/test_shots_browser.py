@@ -0,0 +1,104 @@
+import pytest
+import sys
+import numpy as np
+import h5py
+sys.path.append("..")
+from analysis import ShotsBrowserAnalysis
+from scan_planner import ScanPlan
+
+
+class FakeConfig(object):
+    def get(self, section, option):
+        return 'Camera'
+
+
+class FakeExperiment(object):
+    allow_evaluation = False
+    gui = None
+    settings_hashes = None
+    previous_settings = None
+    hdf5 = None
+    iteration = 0
+
+    def __init__(self):
+        self.Config = self
+        self.config = FakeConfig()
+
+
+# 2 x 3 ivar values, and the last iteration repeats the ivar indices of the first
+PLAN = ScanPlan(['x', 'y'], [np.array([.1, .2]), np.array([1, 2, 3])])
+INDICES = PLAN.indices.tolist() + [[0, 0]]
+
+
+def shot_image(iteration, measurement, shot):
+    return np.full((2, 2), 100 * iteration + 10 * measurement + shot, dtype=np.uint16)
+
+
+def write_results(path, index_table=True):
+    f = h5py.File(path, 'w')
+    f.attrs['ivarNames'] = ['x', 'y']
+    PLAN.toHDF5(f)
+    for iteration, index in enumerate(INDICES):
+        group = f.create_group('iterations/{}'.format(iteration))
+        group.attrs['iteration'] = iteration
+        group.attrs['ivarIndex'] = index
+        for m in range(2):
+            for s in range(2):
+                group['measurements/{}/data/Camera/shots/{}'.format(m, s)] = shot_image(iteration, m, s)
+    if index_table:
+        f['iteration_index'] = [[i] + index for i, index in enumerate(INDICES)]
+    f.close()
+
+
+@pytest.fixture()
+def browser():
+    b = ShotsBrowserAnalysis(FakeExperiment())
+    yield b
+    b.close_results()
+
+
+@pytest.mark.parametrize('index_table', [True, False])
+def test_index_from_hdf5(tmpdir, index_table):
+    path = str(tmpdir.join('results.hdf5'))
+    write_results(path, index_table)
+    with h5py.File(path, 'r') as f:
+        index = ShotsBrowserAnalysis.index_from_hdf5(f)
+    assert len(index) == 6
+    # the first iteration with the indices is kept
+    assert index[(0, 0)] == 0
+    assert index[(1, 2)] == 5
+
+
+def test_open_results_file(tmpdir, browser):
+    path = str(tmpdir.join('results.hdf5'))
+    write_results(path, index_table=False)
+    browser.open_path(path)
+    assert browser.ivarNames == ['x', 'y']
+    np.testing.assert_array_equal(browser.ivarValueLists[1], [1, 2, 3])
+    np.testing.assert_array_equal(browser.array, shot_image(0, 0, 0))
+    browser.setIteration(1, 2)
+    browser.measurement = 1
+    np.testing.assert_array_equal(browser.array, shot_image(4, 1, 0))
+    browser.close_results()
+    assert browser.experimentResults is None
+
+
+def test_get_shot_cache(tmpdir, browser):
+    path = str(tmpdir.join('results.hdf5'))
+    write_results(path)
+    browser.open_path(path)
+    browser.cache_size = 2
+    image = browser.get_shot(1, 0, 1)
+    np.testing.assert_array_equal(image, shot_image(1, 0, 1))
+    assert browser.get_shot(1, 0, 1) is image
+    browser.get_shot(2, 0, 0)
+    browser.get_shot(1, 0, 1)
+    browser.get_shot(3, 0, 0)
+    # the least recently used shot is dropped
+    assert list(browser.image_cache) == [(1, 0, 1), (3, 0, 0)]
+
+    # shots of the running iteration are not cached
+    browser.experiment.hdf5 = browser.experimentResults
+    browser.experiment.iteration = 4
+    browser.get_shot(4, 0, 0)
+    assert (4, 0, 0) not in browser.image_cache
@@ -0,0 +1,76 @@
+import sys
+import time
+import threading
+import numpy as np
+import h5py
+sys.path.append("..")
+from stage_profiler import Profiler, NULL_SPAN
+
+
+def enabled_profiler(size=2**10):
+    profiler = Profiler(size)
+    profiler.enabled = True
+    return profiler
+
+
+def test_disabled_records_nothing():
+    profiler = Profiler()
+    assert profiler.span('run') is NULL_SPAN
+    with profiler.span('run'):
+        pass
+    profiler.record('run', 0, 1)
+    assert profiler.recorded == 0 and len(profiler.summary()) == 0
+
+
+def test_spans_and_summary():
+    profiler = enabled_profiler()
+    with profiler.span('sleep'):
+        time.sleep(.02)
+    for duration in range(1, 101):
+        profiler.record('counted', 0, duration)
+    profiler.iteration = 1
+    profiler.record('counted', 0, 1000)
+    rows = profiler.summary(iteration=0)
+    assert list(rows['stage']) == ['sleep', 'counted']
+    sleep, counted = rows
+    assert sleep['count'] == 1 and sleep['max'] >= .02
+    assert counted['count'] == 100 and counted['max'] == 100 and counted['total'] == 5050
+    np.testing.assert_allclose([counted['p50'], counted['p95']], np.percentile(np.arange(1, 101), [50, 95]))
+    assert profiler.summary()['max'][1] == 1000
+    report = profiler.report(0).splitlines()
+    assert len(report) == 3 and report[1].startswith('counted')
+
+
+def test_ring_buffer_keeps_the_newest():
+    profiler = enabled_profiler(size=8)
+    for i in range(20):
+        profiler.record('a', i, i)
+    recent = profiler.recent()
+    assert len(recent) == 8
+    np.testing.assert_array_equal(recent['duration'], np.arange(12, 20))
+
+
+def test_threads_and_timed():
+    profiler = enabled_profiler()
+    threads = [threading.Thread(target=profiler.timed('thread {}'.format(i % 2), time.sleep), args=(.001,))
+               for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    rows = profiler.summary()
+    assert sorted(rows['stage']) == ['thread 0', 'thread 1'] and list(rows['count']) == [10, 10]
+
+
+def test_hdf5():
+    f = h5py.File('profile.hdf5', 'w', driver='core', backing_store=False)
+    profiler = enabled_profiler()
+    profiler.record('a', 0, .5)
+    profiler.toHDF5(f, 0)
+    profiler.record('a', 0, 1.5)
+    profiler.toHDF5(f, 0)
+    stored = f['profile'][()]
+    assert stored['stage'][0] == 'a' and stored['count'][0] == 2 and stored['total'][0] == 2
+    # nothing is written for an iteration without spans
+    profiler.toHDF5(f, 1, name='empty')
+    assert 'empty' not in f
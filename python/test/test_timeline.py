@@ -0,0 +1,153 @@
+import pytest
+import sys
+import numpy as np
+sys.path.append("..")
+import timeline
+
+
+def loop_digital(times, channels, states, scale, num_channels):
+    """The per-transition compilation that HSDIO and DAQmxDO used before timeline."""
+    indices = np.rint(np.asarray(times, dtype=np.float64)*scale).astype(np.uint64)
+    index_list = np.zeros(1, dtype=np.uint64)
+    state_list = np.zeros((1, num_channels), dtype=np.bool)
+    first = [-1]
+    for i in np.argsort(indices, kind='mergesort'):
+        if indices[i] == index_list[-1]:
+            state_list[-1][channels[i]] = states[i]
+        else:
+            index_list = np.append(index_list, indices[i])
+            state_list = np.append(state_list, state_list[-1, np.newaxis], axis=0)
+            state_list[-1, channels[i]] = states[i]
+            first.append(i)
+    return index_list, state_list, np.array(first)
+
+
+def loop_analog(times, channels, values, scale, num_channels):
+    """The per-transition compilation that AnalogOutput used before timeline."""
+    times = np.asarray(times, dtype=np.float64)
+    order = np.argsort(times, kind='mergesort')
+    total_samples = int(np.rint(times[order[-1]]*scale)+1)
+    value_list = np.zeros((total_samples, num_channels), dtype=np.float32)
+    for i in order:
+        index = np.rint(times[i]*scale).astype(np.uint64)
+        value_list[index:, channels[i]] = values[i]
+    return value_list, times[order]
+
+
+def random_transitions(n, num_channels, seed):
+    rng = np.random.RandomState(seed)
+    # coarse times so that there are plenty of ties, and some at time 0
+    times = rng.randint(0, n // 2, n) * .5
+    channels = rng.randint(0, num_channels, n).astype(np.uint8)
+    return times, channels, rng
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_digital_matches_loop(seed):
+    times, channels, rng = random_transitions(300, 32, seed)
+    states = rng.rand(300) > .5
+    expected = loop_digital(times, channels, states, 2., 32)
+    result = timeline.compile_digital(times, channels, states, 2., 32)
+    for e, r in zip(expected, result):
+        np.testing.assert_array_equal(r, e)
+    assert result[0].dtype == np.uint64
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_analog_matches_loop(seed):
+    times, channels, rng = random_transitions(200, 8, seed)
+    times += rng.rand(200) * .1
+    values = rng.randn(200).astype(np.float32)
+    expected_values, expected_times = loop_analog(times, channels, values, 10., 8)
+    result_values, result_times = timeline.compile_analog(times, channels, values, 10., 8)
+    np.testing.assert_array_equal(result_values, expected_values)
+    np.testing.assert_array_equal(result_times, expected_times)
+
+
+def test_latter_transition_wins_at_same_sample():
+    indices, states, first = timeline.compile_digital([1, 1.2, 1, 0], [0, 0, 1, 2], [True, False, True, True], 1, 3)
+    np.testing.assert_array_equal(indices, [0, 1])
+    np.testing.assert_array_equal(states, [[0, 0, 1], [0, 1, 1]])
+    # the second segment was started by the first transition at time 1
+    np.testing.assert_array_equal(first, [-1, 0])
+
+
+def test_analog_before_zero():
+    with pytest.raises(ValueError):
+        timeline.compile_analog([-1., 2.], [0, 0], [1., 2.], 1., 1)
+
+
+def test_segment_durations():
+    np.testing.assert_array_equal(timeline.segment_durations(np.array([0, 3, 10], dtype=np.uint64)), [3, 7, 1])
+
+
+@pytest.mark.parametrize('array', [
+    np.random.RandomState(0).rand(10, 300) > .5,
+    np.random.RandomState(0).randint(0, 10**12, 50).astype(np.uint64),
+    np.array([[0., -0., .1, 1e-7, np.nan, -2.5]], dtype=np.float32),
+])
+def test_serializer_matches_str(array):
+    rows = array if array.ndim > 1 else [array]
+    expected = '\n'.join(' '.join(str(sample) for sample in row) for row in rows)
+    serializer = timeline.CachedSerializer()
+    assert serializer.text(array) == expected
+    assert serializer.text(array.copy()) == expected
+    assert (serializer.hits, serializer.misses) == (1, 1)
+
+
+def test_serializer_sees_changes():
+    serializer = timeline.CachedSerializer(size=2)
+    a = np.zeros(4, dtype=np.uint8)
+    assert serializer.text(a) == '0 0 0 0'
+    a[1] = 1
+    assert serializer.text(a) == '0 1 0 0'
+    assert serializer.text(a.reshape(2, 2)) == '0 1\n0 0'
+    # the oldest entry was dropped
+    assert len(serializer.cache) == 2
+
+
+def test_buffer_append_and_extend():
+    buf = timeline.TransitionBuffer()
+    assert not buf
+    buf.append((0.5, 3, True))
+    buf.extend(np.arange(4) * .25, 7, [True, False, True, False])
+    buf.append((2, np.uint8(1), np.float32(.1)))
+    times, channels, values = buf.columns()
+    np.testing.assert_array_equal(times, [.5, 0, .25, .5, .75, 2])
+    np.testing.assert_array_equal(channels, [3, 7, 7, 7, 7, 1])
+    np.testing.assert_array_equal(values.astype(np.float32), np.array([1, 1, 0, 1, 0, .1], dtype=np.float32))
+    assert (times.dtype, channels.dtype) == (np.float64, np.uint8)
+    # the columns are copies, later appends don't change them
+    buf.extend(np.arange(1000.), 0, True)
+    assert len(times) == 6 and len(buf) == 1006
+    buf.clear()
+    assert len(buf) == 0 and buf.tags == []
+    buf.append((1, 2, 3))
+    np.testing.assert_array_equal(buf.columns()[1], [2])
+
+
+def test_buffer_tags_follow_segments():
+    buf = timeline.TransitionBuffer()
+    buf.append((0, 0, True))
+    buf.extend([1, 1.5, 2, 2.5], 1, [True, False, True, False])
+    cycle = {'repeats': 2}
+    buf.tag(1, 5, cycle)
+    buf.tag(5, 5, 'empty')
+    buf.append((3, 0, False))
+    positions = buf.tag_positions()
+    np.testing.assert_array_equal(positions, [-1, 0, 0, 0, 0, -1])
+    indices, states, first = timeline.compile_digital(*(buf.columns() + (2., 2)))
+    repeats = [-1] + [-1 if positions[i] < 0 else buf.tags[positions[i]][2] for i in first[1:]]
+    assert repeats == [-1, cycle, cycle, cycle, cycle, -1]
+
+
+def test_serializer_in_pool():
+    from multiprocessing import Pool
+    pool = Pool(1)
+    try:
+        array = np.random.RandomState(0).rand(3, 20).astype(np.float32)
+        serializer = timeline.CachedSerializer(pool=pool)
+        assert serializer.rows(array) == timeline.format_rows(array)
+        assert serializer.misses == 1
+    finally:
+        pool.terminate()
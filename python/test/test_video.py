@@ -0,0 +1,114 @@
+import pytest
+import sys
+import time
+import numpy as np
+sys.path.append("..")
+import video
+
+
+def test_latest_frame_keeps_newest():
+    slot = video.LatestFrame()
+    assert slot.take() is None
+    frame = np.zeros((4, 5), dtype=np.uint16)
+    for i in range(3):
+        frame[:] = i
+        slot.put(frame)
+    newest = slot.take()
+    assert (newest == 2).all()
+    assert slot.take() is None
+    assert slot.received == 3
+    assert slot.dropped == 2
+
+
+def test_latest_frame_does_not_alias():
+    slot = video.LatestFrame()
+    frame = np.zeros(3)
+    slot.put(frame)
+    taken = slot.take()
+    # the producer keeps writing while the consumer still holds its frame
+    frame[:] = 7
+    slot.put(frame)
+    assert (taken == 0).all()
+    assert taken is not frame
+    assert (slot.take() == 7).all()
+
+
+def test_latest_frame_shape_change():
+    slot = video.LatestFrame()
+    slot.put(np.zeros((2, 2)))
+    slot.put(np.ones((3, 3)))
+    assert slot.take().shape == (3, 3)
+
+
+@pytest.mark.parametrize('shape', [(10,), (1000, 1000), (3, 100000)])
+def test_downsampled(shape):
+    data = np.arange(np.prod(shape)).reshape(shape)
+    sample = video.downsampled(data, max_samples=1000)
+    assert sample.size <= 1000
+    assert np.may_share_memory(sample, data)
+
+
+class FakeCamera(object):
+    def __init__(self, frames):
+        self.frames = frames
+        self.data = np.zeros(2)
+        self.grabs = 0
+
+    def grab(self):
+        self.grabs += 1
+        if self.frames:
+            self.data[:] = self.frames.pop(0)
+            return True
+        return False
+
+
+def test_engine_renders_frames_and_backs_off():
+    camera = FakeCamera([1, 2, 3])
+    rendered = []
+    engine = video.VideoEngine('fake', camera.grab, lambda: camera.data,
+                               lambda frame: rendered.append(frame[0]),
+                               min_interval=.001, max_interval=.05)
+    engine.start()
+    time.sleep(.5)
+    engine.stop()
+    assert not engine.thread.is_alive()
+    assert rendered[-1] == 3
+    # with no new frames the polling interval grows to max_interval,
+    # so the camera is polled far less often than every min_interval
+    assert camera.grabs < 50
+
+
+def test_engine_uses_wait():
+    camera = FakeCamera([5])
+    waits = []
+
+    def wait(timeout):
+        waits.append(timeout)
+        time.sleep(.01)
+        return bool(camera.frames)
+
+    rendered = []
+    engine = video.VideoEngine('fake', camera.grab, lambda: camera.data,
+                               lambda frame: rendered.append(frame[0]), wait=wait)
+    engine.start()
+    time.sleep(.1)
+    engine.stop()
+    assert rendered == [5]
+    assert camera.grabs == 1
+
+
+def test_blitter_with_agg_canvas():
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure()
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    artist = ax.imshow(np.zeros((8, 8)), vmin=0, vmax=1)
+    blitter = video.Blitter([artist])
+    blitter.draw()  # first frame is a full draw that captures the background
+    assert blitter.background is not None
+    background = blitter.background
+    artist.set_data(np.ones((8, 8)))
+    blitter.draw()
+    assert blitter.background is background
+    assert blitter.canvas is canvas
@@ -0,0 +1,66 @@
+import pytest
+import sys
+import numpy as np
+import h5py
+sys.path.append("..")
+import zmq_instrument
+import blackfly
+from blackfly_standin_server import StandInServer
+
+
+def test_pack_unpack_roundtrip():
+    images = np.arange(24, dtype=np.uint16).reshape((2, 3, 4))
+    obj = {'status': 0, 'a': [1, images[:, ::2]], 'b': {'c': np.float32(2.5).item(), 'd': images}}
+    header, buffers = zmq_instrument.pack_arrays(obj)
+    assert len(buffers) == 2
+    out = zmq_instrument.unpack_arrays(zmq_instrument.json.loads(zmq_instrument.json.dumps(header)), buffers)
+    np.testing.assert_array_equal(out['a'][1], images[:, ::2])
+    np.testing.assert_array_equal(out['b']['d'], images)
+    assert out['b']['d'].dtype == np.uint16
+    assert out['a'][0] == 1
+
+
+def make_client(server):
+    client = blackfly.BlackflyClient('blackfly', None)
+    client.port = server.port
+    client.setup_socket()
+    client.enable = True
+    return client
+
+
+@pytest.fixture(params=[True, False], ids=['binary server', 'json server'])
+def server(request):
+    s = StandInServer(shape=(2, 6, 8), binary_supported=request.param)
+    yield s
+    s.stop()
+
+
+@pytest.fixture()
+def hdf5():
+    h5 = h5py.File('test_zmq.hdf5', 'w', driver='core', backing_store=False)
+    yield h5
+    h5.close()
+
+
+def test_acquire_and_write(server, hdf5):
+    client = make_client(server)
+    client.acquire_data()
+    assert server.requests[-1] == {'action': 'GET_RESULTS', 'binary': True}
+    client.writeResults(hdf5)
+    raw = hdf5['camera_data/1234/raw_data']
+    np.testing.assert_array_equal(raw[()], server.images)
+    assert hdf5['camera_data/1234/stats/mean'][()] == pytest.approx(server.images.mean())
+    client.close()
+
+
+def test_binary_results_are_views(hdf5):
+    server = StandInServer(shape=(1, 4, 4))
+    try:
+        client = make_client(server)
+        client.acquire_data()
+        data = client.results['camera_data']['1234']['data']
+        assert isinstance(data, np.ndarray)
+        assert not data.flags.owndata
+        client.close()
+    finally:
+        server.stop()
@@ -0,0 +1,98 @@
+import pytest
+import sys
+import time
+sys.path.append("..")
+import zmq_instrument
+from cs_errors import PauseError
+from blackfly_standin_server import StandInServer
+
+
+@pytest.fixture()
+def server():
+    s = StandInServer(shape=(1, 2, 2))
+    yield s
+    s.stop()
+
+
+def make_client(server, timeout=1.0):
+    client = zmq_instrument.ZMQInstrument('zmq', None)
+    client.timeout = timeout
+    client.port = server.port
+    client.update_socket()
+    client.enable = True
+    return client
+
+
+def test_send_json(server):
+    client = make_client(server)
+    assert client.send_json({'action': 'ECHO'}) == {'status': 0}
+    client.close()
+
+
+def test_start_does_not_block(server):
+    server.delays['START'] = 0.3
+    client = make_client(server)
+    t = time.time()
+    client.start()
+    assert time.time() - t < 0.2
+    assert not client.isDone
+    client.start_request.done.wait(2)
+    assert client.isDone
+    assert not client.error
+    client.close()
+
+
+def test_concurrent_requests_to_several_servers():
+    servers = [StandInServer(shape=(1, 2, 2)) for _ in range(3)]
+    try:
+        clients = [make_client(s) for s in servers]
+        for s in servers:
+            s.delays['UPDATE'] = 0.3
+        t = time.time()
+        requests = [c.update_async() for c in clients]
+        for c, r in zip(clients, requests):
+            assert c.check_response(r.result()) == {'status': 0}
+        assert time.time() - t < 0.6
+        for c in clients:
+            c.close()
+    finally:
+        for s in servers:
+            s.stop()
+
+
+def test_timeout_resets_socket(server):
+    server.delays['ECHO'] = 0.5
+    client = make_client(server, timeout=0.2)
+    # a timed out request returns an empty response, as before
+    assert client.send_json({'action': 'ECHO'}) == {}
+    time.sleep(0.5)
+    # the socket was reset, so the next request is answered normally and the
+    # late reply to the first request is not mistaken for it
+    server.delays['ECHO'] = 0
+    assert client.send_json({'action': 'GET_CAMERAS'}) == {'status': 0, 'cameras': [1234]}
+    client.close()
+
+
+def test_closed_socket_pauses(server):
+    client = make_client(server)
+    client.close_socket()
+    with pytest.raises(PauseError):
+        client.send_json({'action': 'ECHO'})
+    client.context.term()
+
+
+def test_unserializable_request_pauses(server):
+    client = make_client(server)
+    with pytest.raises(PauseError):
+        client.send_json({'action': 'UPDATE', 'settings': {'values': object()}})
+    # the poller thread survives, and the next request is answered
+    assert client.poller_thread.is_alive()
+    assert client.send_json({'action': 'ECHO'}) == {'status': 0}
+    client.close()
+
+
+def test_result_wait_is_bounded():
+    request = zmq_instrument.ZMQRequest('1', {'action': 'ECHO'}, timeout=0.1)
+    t = time.time()
+    assert request.result() == {}
+    assert time.time() - t < 2
@@ -0,0 +1,241 @@
+"""timeline.py
+Part of the CsPyController experiment control software
+
+created = 2026.10.19
+
+Compiles the (time, channel, value) transitions requested by the functional
+waveforms into the sample-indexed segments that the output cards are
+programmed with, shared by HSDIO, DAQmxDO and AnalogOutput.  The compilation
+is a vectorized sort, group and forward-fill, instead of a python loop that
+grows the output arrays one transition at a time.  Hardware specific details
+(HSDIO repeats, the DAQmx two sample minimum) stay with the instruments.
+
+TransitionBuffer collects the transitions as the waveforms are evaluated, in
+one compact float64 array instead of a list of tuples.
+
+CachedSerializer turns the compiled arrays into the text sent to LabView, and
+reuses the text when the same arrays come up again, which is the usual case
+from one iteration to the next.  Formatting is the one step that holds the
+python interpreter lock throughout, so it can be handed to a process pool,
+since its inputs are plain arrays.
+"""
+
+from __future__ import division
+import logging
+import hashlib
+import array
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class TransitionBuffer(object):
+    """A growable store of (time, channel, value) transitions.
+
+    The transitions are kept as consecutive float64 triples in a stdlib array, which grows geometrically (amortized
+    O(1) appends) and takes 24 bytes per transition instead of a tuple of python objects.  append((time, channel,
+    value)) is the array's own extend method, so a single transition costs no more than appending a tuple to a list.
+    Whole pulse trains can be added at once from numpy arrays with extend().  Contiguous ranges of transitions can be
+    tagged, as HSDIO does for repeats.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forget all transitions and tags."""
+        self._data = array.array('d')
+        self.append = self._data.extend
+        self.generation = getattr(self, 'generation', 0) + 1
+        self.tags = []  # (start, stop, tag) for each tagged range of transitions
+
+    def __len__(self):
+        return len(self._data) // 3
+
+    def state(self):
+        """A key that changes whenever transitions are cleared or added."""
+        return self.generation, len(self._data), len(self.tags)
+
+    def extend(self, times, channels, values):
+        """Append many transitions at once.  Scalar arguments are broadcast against the arrays."""
+        times, channels, values = np.broadcast_arrays(times, channels, values)
+        rows = np.empty((times.size, 3), dtype=np.float64)
+        rows[:, 0] = times.ravel()
+        rows[:, 1] = channels.ravel()
+        rows[:, 2] = values.ravel()
+        self._data.fromstring(rows.tostring())
+
+    def tag(self, start, stop, tag):
+        """Mark transitions [start, stop) with tag.  Ranges should not overlap."""
+        if stop > start:
+            self.tags.append((start, stop, tag))
+
+    def columns(self):
+        """The times (float64), channels (uint8) and values (float64) as numpy arrays."""
+        # copy, because the array storage moves when it grows
+        rows = np.frombuffer(self._data, dtype=np.float64).reshape((-1, 3)).copy()
+        return rows[:, 0], rows[:, 1].astype(np.uint8), rows[:, 2]
+
+    def tag_positions(self):
+        """For each transition, its position in self.tags, or -1 if it is not tagged."""
+        positions = np.full(len(self), -1, dtype=np.int64)
+        for i, (start, stop, tag) in enumerate(self.tags):
+            positions[start:stop] = i
+        return positions
+
+
+def last_per_cell(rows, columns, n_columns):
+    """For each (row, column) cell that appears, the position of its last appearance.
+
+    Returns (rows, columns, positions) with one entry per distinct cell.
+    """
+    key = rows.astype(np.int64) * n_columns + columns
+    # the first occurrence in the reversed keys is the last occurrence in the keys
+    unique_keys, reversed_positions = np.unique(key[::-1], return_index=True)
+    positions = len(key) - 1 - reversed_positions
+    return unique_keys // n_columns, unique_keys % n_columns, positions
+
+
+def forward_fill(rows, columns, positions, shape):
+    """An array of the given shape holding, at each cell, the position set at or above it in the same column, or -1.
+
+    Positions must not decrease with increasing row, which holds when the transitions are sorted by time.
+    """
+    # int32 positions keep the grid small for long analog waveforms
+    filled = np.full(shape, -1, dtype=np.int32)
+    filled[rows, columns] = positions
+    return np.maximum.accumulate(filled, axis=0)
+
+
+def compile_digital(times, channels, states, samples_per_unit, num_channels):
+    """Compile digital transitions into segments.
+
+    :param times: array of transition times, in units such that times*samples_per_unit is a sample index
+    :param channels: array of channel numbers
+    :param states: array of bools, the state each channel goes to
+    :param samples_per_unit: the sample clock rate times the time units
+    :param num_channels: the number of channels on the card
+    :return: (indices, states, first) where indices are the uint64 sample indices at which the output changes,
+        starting with 0, states has one row of channel states per index, and first gives, for each index after 0,
+        the position in the original transitions of the first transition at that index (-1 for index 0).  All
+        channels start low.  Transitions at the same sample are applied in the order they were added, so the latter
+        one wins.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    channels = np.asarray(channels, dtype=np.uint8)
+    states = np.asarray(states, dtype=np.bool)
+    # convert the float time to an integer number of samples
+    indices = np.rint(times * samples_per_unit).astype(np.uint64)
+    # sort the transitions by time.  If there is a tie, preserve the order.
+    # mergesort is 'stable', which means items of the same value are kept in their relative order
+    order = np.argsort(indices, kind='mergesort')
+    sorted_indices = indices[order]
+
+    # one segment for the initial state at sample 0, and one for every later sample that has a transition
+    segment_indices, first_in_segment = np.unique(np.concatenate(([0], sorted_indices)).astype(np.uint64),
+                                                  return_index=True)
+    segment = np.searchsorted(segment_indices, sorted_indices)
+
+    # each channel holds the state of its latest transition at or before each segment
+    rows, columns, positions = last_per_cell(segment, channels[order], num_channels)
+    filled = forward_fill(rows, columns, positions, (len(segment_indices), num_channels))
+    sorted_states = states[order]
+    segment_states = np.zeros(filled.shape, dtype=np.bool)
+    has_state = filled >= 0
+    segment_states[has_state] = sorted_states[filled[has_state]]
+
+    # the first transition that created each segment, in the original order (the initial segment was not created
+    # by a transition)
+    first = np.full(len(segment_indices), -1, dtype=np.int64)
+    first[1:] = order[first_in_segment[1:] - 1]
+    return segment_indices, segment_states, first
+
+
+def compile_analog(times, channels, values, samples_per_unit, num_channels):
+    """Compile analog transitions into one row of channel values per sample.
+
+    Each channel holds the value of its latest transition until the next one, starting at 0.  The output runs up to
+    and including the sample of the last transition.  Transitions are sorted by time, and for equal times they are
+    applied in the order they were added.
+    :return: (samples, sorted_times) where samples is a float32 array of shape (samples, num_channels)
+    """
+    times = np.asarray(times, dtype=np.float64)
+    channels = np.asarray(channels, dtype=np.uint8)
+    values = np.asarray(values, dtype=np.float32)
+    order = np.argsort(times, kind='mergesort')
+    sorted_times = times[order]
+    # evaluate the sample index equivalent to each transition time
+    indices = np.rint(sorted_times * samples_per_unit).astype(np.int64)
+    if np.any(indices < 0):
+        raise ValueError('Analog output transition before time 0.')
+    total_samples = int(indices[-1]) + 1
+
+    rows, columns, positions = last_per_cell(indices, channels[order], num_channels)
+    filled = forward_fill(rows, columns, positions, (total_samples, num_channels))
+    samples = np.zeros(filled.shape, dtype=np.float32)
+    has_value = filled >= 0
+    samples[has_value] = values[order][filled[has_value]]
+    return samples, sorted_times
+
+
+def segment_durations(indices):
+    """The number of samples in each segment, with a 1 sample duration for the last one."""
+    durations = np.empty_like(indices)
+    durations[:-1] = indices[1:] - indices[:-1]
+    durations[-1:] = 1
+    return durations
+
+
+class CachedSerializer(object):
+    """Formats arrays as text rows, remembering the text for the most recent arrays.
+
+    Each element is formatted with str(), exactly as a loop over the numpy elements would, but each distinct value is
+    only formatted once.  If pool is set to a multiprocessing pool, new arrays are formatted in one of its processes,
+    which lets several instruments format at once from their own threads.
+    """
+
+    def __init__(self, size=8, pool=None):
+        self.size = size
+        self.pool = pool
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def rows(self, array, separator=' '):
+        """A list with one string per row of a 2D array (or a single row for a 1D array), elements joined by
+        separator."""
+        array = np.ascontiguousarray(array)
+        key = (array.dtype.str, array.shape, separator, hashlib.sha1(array).hexdigest())
+        if key in self.cache:
+            self.hits += 1
+            rows = self.cache.pop(key)
+        else:
+            self.misses += 1
+            if self.pool is None:
+                rows = format_rows(array, separator)
+            else:
+                rows = self.pool.apply(format_rows, (array, separator))
+            if len(self.cache) >= self.size:
+                self.cache.popitem(last=False)
+        # most recently used entries go to the end
+        self.cache[key] = rows
+        return rows
+
+    def text(self, array, separator=' ', row_separator='\n'):
+        return row_separator.join(self.rows(array, separator))
+
+
+def format_rows(array, separator=' '):
+    array = np.asarray(array)
+    if array.ndim < 2:
+        array = array.reshape((1, -1))
+    if array.size == 0:
+        return [''] * array.shape[0]
+    flat = array.ravel()
+    # group floats by their bits, so that -0.0 and 0.0 (or different nans) keep their own strings
+    keys = flat.view('u{}'.format(flat.dtype.itemsize)) if flat.dtype.kind == 'f' else flat
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    strings = np.array([str(u) for u in flat[first]], dtype=object)
+    return [separator.join(row) for row in strings[inverse].reshape(array.shape).tolist()]
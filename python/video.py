@@ -0,0 +1,214 @@
+"""video.py
+Part of the CsPyController experiment control software
+
+created = 2026.10.19
+
+Video mode engine shared by the camera and scope instruments.
+
+A producer thread grabs frames from the instrument, either by blocking on the
+SDK's new-image event (wait) or by polling with an interval that adapts to how
+often new data actually shows up.  Frames go into a single-slot LatestFrame
+buffer, so the producer never waits on the GUI.  Rendering is scheduled on the
+GUI thread with deferred_call, at most one render at a time; frames that arrive
+while a render is pending are dropped, and only the newest one is drawn.
+"""
+
+from __future__ import division
+import logging
+import threading
+import time
+
+import numpy
+from enaml.application import deferred_call
+
+logger = logging.getLogger(__name__)
+
+
+class LatestFrame(object):
+    """A single-slot frame buffer between one producer and one consumer.
+
+    put() copies a frame in, replacing any frame that was not yet taken.
+    take() returns the newest frame, or None if nothing new arrived since the
+    last take().  Three preallocated buffers are rotated (triple buffering), so
+    the producer never writes into the array the consumer is reading, and no
+    memory is allocated per frame.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.back = None  # being written by the producer
+        self.ready = None  # the newest complete frame
+        self.front = None  # being read by the consumer
+        self.fresh = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        frame = numpy.asarray(frame)
+        if (self.back is None) or (self.back.shape != frame.shape) or (self.back.dtype != frame.dtype):
+            with self.lock:
+                self.back = numpy.empty_like(frame)
+                self.ready = numpy.empty_like(frame)
+                self.front = numpy.empty_like(frame)
+                self.fresh = False
+        numpy.copyto(self.back, frame)
+        with self.lock:
+            self.back, self.ready = self.ready, self.back
+            if self.fresh:
+                self.dropped += 1
+            self.fresh = True
+            self.received += 1
+
+    def take(self):
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.front, self.ready = self.ready, self.front
+            self.fresh = False
+            return self.front
+
+
+class VideoEngine(object):
+    """Runs video mode for one instrument.
+
+    grab() updates the instrument's frame buffer and returns True if there is a
+    new frame, frame() returns that buffer, and render(frame) draws it on the
+    GUI thread.  If wait(timeout) is given, it should block until the
+    instrument reports a new frame or timeout seconds pass, returning True on a
+    new frame; otherwise grab() is polled adaptively between min_interval and
+    max_interval seconds.
+    """
+
+    def __init__(self, name, grab, frame, render, wait=None, min_interval=.005, max_interval=.1):
+        self.name = name
+        self.grab = grab
+        self.frame = frame
+        self.render = render
+        self.wait = wait
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.frames = LatestFrame()
+        self.lock = threading.Lock()
+        self.render_pending = False
+        self.rendered = 0
+        self.fps = 0.0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        self.stopped.set()
+        if (self.thread is not None) and (self.thread is not threading.current_thread()):
+            self.thread.join(timeout)
+        logger.debug('{} video stopped: {} frames received, {} dropped, {} rendered'.format(
+            self.name, self.frames.received, self.frames.dropped, self.rendered))
+
+    def run(self):
+        interval = self.max_interval
+        last = None
+        while not self.stopped.is_set():
+            try:
+                if self.wait is not None:
+                    new = self.wait(self.max_interval) and self.grab()
+                else:
+                    new = self.grab()
+                if new:
+                    self.frames.put(self.frame())
+                    self.request_render()
+            except Exception:
+                logger.exception('Problem in {} video mode.'.format(self.name))
+                break
+            if new:
+                now = time.time()
+                if last is not None:
+                    # exponential moving average of the frame rate
+                    self.fps = .9 * self.fps + .1 / max(now - last, 1e-6)
+                last = now
+                interval = max(self.min_interval, interval / 2)
+            else:
+                interval = min(self.max_interval, interval * 2)
+            if self.wait is None:
+                self.stopped.wait(interval)
+
+    def request_render(self):
+        with self.lock:
+            if self.render_pending:
+                return  # the pending render will pick up the newest frame
+            self.render_pending = True
+        try:
+            deferred_call(self.render_latest)
+        except RuntimeError:  # application not started yet
+            self.render_latest()
+
+    def render_latest(self):
+        with self.lock:
+            self.render_pending = False
+        frame = self.frames.take()
+        if frame is None:
+            return
+        try:
+            self.render(frame)
+            self.rendered += 1
+        except Exception:
+            logger.exception('Problem rendering {} video frame.'.format(self.name))
+
+
+def downsampled(data, max_samples=16384):
+    """Returns a strided view of data with at most max_samples elements, for
+    cheap pixel statistics."""
+    data = numpy.asarray(data)
+    if data.size <= max_samples:
+        return data
+    step = int(numpy.ceil(data.size / max_samples))
+    # ravel is a view for the contiguous frame buffers used in video mode
+    return data.ravel()[::step]
+
+
+class Blitter(object):
+    """Redraws a few animated artists over a cached background, instead of
+    redrawing the whole figure for every video frame.
+
+    The background is captured on every full draw of the canvas (the first
+    frame, resizes), which leaves the animated artists out.  Canvases that
+    cannot copy regions fall back to full draws.
+    """
+
+    def __init__(self, artists):
+        self.artists = list(artists)
+        self.axes = self.artists[0].axes
+        self.canvas = None
+        self.background = None
+        self.supported = True
+        for artist in self.artists:
+            artist.set_animated(True)
+
+    def on_draw(self, event):
+        try:
+            self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        except (AttributeError, NotImplementedError):
+            self.supported = False
+            for artist in self.artists:
+                artist.set_animated(False)
+            return
+        for artist in self.artists:
+            self.axes.draw_artist(artist)
+
+    def draw(self):
+        canvas = self.axes.figure.canvas
+        if canvas is not self.canvas:
+            # the figure was (re)attached to a canvas
+            self.canvas = canvas
+            self.background = None
+            canvas.mpl_connect('draw_event', self.on_draw)
+        if (self.background is None) or not self.supported:
+            canvas.draw()
+            return
+        canvas.restore_region(self.background)
+        for artist in self.artists:
+            self.axes.draw_artist(artist)
+        canvas.blit(self.axes.bbox)
@@ -10,9 +10,21 @@ instrument servers. In an effort to distribute computational load instruments
 can be designed to do basic analysis. Since the server is running in a different
 process this can improve performance, but analysis dependencies must be
 appropriately handled.
+
+The client talks to the (REP) servers through a DEALER socket owned by a
+poller thread, so several requests can be in flight at once and callers get a
+ZMQRequest to wait on.  Each request is sent with its id as an envelope frame,
+which a REP socket echoes back, so replies are matched to requests without any
+change to the servers.
 """
 
 import logging
+import itertools
+import json
+import threading
+import time
+import Queue
+import numpy as np
 import zmq
 from cs_errors import PauseError
 from cs_instruments import Instrument
@@ -23,6 +35,133 @@ from instrument_property import ListProp
 __author__ = 'Matthew Ebert'
 logger = logging.getLogger(__name__)
 
+# key marking a placeholder for a numpy array sent as a separate message part
+ARRAY_KEY = '__ndarray__'
+
+
+def pack_arrays(obj):
+    """Replace the numpy arrays in a JSON-able object with placeholders.
+
+    Returns (obj, buffers).  Each placeholder records the index of its array in
+    buffers, and the dtype and shape needed to rebuild it.  The buffers are sent
+    as raw message parts after the JSON header, so images do not have to be
+    converted to nested lists and back.
+    """
+    buffers = []
+
+    def pack(o):
+        if isinstance(o, np.ndarray):
+            buffers.append(np.ascontiguousarray(o))
+            return {ARRAY_KEY: len(buffers) - 1, 'dtype': o.dtype.str, 'shape': list(o.shape)}
+        if isinstance(o, dict):
+            return {k: pack(v) for k, v in o.iteritems()}
+        if isinstance(o, (list, tuple)):
+            return [pack(v) for v in o]
+        return o
+
+    return pack(obj), buffers
+
+
+def unpack_arrays(obj, frames):
+    """Undo pack_arrays: replace placeholders with numpy arrays that are
+    read-only views on the received message frames (no copy)."""
+
+    def unpack(o):
+        if isinstance(o, dict):
+            if ARRAY_KEY in o:
+                frame = frames[o[ARRAY_KEY]]
+                return np.frombuffer(frame, dtype=np.dtype(str(o['dtype']))).reshape(o['shape'])
+            return {k: unpack(v) for k, v in o.iteritems()}
+        if isinstance(o, list):
+            return [unpack(v) for v in o]
+        return o
+
+    return unpack(obj)
+
+
+def send_binary(sock, obj):
+    """Send obj as a JSON header followed by its numpy arrays as raw parts.
+
+    This is the server side of ZMQInstrument.send_json(obj, binary=True).
+    """
+    header, buffers = pack_arrays(obj)
+    sock.send_multipart([json.dumps(header)] + buffers, copy=False)
+
+
+class ZMQRequest(object):
+    """A request sent by ZMQInstrument, completed by its poller thread.
+
+    result() waits for the reply and returns the decoded response.
+    Callbacks added with add_done_callback run on the poller thread.
+    """
+
+    def __init__(self, request_id, obj, binary=False, timeout=None):
+        self.id = request_id
+        self.obj = obj
+        self.binary = binary
+        self.timeout = timeout  # the instrument's reply timeout, which the poller thread enforces
+        self.deadline = None  # set by the poller thread when sent
+        self.frames = None
+        self.error = None
+        self.timed_out = False
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.callbacks = []
+
+    def set_reply(self, frames):
+        self.frames = frames
+        self.finish()
+
+    def set_error(self, error, timed_out=False):
+        self.error = error
+        self.timed_out = timed_out
+        self.finish()
+
+    def finish(self):
+        with self.lock:
+            self.done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception('Exception in ZMQRequest callback.')
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def result(self, timeout=None):
+        """Return the decoded response.
+
+        A request that timed out returns {} with a warning, as the blocking
+        client did.  Other failures raise PauseError.  By default this waits a
+        little longer than the reply timeout, so that a caller is not stuck if
+        the poller thread never completes the request.
+        """
+        if (timeout is None) and (self.timeout is not None):
+            timeout = self.timeout + 1.0
+        if not self.done.wait(timeout):
+            logger.warning('Waiting for `{}` reply timed out.'.format(self.obj.get('action')))
+            return {}
+        if self.timed_out:
+            logger.warning('Receiving msg timed out.')
+            return {}
+        if self.error is not None:
+            logger.error('ZMQ request `{}` failed: {}'.format(self.obj.get('action'), self.error))
+            raise PauseError
+        try:
+            resp = json.loads(self.frames[0].bytes)
+            if self.binary:
+                resp = unpack_arrays(resp, self.frames[1:])
+        except Exception:
+            logger.exception('Could not decode reply to `{}`.'.format(self.obj.get('action')))
+            raise PauseError
+        return resp
+
 
 class ZMQListProp(ListProp):
     """It is necessary to redefine the HardwareProtocol method of ListProp"""
@@ -54,8 +193,15 @@ class ZMQInstrument(Instrument, Analysis):
     connected = Bool(False)
     msg = Str()
     results = Member()
-    sock = Member()
+    sock = Member()  # the DEALER socket, only touched by the poller thread
+    outbox = Member()  # commands for the poller thread
+    wake = Member()  # inproc PUSH socket that wakes the poller thread
+    wake_lock = Member()
+    poller_thread = Member()
+    request_ids = Member()
+    start_request = Member()
     timeout = Float(2.0)
+    binaryTransport = Bool(False)  # ask for numpy arrays as raw message parts
     error = Bool(False)
     log = Str()
 
@@ -63,21 +209,35 @@ class ZMQInstrument(Instrument, Analysis):
         """Initialize the class."""
         super(ZMQInstrument, self).__init__(name, experiment, description)
         self.results = {}
+        self.request_ids = itertools.count()
+        self.wake_lock = threading.Lock()
         self.setup_socket()
-        self.properties += ['IP', 'port', 'timeout']
-        self.doNotSendToHardware += ['IP', 'port', 'timeout']
+        self.properties += ['IP', 'port', 'timeout', 'binaryTransport']
+        self.doNotSendToHardware += ['IP', 'port', 'timeout', 'binaryTransport']
 
     def acquire_data(self):
         """Retrieve data from the server."""
-        self.results = self.send_json({
+        self.collect_results(self.request_results())
+
+    def request_results(self):
+        """Ask the server for results without waiting for them, so that the
+        experiment can ask several servers at once (see collect_results)."""
+        return self.request({
             'action': 'GET_RESULTS'
-        })
+        }, binary=self.binaryTransport)
+
+    def collect_results(self, request):
+        """Wait for the reply to request_results()."""
+        if self.error:
+            logger.error('`{}` server did not start the measurement.'.format(self.name))
+            raise PauseError
+        self.results = self.check_response(request.result())
 
     def close_socket(self):
         """Close the socket."""
         logger.info("Socket is being closed, disabling device.")
         self.enable = False
-        self.sock.close()
+        self.stop_poller()
         self.connected = False
         self.isInitialized = False
 
@@ -121,47 +281,197 @@ class ZMQInstrument(Instrument, Analysis):
                 self.isInitialized = False
                 raise PauseError
 
-    def send_json(self, obj):
-        """Send a dictionary object with JSON formatting to the server.
+    def request(self, obj, binary=False):
+        """Send a dictionary object with JSON formatting to the server without
+        waiting for the reply.  Returns a ZMQRequest.
 
-        Expects a JSON response with response['status'] == 0 for no error.
+        If binary is True the server is asked to send numpy arrays as raw
+        message parts after a JSON header (see send_binary).
         """
-        try:
-            self.sock.send_json(obj)
-            resp = self.sock.recv_json()
-        except zmq.ZMQError as e:
-            if e.errno == zmq.EAGAIN:
-                logger.warning('Receiving msg timed out.')
-                return {}
-            else:
-                msg = 'ZMQInstrument.send_json failed for `{}`.'
-                logger.exception(msg.format(self.name))
-                raise PauseError
-        except:
-            msg = 'ZMQInstrument.send_json failed for `{}`.'
-            logger.exception(msg.format(self.name))
-            raise PauseError
+        if binary:
+            obj = dict(obj, binary=True)
+        request = ZMQRequest(str(next(self.request_ids)), obj, binary, self.timeout)
+        if (self.poller_thread is None) or not self.poller_thread.is_alive():
+            request.set_error('socket is closed')
+            return request
+        self.outbox.put(('send', request))
+        self.wake_poller()
+        return request
 
-        # check the response status
-        if resp['status'] != 0:
+    def check_response(self, resp):
+        """Expects a JSON response with response['status'] == 0 for no
+        error.  An empty response means the request timed out."""
+        if resp and resp['status'] != 0:
             msg = 'ZMQInstrument.send_json failed for `{}`. Server resp:\n{}'
-            logger.exception(msg.format(self.name, resp['message']))
+            logger.error(msg.format(self.name, resp['message']))
             raise PauseError
         return resp
 
+    def send_json(self, obj, binary=False):
+        """Send a dictionary object with JSON formatting to the server and
+        wait for the response.
+
+        Expects a JSON response with response['status'] == 0 for no error.
+        """
+        return self.check_response(self.request(obj, binary).result())
+
     def setup_socket(self):
-        """Set up basic client socket."""
-        self.context = zmq.Context()
-        # set up a request socket as the client
-        self.sock = self.context.socket(zmq.REQ)
+        """Set up the client socket and the poller thread that owns it."""
+        self.stop_poller()
+        if self.context is None:
+            self.context = zmq.Context()
+        self.outbox = Queue.Queue()
+        wake_addr = 'inproc://zmq_instrument_{}_{}'.format(id(self), next(self.request_ids))
+        # the PULL end must be bound before the PUSH end connects on inproc
+        pull = self.context.socket(zmq.PULL)
+        pull.bind(wake_addr)
+        self.wake = self.context.socket(zmq.PUSH)
+        self.wake.setsockopt(zmq.LINGER, 0)
+        self.wake.connect(wake_addr)
+        self.poller_thread = threading.Thread(
+            target=self.poll_loop,
+            args=(pull,),
+            name='{}_zmq_poller'.format(self.name)
+        )
+        self.poller_thread.daemon = True
+        self.poller_thread.start()
         self.update_socket()
         self.isInitialized = True
 
+    def stop_poller(self):
+        """Stop the poller thread, which closes the socket."""
+        if (self.poller_thread is not None) and self.poller_thread.is_alive():
+            self.outbox.put(('stop', None))
+            self.wake_poller()
+            self.poller_thread.join()
+        if self.wake is not None:
+            self.wake.close()
+            self.wake = None
+        self.poller_thread = None
+
+    def wake_poller(self):
+        with self.wake_lock:
+            if self.wake is not None:
+                self.wake.send(b'')
+
+    def reset_socket(self):
+        """Replace the DEALER socket.  Runs on the poller thread."""
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = self.context.socket(zmq.DEALER)
+        # drop unanswered requests on close, otherwise terminating the
+        # context blocks forever when the server was unreachable
+        self.sock.setsockopt(zmq.LINGER, 0)
+        if self.current_addr:
+            self.sock.connect(self.current_addr)
+
+    def poll_loop(self, pull):
+        """Send queued requests and match replies to them by request id.
+
+        A request that is not answered within timeout seconds fails, and the
+        socket is reset so that a hung server does not leave it stuck.
+        """
+        pending = {}
+        self.reset_socket()
+        poller = zmq.Poller()
+        poller.register(pull, zmq.POLLIN)
+        poller.register(self.sock, zmq.POLLIN)
+        running = True
+        try:
+            while running:
+                now = time.time()
+                wait = 100
+                if pending:
+                    deadline = min(r.deadline for r in pending.itervalues())
+                    wait = min(wait, max(0, int((deadline - now) * 1000)))
+                events = dict(poller.poll(wait))
+
+                if pull in events:
+                    while pull.poll(0):
+                        pull.recv()
+                    while True:
+                        try:
+                            command, request = self.outbox.get_nowait()
+                        except Queue.Empty:
+                            break
+                        if command == 'send':
+                            try:
+                                self.sock.send_multipart([request.id, b'', json.dumps(request.obj)])
+                            except Exception as e:
+                                # e.g. settings that are not json serializable
+                                request.set_error('could not send request: {}'.format(e))
+                            else:
+                                request.deadline = time.time() + self.timeout
+                                pending[request.id] = request
+                        elif command == 'reset':
+                            poller.unregister(self.sock)
+                            self.fail_all(pending, 'socket reset')
+                            self.reset_socket()
+                            poller.register(self.sock, zmq.POLLIN)
+                        elif command == 'stop':
+                            running = False
+
+                if self.sock in events:
+                    while self.sock.poll(0):
+                        frames = self.sock.recv_multipart(copy=False)
+                        request = pending.pop(frames[0].bytes, None)
+                        if request is None:
+                            logger.debug('Dropping late reply on `{}` socket.'.format(self.name))
+                        else:
+                            # frames[1] is the empty delimiter echoed by REP
+                            request.set_reply(frames[2:])
+
+                now = time.time()
+                expired = [r for r in pending.itervalues() if r.deadline <= now]
+                if expired:
+                    for request in expired:
+                        del pending[request.id]
+                        request.set_error('timed out', timed_out=True)
+                    logger.warning('`{}` server did not answer within {} s, resetting socket.'.format(self.name, self.timeout))
+                    poller.unregister(self.sock)
+                    self.fail_all(pending, 'socket reset after a timeout')
+                    self.reset_socket()
+                    poller.register(self.sock, zmq.POLLIN)
+        except Exception:
+            logger.exception('`{}` poller thread failed.'.format(self.name))
+            self.fail_all(pending, 'poller thread failed')
+
+        self.fail_all(pending, 'socket closed')
+        # requests queued after the loop ended would never be sent
+        while True:
+            try:
+                command, request = self.outbox.get_nowait()
+            except Queue.Empty:
+                break
+            if command == 'send':
+                request.set_error('socket closed')
+        self.sock.close()
+        self.sock = None
+        pull.close()
+
+    def fail_all(self, pending, error):
+        for request in pending.itervalues():
+            request.set_error(error)
+        pending.clear()
+
     def start(self):
-        """Send software trigger."""
-        self.send_json({
+        """Send software trigger.
+
+        Does not wait for the reply: isDone is set when it arrives, so the
+        experiment can start the other instruments meanwhile.
+        """
+        self.error = False
+        self.isDone = False
+        self.start_request = self.request({
             'action': 'START'
         })
+        self.start_request.add_done_callback(self.start_done)
+
+    def start_done(self, request):
+        try:
+            self.check_response(request.result())
+        except PauseError:
+            self.error = True
         self.isDone = True
 
     def toHardware(self):
@@ -194,28 +504,24 @@ class ZMQInstrument(Instrument, Analysis):
     def update(self):
         """Send update command to hardware with settings."""
         if self.enable:
-            logger.info('updating settings')
-            self.send_json({
-                'action': 'UPDATE',
-                'settings': self.toHardware()
-            })
+            self.check_response(self.update_async().result())
+
+    def update_async(self):
+        """Send the update command without waiting for the reply, so the
+        experiment can update several servers at once."""
+        logger.info('updating settings')
+        return self.request({
+            'action': 'UPDATE',
+            'settings': self.toHardware()
+        })
 
     def update_socket(self):
         """Close and reopen socket with new settings."""
-        addr = "{}://{}:{}".format(self.transport, self.IP, self.port)
-        if self.current_addr != addr:
-            try:
-                self.sock.disconnect(self.current_addr)
-            except zmq.ZMQError as e:
-                if e.errno != zmq.EINVAL:
-                    logger.exception("Unexpected error during disconnect.")
-
-        # set timeout in ms
-        self.sock.setsockopt(zmq.RCVTIMEO, int(self.timeout*1000))
         # zmq doesn't make an actual connection until you start sending data
         # so this is more of a formality
-        self.sock.connect(addr)
-        self.current_addr = addr
+        self.current_addr = "{}://{}:{}".format(self.transport, self.IP, self.port)
+        self.outbox.put(('reset', None))
+        self.wake_poller()
 
     def writeResults(self, hdf5):
         """Write the previously obtained results to the experiment hdf5 file.